@@ -0,0 +1,274 @@
+# analysis.py finds quantities that would otherwise be read off by hand from many runs of the simulator,
+# using short headless simulations from engine.py
+import math
+import statistics
+import time
+import engine
+
+# Highest stopping voltage in V searched for before giving up
+MAX_VOLTAGE = 100
+# Particle budget of probe runs when the config doesn't give one, so they see enough photons quickly
+PROBE_BUDGET = 2000
+# Quantities precise can aim for. Each is a function of an engine returning a total, what it is divided by and the
+# number of simulated electrons behind it, so the quantity over any part of a run is the change in the first over
+# the change in the second
+PRECISE_QUANTITIES = {
+    # The current in A, the charge of the electrons counted over the seconds simulated. With the field electrons are
+    # only counted once they reach the other plate
+    "current": lambda simulation: ((simulation.real_collected if simulation.field else simulation.real_electrons)
+                                   * engine.CHARGE, simulation.time,
+                                   simulation.electrons_collected if simulation.field
+                                   else simulation.electrons_emitted),
+    # The mean speed in m/s of the electrons emitted, their total speed over their number
+    "speed": lambda simulation: (simulation.stats.speed.mean * simulation.stats.speed.weight,
+                                 simulation.stats.speed.weight, simulation.electrons_emitted),
+}
+# Fewest simulated electrons precise counts before it trusts an interval, so it never stops on a handful of them
+PRECISE_EVENTS = 100
+
+
+# Runs the simulation in config with a stopping voltage until it is known whether there is a current, and returns
+# the engine. There is a current if any electron is emitted
+# Zero current can only be told apart from a very small current statistically: if none of n absorbed photons
+# emitted an electron, then with the given confidence fewer than -ln(1 - confidence) / n of them would,
+# so the run carries on until that fraction is below min_fraction or max_duration seconds have been simulated
+# Runs with a current carry on just as long, so the fastest electron is a good estimate of the stopping voltage
+def probe(config, voltage, min_fraction=0.001, confidence=0.95, max_duration=30):
+    config = dict(config, stop_voltage=voltage, budget=config.get("budget") or PROBE_BUDGET)
+    probe_engine = engine.Engine.from_config(config)
+    needed = -math.log(1 - confidence) / min_fraction
+    frames = round(max_duration * engine.FPS)
+    while probe_engine.frame < frames and probe_engine.photons_absorbed < needed:
+        probe_engine.step()
+    return probe_engine
+
+
+# Returns the stopping voltage of the simulation in config (the lowest voltage with no current) as a dictionary
+# It starts from the bracket 0 V to high V, doubling high while there is still a current there, then bisects it
+# until it is narrower than tolerance V. The fastest electron of a run with a current estimates the answer,
+# so the bracket is first narrowed around that estimate, which usually saves most of the bisection
+# options are passed on to probe. The stopping voltage is None if there is no current even at 0 V
+def stopping_voltage(config, tolerance=0.01, high=3.0, **options):
+    frames = []
+    estimate = 0.0
+
+    # Returns True if there is a current at voltage, and improves the estimate if there is
+    def has_current(voltage):
+        nonlocal estimate
+        probe_engine = probe(config, voltage, **options)
+        frames.append(probe_engine.frame)
+        if probe_engine.electrons_emitted == 0:
+            return False
+        if probe_engine.field:
+            # Electrons leave with all their energy and only those with more than the voltage reach the other plate,
+            # which would take a long time to wait for when they only just do
+            fastest = probe_engine.stats.ke.max / engine.CHARGE
+            estimate = max(estimate, fastest)
+            return fastest > voltage
+        # The fastest electron has the energy left over after the stopping voltage
+        estimate = max(estimate, voltage + probe_engine.stats.ke.max / engine.CHARGE)
+        return True
+
+    low = 0.0
+    result = {
+        "metal": config["metal"],
+        "source": config["source"],
+        "wavelength": config["wavelength"],
+        "frequency": engine.LIGHT_SPEED / (config["wavelength"] * math.pow(10, -9)),
+        "intensity": config["intensity"],
+        "seed": config.get("seed"),
+        # Stopping voltage of light of exactly the given wavelength, from Einstein's equation
+        "theory": (engine.photon_energy(config["wavelength"]) - config["work_func"]) / engine.CHARGE,
+        "stopping_voltage": None,
+        "low": None,
+        "high": None,
+        "tolerance": tolerance,
+    }
+    if has_current(low):
+        while has_current(high):
+            low = high
+            high *= 2
+            if high > MAX_VOLTAGE:
+                high = None
+                break
+    else:
+        high = None
+    if high is not None:
+        # Just inside tolerance of each other, so if both guesses are right no bisection is needed
+        for guess in (estimate + 0.45 * tolerance, estimate - 0.45 * tolerance):
+            if high - low > tolerance and low < guess < high:
+                if has_current(guess):
+                    low = guess
+                else:
+                    high = guess
+        while high - low > tolerance:
+            middle = (low + high) / 2
+            if has_current(middle):
+                low = middle
+            else:
+                high = middle
+        result.update(stopping_voltage=(low + high) / 2, low=low, high=high)
+    result["runs"] = len(frames)
+    result["frames"] = sum(frames)
+    return result
+
+
+# Returns the standard error in A of a result's current, from the Poisson spread of the number of electrons it counts:
+# those collected when the field is simulated, otherwise those emitted
+def current_error(result):
+    counted = result["electrons_collected"] if result.get("field") else result["electrons_emitted"]
+    if counted == 0:
+        return 0.0
+    return result["current"] / math.sqrt(counted)
+
+
+# Sweeps the config value called name (eg. "wavelength" or "stop_voltage") from low to high and returns the results
+# sorted by that value. It starts with initial evenly spaced runs, then adds a run in the middle of every gap where
+# the current changes by more than threshold of its whole range (and by more than twice its uncertainty, so noise
+# isn't mistaken for change), or where the uncertainty itself is more than threshold of the range.
+# Flat regions, such as no current below the threshold or a saturated current, are left with few points
+# runs - the most simulations to run in total, min_step - gaps are never split into parts smaller than this
+# runner - function that runs a function on a list of configs and returns a list of results, eg. in parallel
+# simulate - function that runs one config, such as cache.simulate to reuse earlier results
+def refine(config, name, low, high, runs=50, initial=5, threshold=0.05, min_step=0.0, runner=map,
+           simulate=engine.simulate):
+    results = {}
+
+    def run(values):
+        configs = [dict(config, **{name: value}) for value in values]
+        for value, result in zip(values, runner(simulate, configs)):
+            result["current_error"] = current_error(result)
+            results[value] = result
+
+    initial = max(2, min(initial, runs))
+    run([low + (high - low) * i / (initial - 1) for i in range(initial)])
+    while len(results) < runs:
+        values = sorted(results)
+        currents = [results[value]["current"] for value in values]
+        scale = max(currents) - min(currents)
+        if scale <= 0:
+            break
+        # The gaps worth splitting, with their scores
+        gaps = []
+        for a, b in zip(values, values[1:]):
+            if (b - a) / 2 < min_step:
+                continue
+            change = abs(results[b]["current"] - results[a]["current"])
+            noise = math.hypot(results[a]["current_error"], results[b]["current_error"])
+            if change > 2 * noise and change / scale > threshold or noise / scale > threshold:
+                gaps.append((max(change, noise) / scale, (a + b) / 2))
+        if not gaps:
+            break
+        # If the budget runs out this round, the gaps with the sharpest changes are split first
+        gaps.sort(reverse=True)
+        run([middle for score, middle in gaps[:runs - len(results)]])
+    return [results[value] for value in sorted(results)]
+
+
+# Returns the value of Student's t distribution with dof degrees of freedom that a two sided interval with the given
+# confidence reaches, from the normal distribution's with the Cornish-Fisher expansion, accurate to about 1% from
+# 5 degrees of freedom
+def t_quantile(confidence, dof):
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    return (z + (z ** 3 + z) / (4 * dof) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * dof ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * dof ** 3))
+
+
+# Returns the estimate and the half width of its confidence interval of a ratio, given the change in the total
+# (numerators) and in what it is divided by (denominators) over each of several chunks of a run
+# The chunks are batches whose values vary around the estimate, so the interval comes from how much they vary
+# (the batch means method), which also allows for electrons or quasi-random numbers linking frames within a chunk
+def ratio_interval(numerators, denominators, confidence):
+    count = len(numerators)
+    total = sum(denominators)
+    if total == 0:
+        return None, math.inf
+    estimate = sum(numerators) / total
+    if count < 2:
+        return estimate, math.inf
+    # Spread of the chunks around the estimate, each weighted by its share of the denominator
+    residuals = sum((n - estimate * d) ** 2 for n, d in zip(numerators, denominators))
+    error = math.sqrt(residuals / (count * (count - 1))) / (total / count)
+    return estimate, t_quantile(confidence, count - 1) * error
+
+
+# Returns the seconds of simulation before a quantity reaches its steady state, starting with no particles: the
+# first photons' flight to the plate and, for the current with the field, the longest an electron is followed
+# crossing the plates (engine.MAX_ELECTRON_LIFE), as until then the collected current only counts the fastest ones
+def warm_up(simulation, quantity):
+    frames = (simulation.source.x + simulation.source.mean - engine.ELECTRON_START_X) / -engine.PHOTON_SPEED[0]
+    if quantity == "current" and simulation.field:
+        frames += engine.MAX_ELECTRON_LIFE
+    return math.ceil(frames) / engine.FPS
+
+
+# Runs the simulation in config in chunks of chunk simulated seconds until a quantity is known precisely enough,
+# then returns the engine's results with the estimate, its confidence interval and what it cost
+# quantity - a name in PRECISE_QUANTITIES
+# relative_error - target half width of the interval as a fraction of the estimate, absolute_error - target half width
+# in the quantity's units (A or m/s). The run stops once either one given is met, after at least min_chunks chunks
+# and PRECISE_EVENTS electrons counted, and only if the chunks vary at all. So a quantity that stays 0, eg. no
+# current, never meets its target and the run stops at a time limit
+# The first warm_up seconds are simulated before any chunk is counted, so the interval is of the steady state
+# max_seconds - most seconds of real time to spend, max_duration - most seconds to simulate, None for no limit
+def precise(config, quantity="current", relative_error=None, absolute_error=None, confidence=0.95, chunk=1.0,
+            min_chunks=10, max_seconds=60, max_duration=None):
+    if quantity not in PRECISE_QUANTITIES:
+        raise ValueError("unknown quantity '" + quantity + "', choose from: " + ", ".join(PRECISE_QUANTITIES))
+    if relative_error is None and absolute_error is None:
+        raise ValueError("precise needs a relative or an absolute error to aim for")
+    totals = PRECISE_QUANTITIES[quantity]
+    shards = config.get("shards", 1)
+    if shards > 1:
+        simulation = engine.ShardedEngine.from_config(config, workers=shards)
+    else:
+        simulation = engine.Engine.from_config(config)
+    start = time.perf_counter()
+    numerators = []
+    denominators = []
+    try:
+        warm = warm_up(simulation, quantity)
+        simulation.run(warm)
+        first = last = totals(simulation)
+        while True:
+            simulation.run(chunk)
+            now = totals(simulation)
+            numerators.append(now[0] - last[0])
+            denominators.append(now[1] - last[1])
+            last = now
+            estimate, half_width = ratio_interval(numerators, denominators, confidence)
+            met = (len(numerators) >= min_chunks and now[2] - first[2] >= PRECISE_EVENTS
+                   and estimate is not None and 0 < half_width
+                   and (relative_error is not None and half_width <= relative_error * abs(estimate)
+                        or absolute_error is not None and half_width <= absolute_error))
+            if met:
+                stopped = "target"
+                break
+            if time.perf_counter() - start >= max_seconds:
+                stopped = "time"
+                break
+            if max_duration is not None and simulation.time >= max_duration:
+                stopped = "duration"
+                break
+        results = simulation.results()
+    finally:
+        if shards > 1:
+            simulation.close()
+    # Without an estimate or with too few chunks there is no interval, which is left out like a missing estimate
+    # rather than given as infinite, which JSON has no value for
+    bounded = estimate is not None and math.isfinite(half_width)
+    results.update({
+        "quantity": quantity,
+        "estimate": estimate,
+        "low": estimate - half_width if bounded else None,
+        "high": estimate + half_width if bounded else None,
+        "half_width": half_width if bounded else None,
+        "relative_half_width": half_width / abs(estimate) if bounded and estimate else None,
+        "confidence": confidence,
+        "target_met": stopped == "target",
+        "stopped": stopped,
+        "chunks": len(numerators),
+        "warm_up": warm,
+        "seconds": time.perf_counter() - start,
+    })
+    return results
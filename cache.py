@@ -0,0 +1,130 @@
+# cache.py stores the results of headless simulations on disk, so running a configuration that has been run before
+# returns its results straight away. Results are stored under a hash of the whole configuration and the engine
+# version, so a change to either is a different entry. Least recently used entries are removed above a size limit
+import hashlib
+import json
+import os
+import tempfile
+import engine
+
+# Folder the results are stored in, one JSON file per configuration
+CACHE_FOLDER = os.path.join("data", "cache")
+# Most bytes the cache may use before old entries are removed
+MAX_SIZE = 64 * 1024 * 1024
+
+
+# Class for a folder of cached results, which any number of processes can use at once
+# Files are written to a temporary name then renamed, so another process never reads half a file,
+# and reading an entry updates its modification time, which is how the least recently used entries are found
+class ResultCache:
+
+    # Entries added between two measurements of the size of the whole folder
+    CheckEvery = 100
+
+    def __init__(self, folder=CACHE_FOLDER, max_size=MAX_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        # Estimated size of the folder, None until it is first measured
+        self.size = None
+        self.added = 0
+
+    # Returns the hash a configuration's results are stored under
+    @staticmethod
+    def key(config):
+        text = json.dumps({"config": config, "engine_version": engine.ENGINE_VERSION}, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    # Entries are spread over 256 sub folders so no folder gets too big
+    def path(self, key):
+        return os.path.join(self.folder, key[:2], key + ".json")
+
+    # Returns the cached results of config, or None if there are none
+    def get(self, config):
+        path = self.path(ResultCache.key(config))
+        try:
+            with open(path) as f:
+                results = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return results
+
+    # Stores the results of config, then removes old entries if the cache has grown too big
+    def put(self, config, results):
+        path = self.path(ResultCache.key(config))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as f:
+                json.dump(results, f)
+            size = os.path.getsize(temporary)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.added += 1
+        if self.size is None or self.added % ResultCache.CheckEvery == 0:
+            self.size = self.measure()
+        else:
+            self.size += size
+        if self.size > self.max_size:
+            self.evict()
+
+    # Returns a list of (last used time, size, path) of every entry
+    def entries(self):
+        entries = []
+        for root, folders, files in os.walk(self.folder):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        # Removed by another process
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    # Returns the number of bytes used by the cache
+    def measure(self):
+        return sum(size for used, size, path in self.entries())
+
+    # Removes the least recently used entries until the cache is 90% of its limit, so it isn't done on every put
+    def evict(self):
+        entries = sorted(self.entries())
+        size = sum(entry[1] for entry in entries)
+        for used, entry_size, path in entries:
+            if size <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self.size = size
+
+    # Removes every entry
+    def clear(self):
+        for used, size, path in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.size = 0
+
+
+# The cache used by simulate
+default_cache = ResultCache()
+
+
+# Runs one headless simulation like engine.simulate, unless its results are already in the cache
+# Runs without a seed are random, so they are never cached
+# Defined at module level so it can be sent to worker processes
+def simulate(config):
+    if config.get("seed") is None:
+        return engine.simulate(config)
+    results = default_cache.get(config)
+    if results is None:
+        results = engine.simulate(config)
+        default_cache.put(config, results)
+    return results
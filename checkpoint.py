@@ -0,0 +1,191 @@
+# checkpoint.py saves the full state of an Engine to a compact binary file and restores it, so a long run that
+# is stopped can carry on from its last checkpoint and finish with exactly the results it would have had
+# File layout: MAGIC, the length of the header as a 4 byte little endian number, the header as UTF-8 JSON,
+# then the raw bytes of every array listed in the header, one after the other
+import json
+import os
+import struct
+import threading
+import types
+import numpy as np
+import engine
+import qmc
+
+MAGIC = b"PECKPT\x00\x01"
+
+# Quasi-random sequences of an Engine, saved as their permutations and how far along them the engine is
+SAMPLERS = ("sampler", "timer_sampler")
+
+# Attributes of an Engine saved as they are
+SCALARS = ("wavelength", "intensity", "stop_voltage", "seed", "budget", "monochromatic", "field", "cone", "qmc",
+           "keep_missed", "shard_index", "shard_count", "emission_index", "last_emitted", "frame", "count_collisions",
+           "current", "photons_emitted", "photons_absorbed", "photons_missed", "electrons_emitted",
+           "electrons_collected", "electrons_returned", "real_electrons", "real_collected", "total_ke")
+
+
+# Adds the attributes of obj to header, and its numpy arrays to arrays, with names starting with prefix
+# Attributes that are objects themselves, such as the parts of engine.stats, are added with their own prefix
+def flatten(obj, prefix, header, arrays):
+    for name, value in vars(obj).items():
+        if isinstance(value, np.ndarray):
+            arrays[prefix + name] = value.copy()
+        elif hasattr(value, "__dict__"):
+            flatten(value, prefix + name + ".", header, arrays)
+        else:
+            header[prefix + name] = value
+
+
+# Sets the attributes of obj from what flatten added to header and arrays
+def unflatten(obj, prefix, header, arrays):
+    for name, value in vars(obj).items():
+        if isinstance(value, np.ndarray):
+            setattr(obj, name, arrays[prefix + name])
+        elif hasattr(value, "__dict__"):
+            unflatten(value, prefix + name + ".", header, arrays)
+        else:
+            setattr(obj, name, header[prefix + name])
+
+
+# Returns the state of an engine as a header dictionary and a dictionary of arrays
+# Every array is a copy, so the engine can carry on running while they are written
+# config is stored with the state, so a resumed run can check it is the same simulation
+def capture(simulation, config=None):
+    if isinstance(simulation, engine.ShardedEngine):
+        raise TypeError("sharded engines cannot be checkpointed")
+    header = {name: getattr(simulation, name) for name in SCALARS}
+    header["engine_version"] = engine.ENGINE_VERSION
+    header["config"] = config
+    header["metal"] = vars(simulation.metal)
+    header["source"] = vars(simulation.source)
+    header["rng"] = simulation.rng.bit_generator.state
+    header["timer_rng"] = simulation.timer_rng.bit_generator.state
+    arrays = {}
+    for name in SAMPLERS:
+        sampler = getattr(simulation, name)
+        header[name] = None
+        if sampler is not None:
+            header[name] = {"index": sampler.index, "shape": sampler.permutations.shape}
+            arrays[name] = sampler.permutations.reshape(-1).copy()
+    for kind in ("photons", "electrons"):
+        particles = getattr(simulation, kind)
+        for name in particles.fields:
+            arrays[kind + "." + name] = particles[name].copy()
+    stats_header = {}
+    flatten(simulation.stats, "", stats_header, arrays)
+    header["stats"] = stats_header
+    return header, arrays
+
+
+# Writes a captured state to path. It is written to a temporary file first and renamed,
+# so if the process dies while writing, the last checkpoint is still whole
+def write(path, header, arrays):
+    header = dict(header, arrays=[[name, array.dtype.str, len(array)] for name, array in arrays.items()])
+    # numpy numbers are turned into Python ones
+    text = json.dumps(header, default=lambda value: value.item()).encode()
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(text)))
+        f.write(text)
+        for array in arrays.values():
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(temporary, path)
+
+
+# Saves the state of an engine to path
+def save(simulation, path, config=None):
+    write(path, *capture(simulation, config))
+
+
+# Returns the engine saved in path and the config stored with it
+def load(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + " is not a checkpoint")
+        length, = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length).decode())
+        if header["engine_version"] != engine.ENGINE_VERSION:
+            raise ValueError(path + " was saved by a different version of the engine")
+        arrays = {}
+        for name, dtype, count in header["arrays"]:
+            arrays[name] = np.frombuffer(f.read(np.dtype(dtype).itemsize * count), dtype).copy()
+
+    simulation = engine.Engine(types.SimpleNamespace(**header["metal"]), types.SimpleNamespace(**header["source"]),
+                               seed=header["seed"])
+    for name in SCALARS:
+        setattr(simulation, name, header[name])
+    simulation.rng.bit_generator.state = header["rng"]
+    simulation.timer_rng.bit_generator.state = header["timer_rng"]
+    for name in SAMPLERS:
+        if header.get(name) is not None:
+            permutations = arrays[name].reshape(header[name]["shape"])
+            setattr(simulation, name, qmc.ScrambledHalton(permutations=permutations, index=header[name]["index"]))
+    for kind, fields in (("photons", engine.PHOTON_FIELDS), ("electrons", engine.ELECTRON_FIELDS)):
+        count = len(arrays[kind + ".x"])
+        particles = engine.ParticleArrays(fields, max(count, 64))
+        particles.append(**{name: arrays[kind + "." + name] for name in fields})
+        setattr(simulation, kind, particles)
+    unflatten(simulation.stats, "", header["stats"], arrays)
+    return simulation, header["config"]
+
+
+# Class that writes checkpoints on a background thread, so the simulation only pauses to copy its arrays
+# If the previous checkpoint is still being written when a new one is asked for, the new one is skipped
+class CheckpointWriter:
+
+    def __init__(self, path, config=None):
+        self.path = path
+        self.config = config
+        self.thread = None
+        # Number of checkpoints written and skipped
+        self.written = 0
+        self.skipped = 0
+        self.error = None
+
+    # Starts writing the current state of an engine, returns False if it was skipped
+    def save(self, simulation):
+        if self.error is not None:
+            raise self.error
+        if self.thread is not None and self.thread.is_alive():
+            self.skipped += 1
+            return False
+        state = capture(simulation, self.config)
+        self.thread = threading.Thread(target=self.write, args=state, daemon=True)
+        self.thread.start()
+        return True
+
+    def write(self, header, arrays):
+        try:
+            write(self.path, header, arrays)
+            self.written += 1
+        except OSError as error:
+            self.error = error
+
+    # Waits for the checkpoint being written to finish
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+# Runs the simulation in config like engine.simulate, saving a checkpoint to path every interval simulated seconds
+# and at the end. If resume is True and path exists, the run carries on from that checkpoint instead of starting
+# again, which must have been saved from the same config apart from its duration
+def simulate(config, path, interval=10, resume=False):
+    if resume and os.path.exists(path):
+        simulation, saved = load(path)
+        if {**saved, "duration": None} != {**config, "duration": None}:
+            raise ValueError(path + " was saved from a different simulation")
+    else:
+        simulation = engine.Engine.from_config(config)
+    writer = CheckpointWriter(path, config)
+    frames = round(config["duration"] * engine.FPS)
+    every = max(1, round(interval * engine.FPS))
+    while simulation.frame < frames:
+        simulation.step()
+        if simulation.frame % every == 0:
+            writer.save(simulation)
+    writer.wait()
+    save(simulation, path, config)
+    return simulation.results()
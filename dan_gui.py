@@ -1,6 +1,7 @@
 # dan_gui.py is a GUI library I have developed for use in the program
 import pygame
 import math
+import os
 
 # RGB colour definitions for referring to later
 black = (0, 0, 0)
@@ -10,6 +11,90 @@ darkGrey = (50, 50, 50)
 light_grey = (130, 130, 130)
 
 
+# Class that loads every image in a folder once and hands out cached surfaces by name
+# A name is the path of the image inside the folder without the .png extension, eg. "laser" or "dan_gui/checkboxOn"
+# Images are converted to the display's pixel format so blitting them does not need a conversion every frame
+# Small images (icons) are packed into one atlas surface and handed out as subsurfaces of it
+class AssetManager:
+
+    # folder - the folder the images are loaded from
+    # icon_size - images no bigger than this many pixels in both dimensions are packed into the atlas
+    # atlas_width - the width of the atlas surface in pixels, must be at least icon_size
+    def __init__(self, folder="img", icon_size=256, atlas_width=1024):
+        self.folder = folder
+        self.icon_size = icon_size
+        self.atlas_width = atlas_width
+        # Dictionary of image names and their surfaces
+        self.images = {}
+        # The surface that all icons are packed into
+        self.atlas = None
+        # True once every image in the folder has been loaded
+        self.loaded = False
+
+    # Loads, converts and packs every .png image in the folder
+    # Should be called once after the display mode has been set, otherwise images cannot be converted
+    def preload(self):
+        icons = {}
+        for root, dirs, files in os.walk(self.folder):
+            for file in sorted(files):
+                if file.lower().endswith(".png"):
+                    path = os.path.join(root, file)
+                    name = os.path.relpath(path, self.folder)[:-4].replace(os.sep, "/")
+                    image = self.convert(pygame.image.load(path))
+                    width, height = image.get_size()
+                    if width <= self.icon_size and height <= self.icon_size:
+                        icons[name] = image
+                    else:
+                        self.images[name] = image
+        self.pack(icons)
+        self.loaded = True
+
+    # Converts an image to the pixel format of the display, keeping its transparency
+    # Images can only be converted once a display mode has been set
+    @staticmethod
+    def convert(image):
+        if pygame.display.get_surface() is not None:
+            return image.convert_alpha()
+        return image
+
+    # Packs a dictionary of names and icons into one atlas surface using shelf packing
+    # Icons are placed left to right in rows (shelves), tallest first, starting a new row when one is full
+    def pack(self, icons):
+        if not icons:
+            return
+        positions = {}
+        x = 0
+        y = 0
+        shelf_height = 0
+        for name in sorted(icons, key=lambda n: icons[n].get_height(), reverse=True):
+            width, height = icons[name].get_size()
+            if x + width > self.atlas_width:
+                x = 0
+                y += shelf_height
+                shelf_height = 0
+            positions[name] = (x, y)
+            # Leaves a pixel gap between icons so smooth scaling of one never picks up its neighbour
+            x += width + 1
+            shelf_height = max(shelf_height, height + 1)
+        self.atlas = self.convert(pygame.Surface((self.atlas_width, y + shelf_height), pygame.SRCALPHA))
+        for name, pos in positions.items():
+            # BLEND_RGBA_MAX onto the fully transparent atlas copies the pixels exactly, alpha included
+            self.atlas.blit(icons[name], pos, special_flags=pygame.BLEND_RGBA_MAX)
+            self.images[name] = self.atlas.subsurface(pygame.Rect(pos, icons[name].get_size()))
+
+    # Returns the surface of the image called name
+    # Images that were not preloaded are loaded from disk the first time they are asked for
+    # Raises FileNotFoundError if there is no such image
+    def get(self, name):
+        if name not in self.images:
+            self.images[name] = self.convert(pygame.image.load(os.path.join(self.folder, name + ".png")))
+        return self.images[name]
+
+
+# The asset manager shared by all elements, loads from the /img folder
+assets = AssetManager()
+
+
 # Base/parent class used for all other classes
 # Should be treated as abstract - there should never be an Element object, only objects that are children of Element
 class Element:
@@ -31,6 +116,12 @@ class Element:
         self.x2 = self.x + self.width
         self.y2 = self.y + self.height
         self.font = font
+        # Elements are drawn in retained mode: each one renders itself into a cached surface
+        # which is only redrawn when dirty is True (when its value, hover state or geometry changes)
+        self.dirty = True
+        # The cached surface and the screen co-ords of its top left corner
+        self.surface = None
+        self.surface_pos = (self.x, self.y)
         self.bg_colour = back_colour
         self.text_colour = text_colour
 
@@ -46,16 +137,46 @@ class Element:
         for n in new_colour:
             if n > 255 or n < 0:
                 valid = False
-        if valid:
+        # Only redraws the element if the colour actually changed
+        if valid and new_colour != getattr(self, "_bg_colour", None):
             self._bg_colour = new_colour
+            self.invalidate()
+
+    # Marks the element as needing to be re-rendered the next time it is drawn
+    def invalidate(self):
+        self.dirty = True
+
+    # Returns True if the cached surface is out of date
+    # Overridden by Group, which is also dirty when any of its elements are
+    def is_dirty(self):
+        return self.dirty
+
+    # Returns the cached surface and its position, re-rendering it first if the element is dirty
+    def get_surface(self):
+        if self.is_dirty():
+            self.surface, self.surface_pos = self.render()
+            self.dirty = False
+        return self.surface, self.surface_pos
+
+    # Creates a transparent surface for an element to render itself onto
+    @staticmethod
+    def new_surface(width, height):
+        return pygame.Surface((math.ceil(width), math.ceil(height)), pygame.SRCALPHA)
+
+    # Draw method, blits the cached surface so an unchanged element costs one blit per frame
+    # Parameter screen is a Pygame surface object that will be drawn to
+    def draw(self, screen):
+        surface, pos = self.get_surface()
+        if surface is not None:
+            screen.blit(surface, pos)
 
     # Default methods, child classes override the ones they need
     # Uses 'pass' keyword: method does nothing
 
-    # Default draw method
-    # Parameter screen is a Pygame surface object that will be drawn to
-    def draw(self, screen):
-        pass
+    # Default render method, draws the element onto a new surface
+    # Returns the surface and the screen co-ords of its top left corner (None if there is nothing to draw)
+    def render(self):
+        return None, (self.x, self.y)
 
     # Method that deals with clicking input, takes in the mouse position as 2 co-ords
     def on_click(self, mouse_x, mouse_y):
@@ -115,6 +236,17 @@ class DropDown(Element):
         self.button_rect = pygame.Rect(self.x2, self.y, DropDown.buttonWidth, self.height)
         self.menu_rect = pygame.Rect(self.x, self.y2, self.width, self.height*len(self.data))
 
+    @property
+    def open(self):
+        return self._open
+
+    # Opening or closing the list changes what is drawn, so the element is redrawn
+    @open.setter
+    def open(self, new_open):
+        if new_open != getattr(self, "_open", None):
+            self._open = new_open
+            self.invalidate()
+
     def on_click(self, mouse_x, mouse_y):
         # Returns true if an option changed
         changed = False
@@ -154,6 +286,7 @@ class DropDown(Element):
         self.__options = options
         # Recreates the collision Rect object to account for longer menu box
         self.menu_rect = pygame.Rect(self.x, self.y2, self.width, self.height * (len(self.data)))
+        self.invalidate()
 
     # Takes in the y co-ord of the mouse
     # Subtracts from the y co-ord so the top of the first option box is at 0
@@ -163,34 +296,50 @@ class DropDown(Element):
         # Changes the button text to the currently selected option
         self.change_text(self.data[self.current_opt])
 
+    # Selects the option new_option, returns False if it isn't one of the options
+    def select(self, new_option):
+        if new_option not in self.data:
+            return False
+        self.current_opt = self.data.index(new_option)
+        self.change_text(new_option)
+        return True
+
     # Changes the text in the button to string new_text
     def change_text(self, new_text):
         self.button_text = self.font.render(new_text, 1, black)
-
-    # Draws the drop-down box
-    def draw(self, screen):
+        self.invalidate()
+
+    # Renders the drop-down box
+    # Co-ords on the surface are relative to the top left of the box
+    def render(self):
+        width = self.width + DropDown.buttonWidth
+        height = self.height
+        # The surface is taller when the list is open so that the options fit on it
+        if self.open:
+            height += self.height * len(self.data)
+        surface = self.new_surface(width + 1, height + 1)
         # Draws the background of the box
-        pygame.draw.rect(screen, self.bg_colour, (self.x, self.y, self.width, self.height))
+        pygame.draw.rect(surface, self.bg_colour, (0, 0, self.width, self.height))
         # Draws the background for the button next to the box
-        pygame.draw.rect(screen, white, ((self.x + self.width), self.y, DropDown.buttonWidth, self.height))
-        pygame.draw.lines(screen, black, True, ((self.x2, self.y), (self.x2+DropDown.buttonWidth, self.y), (self.x2+DropDown.buttonWidth, self.y+self.height), (self.x2, self.y+self.height)))
+        pygame.draw.rect(surface, white, (self.width, 0, DropDown.buttonWidth, self.height))
+        pygame.draw.lines(surface, black, True, ((self.width, 0), (width, 0), (width, self.height), (self.width, self.height)))
         # Draws the triangle inside the button
-        pygame.draw.polygon(screen, black, (((self.x + self.width + (DropDown.buttonWidth / 2)),
-                                             (self.y + self.height - 3)), ((self.x + self.width + 3), (self.y + 3)),
-                                            ((self.x2 + DropDown.buttonWidth - 3), (self.y + 3))))
+        pygame.draw.polygon(surface, black, (((self.width + (DropDown.buttonWidth / 2)), (self.height - 3)),
+                                             ((self.width + 3), 3), ((width - 3), 3)))
         # Draw text in box
-        screen.blit(self.button_text, (self.x + 2, self.y + 2))
+        surface.blit(self.button_text, (2, 2))
         # Draw border around box
-        pygame.draw.lines(screen, black, True, ((self.x, self.y), (self.x2, self.y), (self.x2, self.y2), (self.x, self.y2)))
+        pygame.draw.lines(surface, black, True, ((0, 0), (self.width, 0), (self.width, self.height), (0, self.height)))
         # Displays whole list if open
         if self.open:
             # For each option available, draw a box with text in
             for i in range(len(self.data)):
-                current_y = self.y + ((i+1)*self.height)
+                current_y = (i+1)*self.height
                 # Render a box
-                pygame.draw.rect(screen, self.bg_colour, (self.x, current_y, self.width, self.height))
+                pygame.draw.rect(surface, self.bg_colour, (0, current_y, self.width, self.height))
                 # Render the text
-                screen.blit(self.options[i], (self.x + 2, current_y + 2))
+                surface.blit(self.options[i], (2, current_y + 2))
+        return surface, (self.x, self.y)
 
 
 # Class for a button with a text label
@@ -213,6 +362,8 @@ class Button(Element):
         self.last_click = 0
         # The width of the black border around the button in pixels
         self.border = 1
+        # Whether the mouse was inside the button last frame, None until the first update
+        self.hovered = None
         # When this is true, the button appears greyed out and cannot be clicked
         self.grey = False
 
@@ -243,14 +394,20 @@ class Button(Element):
 
     # Called every frame, checks if mouse is inside button but doesn't need to be clicked
     def on_hover(self, mouse_x, mouse_y):
+        hovered = self.rect.collidepoint(mouse_x, mouse_y) and not self.grey
+        # The look of the button only changes when the mouse enters or leaves it
+        if hovered == self.hovered:
+            return
+        self.hovered = hovered
         # If in button, make border thicker and make background slightly lighter
-        if self.rect.collidepoint(mouse_x, mouse_y) and not self.grey:
+        if hovered:
             self.border = 2
             self.bg_colour = (100, 100, 100)
         # If not in button, set border and colour back to normal
         else:
             self.border = 1
             self.bg_colour = light_grey
+        self.invalidate()
 
     # Called every second
     def update(self, mouse_x, mouse_y):
@@ -273,6 +430,7 @@ class Button(Element):
                 self.txt_obj = self.font.render(self.text, 1, self.text_colour)
             except AttributeError:
                 pass
+            self.invalidate()
         # If not grey, set background colour and text colour to normal
         else:
             self.bg_colour = light_grey
@@ -281,15 +439,24 @@ class Button(Element):
                 self.txt_obj = self.font.render(self.text, 1, self.text_colour)
             except AttributeError:
                 pass
-        
-    def draw(self, screen):
+            self.invalidate()
+
+    # Draws the background and border of the button onto a new surface, leaving the middle for the label
+    # The surface has a pixel of padding on each side so that thick borders are not cut off
+    def render_frame(self):
+        surface = self.new_surface(self.width + 3, self.height + 3)
         # Draws the background rectangle of the button
-        pygame.draw.rect(screen, self.bg_colour, (self.x, self.y, self.width, self.height))
-        # Draws the button text
-        screen.blit(self.txt_obj, (self.x + 3, self.y + 3))
+        pygame.draw.rect(surface, self.bg_colour, (1, 1, self.width, self.height))
         # Draws the border
-        pygame.draw.lines(screen, black, True, ((self.x, self.y), (self.x, self.y2), (self.x2, self.y2),
-                                                    (self.x2, self.y)), self.border)
+        pygame.draw.lines(surface, black, True, ((1, 1), (1, self.height + 1), (self.width + 1, self.height + 1),
+                                                     (self.width + 1, 1)), self.border)
+        return surface
+
+    def render(self):
+        surface = self.render_frame()
+        # Draws the button text
+        surface.blit(self.txt_obj, (4, 4))
+        return surface, (self.x - 1, self.y - 1)
 
 
 # Child of the button class but displays an image instead of a text label
@@ -301,7 +468,7 @@ class ImageButton(Button):
         # Tries to open the image specified by 'filepath' in the /img folder
         # The root of the /img folder is the folder where this .py file is
         try:
-            self.image = pygame.image.load("img/" + filepath + ".png")
+            self.image = assets.get(filepath)
         # Validation: Tell user if image cannot be found
         except FileNotFoundError:
             print("Could not find file at img/" + filepath + ".png")
@@ -314,16 +481,15 @@ class ImageButton(Button):
         self.border = 1
         self.clicked = False
         self.last_click = 0
+        self.hovered = None
         self.grey = False
 
-    def draw(self, screen):
-        # Draw the background
-        pygame.draw.rect(screen, self.bg_colour, (self.x, self.y, self.width, self.height))
+    def render(self):
+        # Draw the background and the borders
+        surface = self.render_frame()
         # Draw the image
-        screen.blit(self.image, (self.x + 5, self.y + 5))
-        # Draw the borders
-        pygame.draw.lines(screen, black, True, ((self.x, self.y), (self.x, self.y2), (self.x2, self.y2),
-                                                    (self.x2, self.y)), self.border)
+        surface.blit(self.image, (6, 6))
+        return surface, (self.x - 1, self.y - 1)
 
 
 # Class for a slider that has a small triangle that moves along a bar when clicked and dragged
@@ -345,17 +511,13 @@ class Slider(Element):
         self.starting_pos = starting_pos
         self.dec_points = dec_points
         # 'pointer' is the raw pixel position of the x co-ord of the middle of the triangular pointer
+        # Setting it also sets value (the output of the slider), txt (the text object that renders the value)
+        # and tri_rect (the Pygame Rect object for the triangle pointer)
         self.pointer = self.x + (self.width * self.starting_pos)
-        # Value is the output of the slider
-        self.value = self.get_pos()
-        # txt is the text object that renders the value of the slider
-        self.txt = self.update_txt()
         # true when the slider itself is clicked
         self.clicked = False
         # true when the pointer is clicked
         self.tri_clicked = False
-        # Pygame Rect object for the triangle pointer
-        self.tri_rect = pygame.Rect(self.pointer - 10, self.y + 2, 20, (self.line_y - 2) - (self.y + 2))
 
     # Called when a slider object is added to a Menu object
     # Updates all x and y positions of the triangle and text
@@ -365,7 +527,8 @@ class Slider(Element):
         self.value = self.get_pos()
         self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
         self.tri_rect = pygame.Rect(self.pointer - 10, self.y + 2, 20, (self.line_y - 2) - (self.y + 2))
-        self.update_txt()
+        self.txt = self.update_txt()
+        self.invalidate()
 
     # Given the raw pointer position relative to the top left corner of the screen
     # Gets the value from the slider and returns it
@@ -380,6 +543,14 @@ class Slider(Element):
         pos += self.limits[0]
         return pos
 
+    # Moves the pointer to a value, eg. one set from outside the GUI
+    # Values outside the limits move the pointer to the nearest end, NaN and infinities are ignored
+    def set_pos(self, value):
+        if not math.isfinite(value):
+            return
+        proportion = (value - self.limits[0]) / (self.limits[1] - self.limits[0])
+        self.pointer = self.x + self.width * min(max(proportion, 0), 1)
+
     # Updates the text object of the value above the pointer
     def update_txt(self):
         if self.dec_points == 0:
@@ -388,16 +559,20 @@ class Slider(Element):
             txt = self.font.render(str(round(self.value, self.dec_points)), 1, black)
         return txt
 
-    def draw(self, screen):
+    # The surface starts 10 pixels left of the slider so the pointer fits at the lower limit
+    # and is wide enough for the value text at the upper limit
+    def render(self):
+        surface = self.new_surface(self.width + 22 + self.txt.get_width(), self.height + 1)
+        # Pointer position relative to the surface
+        pointer = self.pointer - self.x + 10
+        line_y = self.line_y - self.y
         # Draws bottom line
-        pygame.draw.rect(screen, black, (self.x, self.line_y, self.width, self.y2 - self.line_y))
+        pygame.draw.rect(surface, black, (10, line_y, self.width, self.height - line_y))
         # Draws triangular pointer 2 pixels above the line
-        pygame.draw.polygon(screen, black, ((self.pointer, self.line_y - 2), (self.pointer - 10, self.y + 2),
-                                                (self.pointer + 10, self.y + 2)))
+        pygame.draw.polygon(surface, black, ((pointer, line_y - 2), (pointer - 10, 2), (pointer + 10, 2)))
         # Draws value above pointer
-        self.value = self.get_pos()
-        self.txt = self.update_txt()
-        screen.blit(self.txt, (self.pointer + 12, self.y))
+        surface.blit(self.txt, (pointer + 12, 0))
+        return surface, (self.x - 10, self.y)
 
     # If clicked and is in bounds of the triangle, clicked = True
     def on_click(self, mouse_x, mouse_y):
@@ -427,7 +602,22 @@ class Slider(Element):
             # pointer = mouse x co-ord
             else:
                 self.pointer = mouse_x
-            self.tri_rect = pygame.Rect(self.pointer - 10, self.y + 2, 20, (self.line_y - 2) - (self.y + 2))
+
+    @property
+    def pointer(self):
+        return self._pointer
+
+    # Moving the pointer updates the value, the value text and the pointer's Rect
+    # Nothing is recalculated or redrawn while the pointer stays still
+    @pointer.setter
+    def pointer(self, new_pointer):
+        if new_pointer == getattr(self, "_pointer", None):
+            return
+        self._pointer = new_pointer
+        self.value = self.get_pos()
+        self.txt = self.update_txt()
+        self.tri_rect = pygame.Rect(self.pointer - 10, self.y + 2, 20, (self.line_y - 2) - (self.y + 2))
+        self.invalidate()
 
 
 # Class for a text entry box
@@ -482,6 +672,17 @@ class Textbox(Element):
         else:
             self.is_focused = False
 
+    @property
+    def is_focused(self):
+        return self._is_focused
+
+    # The outline is only drawn when focused, so the text box is redrawn when focus changes
+    @is_focused.setter
+    def is_focused(self, new_focused):
+        if new_focused != getattr(self, "_is_focused", None):
+            self._is_focused = new_focused
+            self.invalidate()
+
     # Called every time a key is pressed
     def on_char_typed(self, key_pressed):
         # Only runs the code if the textbox is in focus
@@ -548,21 +749,25 @@ class Textbox(Element):
         if key_up == pygame.K_RSHIFT or key_up == pygame.K_LSHIFT:
             self.shift_pressed = False
 
-    def draw(self, screen):
+    # The surface has a pixel of padding on each side so that the outline is not cut off
+    def render(self):
+        surface = self.new_surface(self.width + 3, self.height + 3)
         # Draws white background box
-        pygame.draw.rect(screen, white, (self.x, self.y, self.width, self.height))
+        pygame.draw.rect(surface, white, (1, 1, self.width, self.height))
         # Draws outline if focused
         if self.is_focused:
-            pygame.draw.lines(screen, black, True, ((self.x, self.y), (self.x + self.width, self.y),
-                                                        (self.x + self.width, self.y + self.height),
-                                                        (self.x, self.y + self.height)), 2)
+            pygame.draw.lines(surface, black, True, ((1, 1), (self.width + 1, 1),
+                                                     (self.width + 1, self.height + 1),
+                                                     (1, self.height + 1)), 2)
         # Draws text if not empty
         if self.text != "":
-            screen.blit(self.txt_obj, (self.x + 2, self.y + 2))
+            surface.blit(self.txt_obj, (3, 3))
+        return surface, (self.x - 1, self.y - 1)
 
     # Called when the text in the text box is updated, recreates the text object
     def update_text(self):
             self.txt_obj = self.font.render(self.text, 1, black)
+            self.invalidate()
 
     @property
     def text(self):
@@ -599,15 +804,224 @@ class ColourPatch(Element):
                 valid = False
         if valid:
             self._rgb = new_rgb
+            self.invalidate()
         else:
             print("RGB colour must be between 0 and 255")
     
-    def draw(self, screen):
+    def render(self):
+        surface = self.new_surface(self.width + 1, self.height + 1)
         # Draws the colour
-        pygame.draw.rect(screen, self.rgb, (self.x, self.y, self.width, self.height))
+        pygame.draw.rect(surface, self.rgb, (0, 0, self.width, self.height))
         # Draws a border
-        pygame.draw.lines(screen, black, True, ((self.x, self.y), (self.x2, self.y), (self.x2, self.y2),
-                                                    (self.x, self.y2)))
+        pygame.draw.lines(surface, black, True, ((0, 0), (self.width, 0), (self.width, self.height),
+                                                 (0, self.height)))
+        return surface, (self.x, self.y)
+
+
+# Class for a live line plot of the latest samples of a value, eg. a current against time
+# Samples are kept in a ring buffer of a fixed size, so adding one never allocates memory and the oldest is forgotten
+# The plot is drawn incrementally: the cached plot area is scrolled left and only the new samples are drawn onto it.
+# When there are more samples than pixels, every column of pixels shows the lowest and highest sample that fall in it
+# Inherits all methods and attributes from Element
+class Plot(Element):
+
+    # capacity - number of samples shown across the width of the plot
+    # title - text drawn at the top left of the plot
+    # limits - the values at the bottom and top of the plot, or None to start at 0 and grow to fit the samples
+    # colour - RGB tuple for the line
+    def __init__(self, x, y, width, height, font, capacity, title="", limits=None, colour=(0, 0, 200),
+                 back_colour=white, text_colour=black):
+        Element.__init__(self, x, y, width, height, font, back_colour, text_colour)
+        self.capacity = capacity
+        self.samples = [0.0] * capacity
+        # Index of the oldest sample in samples and the number of samples stored
+        self.start = 0
+        self.count = 0
+        # Number of samples ever added, which says which samples share a column
+        self.added = 0
+        self.title = title
+        self.fixed = limits is not None
+        self.limits = limits if limits is not None else (0.0, 0.0)
+        self.colour = colour
+        # The plot area is inside a 1 pixel border, below a line for the title
+        self.header = font.get_linesize()
+        self.area_width = max(1, int(width) - 2)
+        self.area_height = max(1, int(height) - 2 - self.header)
+        # Each column of the plot is step pixels wide and shows per_column samples
+        if capacity <= self.area_width:
+            self.step = self.area_width // capacity
+            self.per_column = 1
+        else:
+            self.step = 1
+            self.per_column = math.ceil(capacity / self.area_width)
+        # Width of the part of the plot area that is used, which is at the right of it
+        self.used_width = min(self.area_width, math.ceil(capacity / self.per_column) * self.step)
+        # The scrolling plot area, and the samples added since it was last drawn
+        self.area = None
+        self.pending = []
+        # Samples of the column being filled, and the last sample drawn, which the next column joins up to
+        self.column = []
+        self.last = None
+
+    # Adds a sample, which is drawn the next time the plot is
+    def add(self, value):
+        if self.count < self.capacity:
+            self.samples[(self.start + self.count) % self.capacity] = value
+            self.count += 1
+        else:
+            self.samples[self.start] = value
+            self.start = (self.start + 1) % self.capacity
+        self.added += 1
+        # A sample outside the limits means the whole plot is redrawn with new limits
+        if not self.fixed and (value > self.limits[1] or value < self.limits[0]):
+            self.limits = (min(self.limits[0], 1.25 * value), max(self.limits[1], 1.25 * value))
+            self.invalidate()
+        elif not self.dirty:
+            self.pending.append(value)
+
+    # Forgets every sample
+    def clear(self):
+        self.count = 0
+        self.start = 0
+        self.added = 0
+        if not self.fixed:
+            self.limits = (0.0, 0.0)
+        self.invalidate()
+
+    # Returns the samples stored, oldest first
+    def values(self):
+        return [self.samples[(self.start + i) % self.capacity] for i in range(self.count)]
+
+    # The plot has to be composited again when new samples have been added
+    def is_dirty(self):
+        return self.dirty or len(self.pending) > 0
+
+    # Redraws the whole plot when it is dirty, otherwise only scrolls in the samples added since the last frame
+    def get_surface(self):
+        if self.dirty:
+            return Element.get_surface(self)
+        if self.pending:
+            self.draw_pending()
+            self.compose()
+        return self.surface, self.surface_pos
+
+    # Returns the y co-ord in the plot area of a value
+    def to_y(self, value):
+        low, high = self.limits
+        if high <= low:
+            return self.area_height - 1
+        fraction = min(max((value - low) / (high - low), 0.0), 1.0)
+        return round((self.area_height - 1) * (1 - fraction))
+
+    # Draws the pending samples onto the plot area, scrolling it left by a column for every column that is filled
+    def draw_pending(self):
+        right = self.used_width - 1
+        for value in self.pending:
+            self.column.append(value)
+            if len(self.column) < self.per_column:
+                continue
+            self.area.scroll(-self.step, 0)
+            self.area.fill(self.bg_colour, (self.used_width - self.step, 0, self.step, self.area_height))
+            if self.last is not None:
+                pygame.draw.line(self.area, self.colour, (right - self.step, self.to_y(self.last)),
+                                 (right, self.to_y(self.column[0])))
+            # A vertical line from the lowest to the highest sample of the column keeps every peak visible
+            if len(self.column) > 1:
+                pygame.draw.line(self.area, self.colour, (right, self.to_y(min(self.column))),
+                                 (right, self.to_y(max(self.column))))
+            self.last = self.column[-1]
+            self.column = []
+        self.pending = []
+
+    # Draws the plot area, border and labels onto the cached surface
+    def compose(self):
+        self.surface.fill(self.bg_colour)
+        self.surface.blit(self.area, (1 + self.area_width - self.used_width, 1 + self.header))
+        pygame.draw.rect(self.surface, self.text_colour, (0, 0, self.width, self.height), 1)
+        self.surface.blit(self.title_text, (3, 1))
+        self.surface.blit(self.limit_text, (self.width - self.limit_text.get_width() - 3, 1))
+
+    # Redraws every stored sample, which only happens when the limits or colours change
+    def render(self):
+        if self.surface is None or self.surface.get_size() != (math.ceil(self.width), math.ceil(self.height)):
+            self.surface = self.new_surface(self.width, self.height)
+        self.area = pygame.Surface((self.used_width, self.area_height))
+        self.area.fill(self.bg_colour)
+        self.title_text = self.font.render(self.title, 1, self.text_colour)
+        self.limit_text = self.font.render("{:.3g}".format(self.limits[1]), 1, self.text_colour)
+        self.column = []
+        self.last = None
+        # Samples are split into columns in the same way as when they were added, the newest column being
+        # the one still being filled. An oldest column that is only partly stored is left out
+        values = self.values()
+        filling = len(values) - self.added % self.per_column
+        self.pending = values[filling % self.per_column:filling]
+        self.draw_pending()
+        self.column = values[filling:]
+        self.compose()
+        return self.surface, (self.x, self.y)
+
+
+# Class for a bar chart of a list of values that is replaced as a whole, eg. the counts of a histogram
+# It is only redrawn when the values change. When there are more values than pixels, neighbouring values are
+# added together so each bar is at least a pixel wide
+# Inherits all methods and attributes from Element
+class BarChart(Element):
+
+    # title - text drawn at the top left of the chart, colour - RGB tuple for the bars
+    def __init__(self, x, y, width, height, font, title="", colour=(0, 0, 200), back_colour=white,
+                 text_colour=black):
+        Element.__init__(self, x, y, width, height, font, back_colour, text_colour)
+        self.title = title
+        self.colour = colour
+        self._values = []
+
+    @property
+    def title(self):
+        return self._title
+
+    @title.setter
+    def title(self, new_title):
+        if new_title != getattr(self, "_title", None):
+            self._title = new_title
+            self.invalidate()
+
+    @property
+    def values(self):
+        return self._values
+
+    # Only redraws the chart if the values actually changed
+    @values.setter
+    def values(self, new_values):
+        new_values = list(new_values)
+        if new_values != self._values:
+            self._values = new_values
+            self.invalidate()
+
+    def render(self):
+        surface = self.new_surface(self.width, self.height)
+        surface.fill(self.bg_colour)
+        # Bars are drawn inside a 1 pixel border, below a line for the title
+        header = self.font.get_linesize()
+        area_width = max(1, int(self.width) - 2)
+        area_height = max(1, int(self.height) - 2 - header)
+        values = self.values
+        if len(values) > area_width:
+            merge = math.ceil(len(values) / area_width)
+            values = [sum(values[i:i + merge]) for i in range(0, len(values), merge)]
+        top = max(values) if values else 0
+        if top > 0:
+            bar_width = area_width / len(values)
+            for i, value in enumerate(values):
+                height = round((area_height - 1) * value / top)
+                if height > 0:
+                    left = 1 + round(i * bar_width)
+                    right = 1 + round((i + 1) * bar_width)
+                    pygame.draw.rect(surface, self.colour, (left, 1 + header + area_height - height,
+                                                            max(1, right - left), height))
+        pygame.draw.rect(surface, self.text_colour, (0, 0, self.width, self.height), 1)
+        surface.blit(self.font.render(self.title, 1, self.text_colour), (3, 1))
+        return surface, (self.x, self.y)
 
 
 # A Group is a list of Elements that can be addressed all at once
@@ -641,6 +1055,8 @@ class Group(Element):
             element.rect.move_ip(self.x, self.y)
             # Run method that allows objects to do things specific to them when added
             element.on_menu_add()
+            # The element has moved so must be redrawn, which also redraws the group
+            element.invalidate()
             # Add object to elements list
             self.elements.append(element)
         except AttributeError:
@@ -648,18 +1064,64 @@ class Group(Element):
 
     # Adds text to render in the group, takes 2 parameters
     # text - the text to be added, in string form
-    def add_text(self, text, coords):
-        self.texts[0].append(self.font.render(text, 1, (255, 0, 0)))
+    # colour - optional RGB tuple for the text, red by default
+    def add_text(self, text, coords, colour=(255, 0, 0)):
+        self.texts[0].append(self.font.render(text, 1, colour))
         self.texts[1].append((coords[0] + self.x, coords[1] + self.y))
+        self.invalidate()
 
-    def draw(self, screen):
-        if self.visible:
-            # Draws each element in the group by calling its draw method
-            for element in self.elements:
-                element.draw(screen)
-            # Draws each text object in the group to the screen
-            for i in range(len(self.texts[0])):
-                screen.blit(self.texts[0][i], self.texts[1][i])
+    @property
+    def visible(self):
+        return self._visible
+
+    @visible.setter
+    def visible(self, new_visible):
+        if new_visible != getattr(self, "_visible", None):
+            self._visible = new_visible
+            self.invalidate()
+
+    # A group has to be redrawn if it or any of the elements in it have changed
+    def is_dirty(self):
+        if self.dirty:
+            return True
+        for element in self.elements:
+            if element.is_dirty():
+                return True
+        return False
+
+    # Returns the Rect of the screen covered by the group's own background
+    def frame_rect(self):
+        return pygame.Rect(self.x, self.y, self.width, self.height)
+
+    # Draws the group's own background onto the panel surface
+    # offset_x and offset_y convert screen co-ords to co-ords on the surface
+    # A Group has no background so does nothing, Menu overrides this
+    def render_frame(self, surface, offset_x, offset_y):
+        pass
+
+    # Composites the cached surfaces of all the elements and the texts into one panel surface
+    # Only elements that have changed are re-rendered, the rest reuse their cached surface
+    # The panel grows to fit elements that draw outside the group, such as an open drop-down list
+    def render(self):
+        if not self.visible:
+            return None, (self.x, self.y)
+        parts = [element.get_surface() for element in self.elements]
+        bounds = self.frame_rect()
+        for part, pos in parts:
+            if part is not None:
+                bounds.union_ip(pygame.Rect(pos, part.get_size()))
+        for i in range(len(self.texts[0])):
+            bounds.union_ip(pygame.Rect(self.texts[1][i], self.texts[0][i].get_size()))
+        panel = self.new_surface(bounds.width, bounds.height)
+        self.render_frame(panel, -bounds.x, -bounds.y)
+        # Draws each element's cached surface onto the panel
+        for part, pos in parts:
+            if part is not None:
+                panel.blit(part, (pos[0] - bounds.x, pos[1] - bounds.y))
+        # Draws each text object in the group onto the panel
+        for i in range(len(self.texts[0])):
+            panel.blit(self.texts[0][i], (self.texts[1][i][0] - bounds.x, self.texts[1][i][1] - bounds.y))
+        return panel, bounds.topleft
 
     def on_click(self, mouse_x, mouse_y):
         # Runs each element's on_click method
@@ -716,6 +1178,7 @@ class Menu(Group):
             element.rect.move_ip(self.x, self.y + self.bar_height)
             # Run method that allows objects to do things when added to a Group or menu
             element.on_menu_add()
+            element.invalidate()
             # Add to the elements list
             self.elements.append(element)
         except AttributeError:
@@ -723,28 +1186,31 @@ class Menu(Group):
 
     # Adds text to render in the menu
     # Overrides Group addText method to factor in height of menu bar
-    def add_text(self, text, coords):
-        self.texts[0].append(self.font.render(text, 1, black))
+    def add_text(self, text, coords, colour=black):
+        self.texts[0].append(self.font.render(text, 1, colour))
         self.texts[1].append((coords[0] + self.x, coords[1] + self.y + self.bar_height))
-
-    def draw(self, screen):
-        if self.visible:
-            # Draw top bar of menu
-            pygame.draw.rect(screen, (80, 80, 80), (self.x, self.y, self.width, self.bar_height))
-            # Draw title on top bar
-            screen.blit(self.txt, (self.x+2, self.y+2))
-            # Draw bg of menu
-            pygame.draw.rect(screen, (120, 120, 120), (self.x, self.y3, self.width, self.height))
-            # Draw border of menu
-            pygame.draw.lines(screen, black, True, ((self.x, self.y), (self.x, self.y2 + self.bar_height),
-                                                        (self.x2, self.y2 + self.bar_height), (self.x2, self.y)))
-            pygame.draw.line(screen, black, (self.x, self.y3), (self.x2, self.y3))
-            # Draws each element in the group by calling its draw method
-            for element in self.elements:
-                element.draw(screen)
-            # Draws each text object in the group to the screen
-            for i in range(len(self.texts[0])):
-                screen.blit(self.texts[0][i], self.texts[1][i])
+        self.invalidate()
+
+    # The menu covers its top bar as well as its main part, plus a pixel for the border
+    def frame_rect(self):
+        return pygame.Rect(self.x, self.y, self.width + 1, self.total_height + 1)
+
+    def render_frame(self, surface, offset_x, offset_y):
+        x = self.x + offset_x
+        y = self.y + offset_y
+        x2 = self.x2 + offset_x
+        y2 = self.y2 + offset_y
+        y3 = self.y3 + offset_y
+        # Draw top bar of menu
+        pygame.draw.rect(surface, (80, 80, 80), (x, y, self.width, self.bar_height))
+        # Draw title on top bar
+        surface.blit(self.txt, (x+2, y+2))
+        # Draw bg of menu
+        pygame.draw.rect(surface, (120, 120, 120), (x, y3, self.width, self.height))
+        # Draw border of menu
+        pygame.draw.lines(surface, black, True, ((x, y), (x, y2 + self.bar_height),
+                                                 (x2, y2 + self.bar_height), (x2, y)))
+        pygame.draw.line(surface, black, (x, y3), (x2, y3))
 
 
 # Checkbox is a small box which when clicked will toggle between an 'on' and 'off' state
@@ -755,23 +1221,36 @@ class Checkbox(Element):
     # off_img and on_img are the images used for the off state and on state respectively
     def __init__(self, x, y, font, width=22, height=22, off_img="dan_gui/checkboxOff", on_img="dan_gui/checkboxOn"):
         Element.__init__(self, x, y, width, height, font)
-        self.offImg = pygame.image.load("img/" + off_img + ".png")
-        self.onImg = pygame.image.load("img/" + on_img + ".png")
+        self.offImg = assets.get(off_img)
+        self.onImg = assets.get(on_img)
         # Checkbox is off by default
         self.on = False
 
-    def draw(self, screen):
+    @property
+    def on(self):
+        return self._on
+
+    @on.setter
+    def on(self, new_on):
+        if new_on != getattr(self, "_on", None):
+            self._on = new_on
+            self.invalidate()
+
+    # The surface has a pixel of padding on each side so that the border is not cut off
+    def render(self):
+        surface = self.new_surface(self.width + 3, self.height + 3)
         # Draw background rectangle
-        pygame.draw.rect(screen, self.bg_colour, (self.x, self.y, self.width, self.height))
+        pygame.draw.rect(surface, self.bg_colour, (1, 1, self.width, self.height))
         # Draw border
-        pygame.draw.lines(screen, black, True, ((self.x, self.y), (self.x, self.y2), (self.x2, self.y2),
-                                                    (self.x2, self.y)), 2)
+        pygame.draw.lines(surface, black, True, ((1, 1), (1, self.height + 1), (self.width + 1, self.height + 1),
+                                                 (self.width + 1, 1)), 2)
         # If on, draw the 'on' image
         if self.on:
-            screen.blit(self.onImg, (self.x + 2, self.y + 2))
+            surface.blit(self.onImg, (3, 3))
         # If off, draw the 'off' image
         else:
-            screen.blit(self.offImg, (self.x + 2, self.y + 2))
+            surface.blit(self.offImg, (3, 3))
+        return surface, (self.x - 1, self.y - 1)
 
     # If clicked on, toggle between on and off state
     def on_click(self, mouse_x, mouse_y):
@@ -0,0 +1,273 @@
+# differential.py checks that the fast engines in engine.py still model the same physics as the original Photon and
+# Electron classes in photoelectric.py, and measures how much faster they are
+# The original object-based loop of the GUI is run headless as the reference, then:
+# replay - the photons the reference emitted are fed into an Engine at the same frames and positions, so everything
+# after emission is deterministic and the photons absorbed, electrons created and electrons collected in every frame
+# must be exactly the same
+# statistics - the reference and each fast engine run the same configuration on the same seeds with their own
+# random numbers, so only their distributions can agree: the mean current is compared with a Welch test and the
+# electrons' kinetic energy histograms with a chi-squared test
+# Run it with python differential.py --help. The exit code is 0 if everything agrees and 1 if anything doesn't
+import argparse
+import json
+import math
+import random
+import sys
+import time
+import numpy as np
+import engine
+import photoelectric
+import stats
+
+# p-value below which a statistical difference is reported as a disagreement
+# Low, because the harness runs many tests and a false alarm is more costly than a slightly weaker test
+ALPHA = 0.001
+# Fast engines compared with the reference
+ENGINES = ("engine", "sharded", "scenes")
+
+
+# Runs the original GUI loop without drawing for a number of frames, seeded with seed
+# Returns a dictionary of:
+# events - (photons absorbed, electrons created, electrons collected) in each frame
+# emitted - (frame, x, y, kinetic energy) of each photon emitted
+# ke - the kinetic energy of every electron created, and seconds - how long it took
+# The original loop removed particles from the list it was looping over, which skipped the particle after each one
+# removed for that frame. The loops here go over copies of the lists, as the engines don't reproduce that
+def reference_run(metal, source, wavelength, intensity, stop_voltage, frames, seed):
+    Photon = photoelectric.Photon
+    Electron = photoelectric.Electron
+    random.seed(seed)
+    Photon.PhotonList = []
+    Photon.LastEmitted = 0
+    Electron.ElectronList = []
+    left_rect = photoelectric.MetalRect(*engine.LEFT_PLATE, metal.colour)
+    right_rect = photoelectric.MetalRect(*engine.RIGHT_PLATE, metal.colour)
+    # The GUI passes the wavelength in metres
+    wavelength = wavelength * math.pow(10, -9)
+    events = []
+    emitted = []
+    ke = []
+    count_collisions = 0
+    start = time.perf_counter()
+    for frame in range(frames):
+        before = len(Photon.PhotonList)
+        photoelectric.emit_photon(metal, source, intensity, wavelength)
+        if len(Photon.PhotonList) > before:
+            photon = Photon.PhotonList[-1]
+            emitted.append((frame, photon.x, photon.y, photon.kinEnergy))
+        absorbed = 0
+        before = len(Electron.ElectronList)
+        for photon in list(Photon.PhotonList):
+            photon.move()
+            if photon.rect.colliderect(left_rect.rect):
+                absorbed += 1
+            count_collisions = photon.check_collision(left_rect, stop_voltage, count_collisions)
+        ke += [electron.kinEnergy for electron in Electron.ElectronList[before:]]
+        created = len(Electron.ElectronList) - before
+        before = len(Electron.ElectronList)
+        for electron in list(Electron.ElectronList):
+            electron.move()
+            electron.check_pos(right_rect.rect)
+        events.append((absorbed, created, before - len(Electron.ElectronList)))
+    return {"events": events, "emitted": emitted, "ke": ke, "seconds": time.perf_counter() - start}
+
+
+# Feeds the photons emitted by a reference run into an Engine built from config at the same frames, and returns
+# the same events per frame as reference_run and the engine
+def replay(config, emitted, frames):
+    # With no intensity the engine emits nothing itself
+    replayed = engine.Engine.from_config(dict(config, intensity=0))
+    by_frame = {}
+    for frame, x, y, ke in emitted:
+        by_frame.setdefault(frame, []).append((x, y, ke))
+    events = []
+    for frame in range(frames):
+        for x, y, ke in by_frame.get(frame, ()):
+            replayed.photons.append(x=[x], y=[y], ke=[ke], wavelength=[config["wavelength"]], weight=[1.0],
+                                    vx=[engine.PHOTON_SPEED[0]], vy=[engine.PHOTON_SPEED[1]], life=[np.inf],
+                                    hits=[False])
+        before = (replayed.photons_absorbed, replayed.electrons_emitted, replayed.electrons_collected)
+        replayed.step()
+        after = (replayed.photons_absorbed, replayed.electrons_emitted, replayed.electrons_collected)
+        events.append(tuple(b - a for a, b in zip(before, after)))
+    return events, replayed
+
+
+# Returns the two sided p-value of a Welch test that two samples have the same mean
+# With the few runs used here the normal distribution stands in for Student's t, which makes the test slightly
+# too eager to find a difference, never too lenient
+def welch(a, b):
+    a = np.asarray(a, np.float64)
+    b = np.asarray(b, np.float64)
+    error = math.sqrt(a.var(ddof=1) / len(a) + b.var(ddof=1) / len(b))
+    difference = float(a.mean() - b.mean())
+    if error == 0:
+        return 0.0, 1.0 if difference == 0 else 0.0
+    z = difference / error
+    return z, math.erfc(abs(z) / math.sqrt(2))
+
+
+# Returns the statistic, degrees of freedom and p-value of a chi-squared test that two histograms of counts are
+# drawn from the same distribution. Bins that are empty in both are left out
+# The p-value uses the Wilson-Hilferty approximation of the chi-squared distribution, so numpy is enough
+def chi_squared(a, b):
+    a = np.asarray(a, np.float64)
+    b = np.asarray(b, np.float64)
+    total_a = a.sum()
+    total_b = b.sum()
+    if total_a == 0 or total_b == 0:
+        return 0.0, 0, 1.0 if total_a == total_b else 0.0
+    used = (a + b) > 0
+    a = a[used]
+    b = b[used]
+    statistic = float(np.sum((a * math.sqrt(total_b / total_a) - b * math.sqrt(total_a / total_b)) ** 2 / (a + b)))
+    dof = len(a) - 1
+    if dof == 0:
+        return statistic, 0, 1.0
+    z = ((statistic / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return statistic, dof, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+# Runs one of the fast engines on the config once per seed
+# Returns the current of each run, the kinetic energy histogram of all of them together and the seconds it took
+def engine_runs(kind, config, seeds, shards):
+    configs = [dict(config, seed=seed) for seed in seeds]
+    start = time.perf_counter()
+    if kind == "scenes":
+        # Every seed is one scene, so they all run together
+        scenes = engine.SceneEngine.from_configs(configs)
+        scenes.run(config["duration"])
+        results = [(result, scene.stats) for result, scene in zip(scenes.results(), scenes.scenes)]
+    elif kind == "sharded":
+        results = []
+        for run_config in configs:
+            with engine.ShardedEngine.from_config(run_config, workers=shards) as sharded:
+                sharded.run(config["duration"])
+                results.append((sharded.results(), sharded.stats))
+    else:
+        results = []
+        for run_config in configs:
+            simulation = engine.Engine.from_config(run_config)
+            simulation.run(config["duration"])
+            results.append((simulation.results(), simulation.stats))
+    seconds = time.perf_counter() - start
+    histogram = sum(run_stats.ke_histogram.counts for result, run_stats in results)
+    return [result["current"] for result, run_stats in results], histogram, seconds
+
+
+# Runs the reference and the fast engines on config, which must be a config made by photoelectric.make_config,
+# and returns a report of how well they agree and how long they took
+# runs - number of seeds, starting from config's seed, shards - worker processes of the sharded engine
+def compare(config, runs=10, shards=2, engines=ENGINES, alpha=ALPHA):
+    # The reference emits one photon at a time of exactly the slider's wavelength, straight at the plate,
+    # and takes the voltage off each electron's energy
+    config = dict(config, budget=None, monochromatic=True, field=False, cone=False, shards=1)
+    photoelectric.load_defaults()
+    metal = photoelectric.find_by_name(photoelectric.Metal.MetalList, config["metal"], "metal")
+    source = photoelectric.find_by_name(photoelectric.Source.SourceList, config["source"], "source")
+    frames = round(config["duration"] * engine.FPS)
+    first_seed = config["seed"] or 0
+    seeds = list(range(first_seed, first_seed + runs))
+
+    reference_seconds = 0.0
+    reference_currents = []
+    reference_stats = stats.ElectronStats()
+    mismatched = 0
+    first_mismatch = None
+    ke_difference = 0.0
+    for seed in seeds:
+        reference = reference_run(metal, source, config["wavelength"], config["intensity"], config["stop_voltage"],
+                                  frames, seed)
+        reference_seconds += reference["seconds"]
+        ke = np.array(reference["ke"], np.float64)
+        reference_currents.append(len(ke) * engine.CHARGE / (frames / engine.FPS))
+        reference_stats.created(ke, engine.electron_speed(np.maximum(ke, 0)), np.ones(len(ke)))
+        events, replayed = replay(config, reference["emitted"], frames)
+        for frame, (expected, actual) in enumerate(zip(reference["events"], events)):
+            if expected != actual:
+                mismatched += 1
+                if first_mismatch is None:
+                    first_mismatch = {"seed": seed, "frame": frame, "reference": expected, "engine": actual}
+        # The engine takes the voltage off with engine.CHARGE instead of 1.6 * 10^-19 multiplied in a different
+        # order, so energies can differ in the last bits
+        if ke.sum() > 0:
+            ke_difference = max(ke_difference, float(abs(replayed.total_ke - ke.sum()) / ke.sum()))
+
+    report = {
+        "config": config,
+        "runs": runs,
+        "frames": frames,
+        "alpha": alpha,
+        "reference_seconds": reference_seconds,
+        "reference_current": float(np.mean(reference_currents)),
+        "replay": {
+            "frames": frames * runs,
+            "mismatched_frames": mismatched,
+            "first_mismatch": first_mismatch,
+            "ke_relative_difference": ke_difference,
+            "agrees": mismatched == 0 and ke_difference < 1e-9,
+        },
+        "engines": {},
+    }
+    agrees = report["replay"]["agrees"]
+    for kind in engines:
+        currents, histogram, seconds = engine_runs(kind, config, seeds, shards)
+        z, current_p = welch(currents, reference_currents)
+        statistic, dof, histogram_p = chi_squared(histogram, reference_stats.ke_histogram.counts)
+        engine_agrees = current_p >= alpha and histogram_p >= alpha
+        agrees = agrees and engine_agrees
+        report["engines"][kind] = {
+            "seconds": seconds,
+            "speedup": reference_seconds / seconds if seconds > 0 else None,
+            "current": float(np.mean(currents)),
+            "current_z": z,
+            "current_p": current_p,
+            "ke_chi_squared": statistic,
+            "ke_dof": dof,
+            "ke_p": histogram_p,
+            "agrees": engine_agrees,
+        }
+    report["agrees"] = agrees
+    return report
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python differential.py",
+                                     description="Compare the fast engines with the original simulation loop.")
+    parser.add_argument("--metal", default="Sodio")
+    parser.add_argument("--source", default="Laser")
+    parser.add_argument("--wavelength", type=float, default=400, help="wavelength in nm (default 400)")
+    parser.add_argument("--intensity", type=float, default=100, help="intensity from 0 to 100 (default 100)")
+    parser.add_argument("--stop-voltage", type=float, default=0, help="stopping voltage in V (default 0)")
+    parser.add_argument("--duration", type=float, default=20, help="simulated seconds per run (default 20)")
+    parser.add_argument("--runs", type=int, default=10, help="seeds to run (default 10)")
+    parser.add_argument("--seed", type=int, default=0, help="first seed (default 0)")
+    parser.add_argument("--shards", type=int, default=2, help="processes of the sharded engine (default 2)")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES),
+                        help="fast engines to compare (default all)")
+    parser.add_argument("--alpha", type=float, default=ALPHA,
+                        help="p-value below which a difference counts as a disagreement (default " + str(ALPHA) + ")")
+    return parser
+
+
+# Entry point, prints the report as JSON and returns the exit code
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        config = photoelectric.make_config(args.metal, args.source, args.wavelength, args.intensity,
+                                           args.stop_voltage, args.duration, args.seed)
+        if args.duration <= 0 or args.runs < 2 or args.shards < 1:
+            raise ValueError("--duration and --shards must be positive and --runs at least 2")
+    except ValueError as error:
+        print("Error: " + str(error), file=sys.stderr)
+        return photoelectric.EXIT_USAGE
+    try:
+        report = compare(config, args.runs, args.shards, args.engines, args.alpha)
+    except KeyboardInterrupt:
+        return photoelectric.EXIT_INTERRUPTED
+    print(json.dumps(report, indent=2))
+    return photoelectric.EXIT_OK if report["agrees"] else photoelectric.EXIT_FAILURE
+
+
+if __name__ == "__main__":
+    sys.exit(main())
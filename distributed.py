@@ -0,0 +1,307 @@
+# distributed.py runs the simulations of a sweep on other computers. A coordinator splits the configs into chunks
+# and hands them to the workers connected to it over TCP, one chunk per worker at a time, then puts the results back
+# in the order of the configs, so a distributed sweep gives the same results as a local one
+# Messages are JSON objects, one per line:
+# worker to coordinator - {"type": "hello", "name": ..., "engine_version": ...} once connected, then
+# {"type": "heartbeat"} every HEARTBEAT seconds while it simulates a chunk, and
+# {"type": "results", "id": ..., "results": [...]} or {"type": "failed", "id": ..., "message": ...} for it
+# coordinator to worker - {"type": "chunk", "id": ..., "configs": [...], "cache": ...} to simulate,
+# {"type": "done"} when there is nothing more to do and {"type": "error", "message": ...} if it is refused
+# A worker that disconnects or goes quiet for longer than the timeout is taken as dead, and its chunk is given to
+# another worker. Only configs and results are sent, never code, but anyone who can connect can take part, so the
+# coordinator only listens on localhost unless told otherwise
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import cache
+import engine
+
+# Seconds between a worker's heartbeats, and the default seconds without any message before it is taken as dead
+HEARTBEAT = 5
+TIMEOUT = 30
+# Times a chunk may fail on a worker before the whole sweep fails
+ATTEMPTS = 3
+# Longest message line in bytes
+MAX_LINE = 16 * 1024 * 1024
+# Seconds a worker keeps trying to connect, so workers can be started before the coordinator
+CONNECT_WAIT = 30
+
+
+# Configs of a sweep handed to a worker together
+class Chunk:
+
+    def __init__(self, id, batch, start, configs):
+        self.id = id
+        self.batch = batch
+        # Index of the first config in the batch's configs
+        self.start = start
+        self.configs = configs
+        self.failures = 0
+        self.done = False
+
+
+# Configs passed to one call of Coordinator.map and their results so far
+class Batch:
+
+    def __init__(self, configs, future):
+        self.results = [None] * len(configs)
+        self.remaining = len(configs)
+        self.future = future
+
+
+# Class that hands out the simulations of sweeps to workers
+# host and port - where to listen for workers, port 0 picks a free port
+# chunk_size - configs per chunk, larger chunks mean fewer messages but more work repeated when a worker dies
+# timeout - seconds without a message from a busy worker before it is taken as dead
+# use_cache - whether workers may take results from their own cache, see cache.simulate
+# log - function called with a line of text for each worker that connects or is lost, None for no log
+class Coordinator:
+
+    def __init__(self, host="127.0.0.1", port=8766, chunk_size=1, timeout=TIMEOUT, use_cache=True, log=None):
+        self.host = host
+        self.port = port
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.use_cache = use_cache
+        self.log = log
+        self.next_id = 0
+        # Chunks waiting for a worker, those given back by dead workers go to the front
+        self.queue = collections.deque()
+        self.workers = 0
+        self.loop = None
+        self.thread = None
+        self.stopping = None
+        self.changed = None
+        self.started = threading.Event()
+        self.error = None
+
+    # Starts listening on a background thread
+    # Raises OSError if it can't listen, eg. because the port is already used
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except OSError as error:
+            self.error = error
+            self.started.set()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        # Notified whenever chunks are queued or the coordinator stops
+        self.changed = asyncio.Condition()
+        server = await asyncio.start_server(self.handle, self.host, self.port, limit=MAX_LINE)
+        self.port = server.sockets[0].getsockname()[1]
+        self.started.set()
+        async with server:
+            await self.stopping.wait()
+
+    def note(self, text):
+        if self.log is not None:
+            self.log(text)
+
+    # Returns the results of simulating each of configs, in the same order, once workers have simulated them all
+    # Can be called from any thread but the coordinator's, and waits for workers to connect if there are none
+    # Raises RuntimeError if a chunk failed ATTEMPTS times
+    def map(self, configs):
+        if not configs:
+            return []
+        return asyncio.run_coroutine_threadsafe(self.submit(list(configs)), self.loop).result()
+
+    async def submit(self, configs):
+        batch = Batch(configs, self.loop.create_future())
+        for start in range(0, len(configs), self.chunk_size):
+            self.queue.append(Chunk(self.next_id, batch, start, configs[start:start + self.chunk_size]))
+            self.next_id += 1
+        async with self.changed:
+            self.changed.notify_all()
+        return await batch.future
+
+    # Returns the next chunk still worth simulating, waiting for one, or None once the coordinator stops
+    async def next_chunk(self):
+        async with self.changed:
+            while True:
+                while self.queue:
+                    chunk = self.queue.popleft()
+                    if not chunk.done and not chunk.batch.future.done():
+                        return chunk
+                if self.stopping.is_set():
+                    return None
+                await self.changed.wait()
+
+    # Puts a chunk's results in its batch, unless another worker already finished it
+    @staticmethod
+    def complete(chunk, results):
+        if chunk.done or chunk.batch.future.done():
+            return
+        if not isinstance(results, list) or len(results) != len(chunk.configs):
+            raise ValueError("expected " + str(len(chunk.configs)) + " results")
+        chunk.done = True
+        batch = chunk.batch
+        batch.results[chunk.start:chunk.start + len(results)] = results
+        batch.remaining -= len(results)
+        if batch.remaining == 0:
+            batch.future.set_result(batch.results)
+
+    # Gives a chunk back to the queue, ahead of the others, if it still needs simulating
+    async def requeue(self, chunk):
+        if chunk.done or chunk.batch.future.done():
+            return
+        async with self.changed:
+            self.queue.appendleft(chunk)
+            self.changed.notify_all()
+
+    @staticmethod
+    async def send(writer, message):
+        writer.write((json.dumps(message) + "\n").encode())
+        await writer.drain()
+
+    # Reads the next message from a worker, raising asyncio.TimeoutError if it doesn't come within the timeout
+    async def receive(self, reader):
+        line = await asyncio.wait_for(reader.readline(), self.timeout)
+        if not line:
+            raise ConnectionError("disconnected")
+        message = json.loads(line)
+        if not isinstance(message, dict):
+            raise ValueError("messages must be JSON objects")
+        return message
+
+    # Runs for as long as a worker is connected, giving it chunks and collecting their results
+    async def handle(self, reader, writer):
+        name = str(writer.get_extra_info("peername"))
+        chunk = None
+        try:
+            hello = await self.receive(reader)
+            if hello.get("type") != "hello":
+                raise ValueError("expected hello")
+            name = str(hello.get("name", name))
+            # Results from another version of the engine would not match the others
+            if hello.get("engine_version") != engine.ENGINE_VERSION:
+                await Coordinator.send(writer, {"type": "error", "message": "engine version " + str(
+                    hello.get("engine_version")) + " does not match the coordinator's " + str(engine.ENGINE_VERSION)})
+                raise ValueError("engine version does not match")
+            self.workers += 1
+            self.note("worker " + name + " connected, " + str(self.workers) + " connected")
+            try:
+                while True:
+                    chunk = await self.next_chunk()
+                    if chunk is None:
+                        await Coordinator.send(writer, {"type": "done"})
+                        break
+                    await Coordinator.send(writer, {"type": "chunk", "id": chunk.id, "configs": chunk.configs,
+                                                    "cache": self.use_cache})
+                    message = await self.receive(reader)
+                    while message.get("type") == "heartbeat":
+                        message = await self.receive(reader)
+                    if message.get("id") != chunk.id:
+                        raise ValueError("reply for the wrong chunk")
+                    if message.get("type") == "results":
+                        Coordinator.complete(chunk, message.get("results"))
+                    elif message.get("type") == "failed":
+                        chunk.failures += 1
+                        self.note("chunk " + str(chunk.id) + " failed on " + name + ": " + str(message.get("message")))
+                        if chunk.failures >= ATTEMPTS and not chunk.batch.future.done():
+                            chunk.batch.future.set_exception(RuntimeError(
+                                "chunk failed " + str(ATTEMPTS) + " times: " + str(message.get("message"))))
+                        await self.requeue(chunk)
+                    else:
+                        raise ValueError("unexpected message")
+                    chunk = None
+            finally:
+                self.workers -= 1
+        except (ConnectionError, asyncio.TimeoutError, ValueError) as error:
+            self.note("worker " + name + " lost: " + (str(error) or "no message for " + str(self.timeout) + " s"))
+        finally:
+            if chunk is not None:
+                await self.requeue(chunk)
+            writer.close()
+
+    # Tells idle workers there is nothing more to do and stops listening, can be called from any thread
+    def stop(self):
+        if self.loop is not None and self.thread.is_alive():
+            async def stopping():
+                async with self.changed:
+                    self.stopping.set()
+                    self.changed.notify_all()
+            asyncio.run_coroutine_threadsafe(stopping(), self.loop).result()
+            self.thread.join()
+
+
+# Returns a socket connected to the coordinator, trying again for up to wait seconds
+def connect(host, port, wait=CONNECT_WAIT):
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            return socket.create_connection((host, port))
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(1)
+
+
+# Connects to a coordinator and simulates the chunks it hands out until it says it is done
+# Returns the number of chunks simulated. Raises OSError if the connection fails and ConnectionError if refused
+# workers - processes to simulate each chunk with, 0 for one per core
+def work(host, port, workers=1, name=None, wait=CONNECT_WAIT):
+    if workers == 0:
+        workers = os.cpu_count()
+    name = name or socket.gethostname() + ":" + str(os.getpid())
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    connection = connect(host, port, wait)
+    lock = threading.Lock()
+
+    def send(message):
+        with lock:
+            connection.sendall((json.dumps(message) + "\n").encode())
+
+    chunks = 0
+    try:
+        send({"type": "hello", "name": name, "engine_version": engine.ENGINE_VERSION})
+        for line in connection.makefile("r", encoding="utf-8"):
+            message = json.loads(line)
+            if message["type"] == "done":
+                break
+            if message["type"] == "error":
+                raise ConnectionError(message["message"])
+            function = cache.simulate if message["cache"] else engine.simulate
+            configs = message["configs"]
+            # The heartbeats show the coordinator this worker is still alive however long the chunk takes
+            finished = threading.Event()
+
+            def beat():
+                while not finished.wait(HEARTBEAT):
+                    send({"type": "heartbeat"})
+
+            beater = threading.Thread(target=beat, daemon=True)
+            beater.start()
+            try:
+                # Sharded runs start processes of their own, which pool processes cannot
+                if pool is None or any(config.get("shards", 1) > 1 for config in configs):
+                    results = [function(config) for config in configs]
+                else:
+                    results = pool.map(function, configs)
+            except Exception as error:
+                reply = {"type": "failed", "id": message["id"], "message": repr(error)}
+            else:
+                reply = {"type": "results", "id": message["id"], "results": results}
+                chunks += 1
+            finally:
+                finished.set()
+                beater.join()
+            send(reply)
+    finally:
+        connection.close()
+        if pool is not None:
+            pool.terminate()
+    return chunks
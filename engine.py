@@ -0,0 +1,1154 @@
+# engine.py is the headless simulation engine
+# It models the same physics as the Photon and Electron classes in photoelectric.py
+# but keeps every particle in numpy arrays, so it runs without pygame or a display and much faster
+import functools
+import math
+import os
+import random
+import multiprocessing
+from multiprocessing import shared_memory
+import threading
+import time
+import types
+import numpy as np
+import qmc
+import stats
+
+# Version of the engine's physics, stored with every result
+# Must be increased whenever a change to the engine changes its results
+ENGINE_VERSION = 4
+
+# Physical constants
+PLANCK = 6.62607004 * math.pow(10, -34)
+LIGHT_SPEED = 3 * math.pow(10, 8)
+CHARGE = 1.6 * math.pow(10, -19)
+ELECTRON_MASS = 9.11 * math.pow(10, -31)
+BOLTZMANN = 1.38064852 * math.pow(10, -23)
+# Wien's displacement constant in nm K, a blackbody at temperature T is brightest at WIEN / T nm
+WIEN = 2.897771955 * math.pow(10, 6)
+
+# Number of frames in one second of simulation, the same as the ticks of the GUI
+FPS = 30
+
+# Geometry of the scene in pixels, the same as in photoelectric.py
+PHOTON_RADIUS = 4
+ELECTRON_RADIUS = 5
+# Pixels a photon moves in each axis per frame
+PHOTON_SPEED = (-10, 4)
+# Pixels a photon moves per frame, and the degrees below the horizontal it moves at, going left
+PHOTON_STEP = math.hypot(*PHOTON_SPEED)
+PHOTON_DIRECTION = math.degrees(math.atan2(PHOTON_SPEED[1], -PHOTON_SPEED[0]))
+# x, y, width and height of the metal plates
+LEFT_PLATE = (10, 360, 50, 210)
+RIGHT_PLATE = (740, 360, 50, 210)
+# x co-ord electrons are created at
+ELECTRON_START_X = 60
+# Distance in pixels an electron travels from where it is created until it touches the right plate
+# The stopping voltage is applied across it when the electric field is simulated
+FIELD_GAP = RIGHT_PLATE[0] - 2 * ELECTRON_RADIUS - ELECTRON_START_X
+# Photons further left or further down than these are off screen
+SCREEN_LEFT = -2 * PHOTON_RADIUS
+SCREEN_BOTTOM = 800 + 2 * PHOTON_RADIUS
+# Photons further up than this are off screen, only photons emitted in a cone can go up
+SCREEN_TOP = -2 * PHOTON_RADIUS
+
+
+# Step in nm between the wavelengths a source's spectrum is tabulated at
+SPECTRUM_STEP = 0.5
+
+
+# Attributes of each photon and electron and their numpy dtypes
+# weight is the number of real particles a simulated (macro) particle stands for
+# vx and vy are a photon's velocity in pixels per frame, life is the number of frames until it hits the left plate
+# (if hits is True) or leaves the screen, worked out when it is emitted, or infinity if it is checked every frame
+PHOTON_FIELDS = {"x": np.float64, "y": np.float64, "ke": np.float64, "wavelength": np.float64, "weight": np.float64,
+                 "vx": np.float64, "vy": np.float64, "life": np.float64, "hits": np.bool_}
+ELECTRON_FIELDS = {"x": np.float64, "y": np.float64, "ke": np.float64, "speed": np.float64, "weight": np.float64}
+# Totals an engine keeps over a whole simulation, which are added together when engines run in parallel
+COUNTERS = ("photons_emitted", "photons_absorbed", "photons_missed", "electrons_emitted", "electrons_collected",
+            "electrons_returned", "real_electrons", "real_collected", "total_ke", "count_collisions", "current",
+            "dropped")
+# Longest an electron is expected to live in frames, used when choosing the weight of macro-particles
+MAX_ELECTRON_LIFE = 30 * FPS
+
+
+# Returns the energy in joules of a photon with a wavelength in nanometres
+def photon_energy(wavelength):
+    frequency = LIGHT_SPEED / (wavelength * math.pow(10, -9))
+    return PLANCK * frequency
+
+
+# Returns the speed in m/s of an electron with kinetic energy ke in joules, which can also be an array
+def electron_speed(ke):
+    return np.sqrt((2 * ke) / ELECTRON_MASS)
+
+
+# Pixels per frame an electron moves for each m/s of its real speed when the electric field is simulated
+# Chosen so that a 1 eV electron moves 1.6 pixels per frame, the same as in the original model
+FIELD_SPEED_SCALE = CHARGE * math.pow(10, 19) / math.sqrt(2 * CHARGE / ELECTRON_MASS)
+
+
+# Returns the speed in pixels per frame of electrons with kinetic energy ke in joules in the electric field model
+def field_speed(ke):
+    return FIELD_SPEED_SCALE * electron_speed(ke)
+
+
+# Returns the mean speed in m/s of electrons, each weighted by the real electrons it stands for
+# In the field their speed changes as they cross, so it is taken from their speed in pixels per frame. Without it
+# they keep the speed of the kinetic energy they were emitted with
+def live_speed(electrons, field):
+    weight = electrons["weight"]
+    total = weight.sum()
+    if total == 0:
+        return 0.0
+    if field:
+        speed = np.abs(electrons["speed"]) / FIELD_SPEED_SCALE
+    else:
+        speed = electron_speed(electrons["ke"])
+    return float((speed * weight).sum() / total)
+
+
+# Returns the acceleration in pixels per frame squared of an electron between the plates at a stopping voltage
+# The field is uniform, so the electron loses exactly the energy charge * voltage crossing FIELD_GAP
+# A positive (retarding) voltage slows electrons down, a negative one speeds them up
+def field_acceleration(voltage):
+    return -voltage * CHARGE * FIELD_SPEED_SCALE ** 2 / (ELECTRON_MASS * FIELD_GAP)
+
+
+# Returns the frames electrons starting at speed (pixels per frame) take to reach the right plate with a constant
+# acceleration, or to turn round and come back to the left plate if they can't reach it. Works on arrays
+def field_transit(speed, acceleration):
+    speed = np.asarray(speed, np.float64)
+    # Square of the speed the electron would have at the right plate, negative if it turns round before it
+    arrival = speed * speed + 2 * acceleration * FIELD_GAP
+    if acceleration == 0:
+        return FIELD_GAP / np.maximum(speed, 1e-9)
+    return np.where(arrival > 0, (np.sqrt(np.maximum(arrival, 0)) - speed) / acceleration, -2 * speed / acceleration)
+
+
+# Returns a boolean array of which rectangles (x, y, width, height) overlap the rectangle rect
+# Works the same way as pygame's Rect.colliderect: touching edges do not count as a collision
+def overlaps(x, y, width, height, rect):
+    return (x < rect[0] + rect[2]) & (x + width > rect[0]) & (y < rect[1] + rect[3]) & (y + height > rect[1])
+
+
+# Works out where photons starting at x, y with velocities vx, vy (arrays, in pixels per frame) end up
+# Each photon's square is a ray cast against the left plate: the ray hits it if the times it is inside the plate's
+# columns and rows overlap. Returns a mask of the photons that hit the plate and the frame of the collision,
+# or for those that miss, the frame they leave the screen
+def cast_photons(x, y, vx, vy):
+    size = 2 * PHOTON_RADIUS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Times the photon's square starts and stops overlapping the plate along each axis
+        x_times = ((LEFT_PLATE[0] - size - x) / vx, (LEFT_PLATE[0] + LEFT_PLATE[2] - x) / vx)
+        y_times = ((LEFT_PLATE[1] - size - y) / vy, (LEFT_PLATE[1] + LEFT_PLATE[3] - y) / vy)
+        enter = np.maximum(np.minimum(*x_times), np.minimum(*y_times))
+        leave = np.minimum(np.maximum(*x_times), np.maximum(*y_times))
+        hits = (enter < leave) & (leave > 0)
+        # Photons that miss move until they are past the left, bottom or top of the screen
+        off_x = (SCREEN_LEFT - x) / vx
+        off_y = np.where(vy > 0, (SCREEN_BOTTOM - y) / vy, (SCREEN_TOP - y) / vy)
+        off = np.minimum(np.where(off_x > 0, off_x, np.inf), np.where(off_y > 0, off_y, np.inf))
+    # Photons are checked at the end of every frame, so the first whole frame after the time counts
+    frames = np.floor(np.where(hits, np.maximum(enter, 0), off)) + 1
+    return hits, frames
+
+
+# Moves every photon in a ParticleArrays one frame
+# Returns a mask of the photons that hit the left plate and a mask of those to remove, which includes those off screen
+def advance_photons(photons):
+    x = photons["x"]
+    y = photons["y"]
+    x += photons["vx"]
+    y += photons["vy"]
+    life = photons["life"]
+    life -= 1
+    # Photons cast when they were emitted only have to count down
+    done = life <= 0
+    hit = done & photons["hits"]
+    gone = done
+    checked = np.isinf(life)
+    if checked.any():
+        # The others are checked against the plate every frame, like in the original GUI
+        # pygame Rects have integer co-ords, so the positions are truncated before checking collisions
+        collided = checked & overlaps(np.trunc(x), np.trunc(y), 2 * PHOTON_RADIUS, 2 * PHOTON_RADIUS, LEFT_PLATE)
+        hit = hit | collided
+        gone = gone | collided | (checked & ((x < SCREEN_LEFT) | (y > SCREEN_BOTTOM)))
+    return hit, gone
+
+
+# Moves every electron in a ParticleArrays one frame with a velocity Verlet step
+# acceleration - in pixels per frame squared, either one number or one per electron. With no acceleration electrons
+# move at a constant speed like in the original model. The field is uniform, so one step per frame is exact
+# Returns a mask of the electrons that reached the right plate and a mask of those that turned round and
+# came back to the left plate
+def advance_electrons(electrons, acceleration=0.0):
+    x = electrons["x"]
+    speed = electrons["speed"]
+    x += speed + 0.5 * acceleration
+    speed += acceleration
+    # Electrons are drawn at rounded co-ords, which are also used for collisions
+    # Any electron that has reached the plate is collected, even if it moved past it in one frame
+    size = 2 * ELECTRON_RADIUS
+    draw_y = np.round(electrons["y"])
+    collected = ((np.round(x) + size > RIGHT_PLATE[0])
+                 & (draw_y < RIGHT_PLATE[1] + RIGHT_PLATE[3]) & (draw_y + size > RIGHT_PLATE[1]))
+    return collected, x < ELECTRON_START_X
+
+
+# Class that draws values from a discrete distribution in constant time per draw, using Walker's alias method
+# values - the values that can be drawn, weights - how likely each one is, they don't need to add up to 1
+class AliasTable:
+
+    def __init__(self, values, weights):
+        self.values = np.asarray(values, np.float64)
+        n = len(self.values)
+        scaled = np.asarray(weights, np.float64) * n / np.sum(weights)
+        # Probability of keeping each column's own value, otherwise its alias is drawn
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            # The large column gives away what fills the small column up to 1
+            scaled[more] -= 1 - scaled[less]
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+        # Probability of each value and the expected value, used to turn a power into a number of photons
+        self.weights = np.asarray(weights, np.float64) / np.sum(weights)
+        self.mean = float(np.dot(self.values, self.weights))
+        # Probability of each value or a lower one, for quantile
+        self.cumulative = np.cumsum(self.weights)
+
+    def __len__(self):
+        return len(self.values)
+
+    # Draws n values using the random generator rng
+    def sample(self, rng, n):
+        columns = rng.integers(0, len(self.values), n)
+        keep = rng.random(n) < self.prob[columns]
+        return self.values[np.where(keep, columns, self.alias[columns])]
+
+    # Returns the values with a probability u (an array of numbers from 0 to 1) of drawing them or a lower one
+    # Unlike sample, values next to each other in u stay next to each other, which quasi-random numbers need
+    def quantile(self, u):
+        return self.values[np.minimum(np.searchsorted(self.cumulative, u), len(self.values) - 1)]
+
+
+# Returns the relative intensity of each wavelength in nm a source emits, when its slider is set to peak
+# kind is the shape of the spectrum:
+# "line" - a laser, a narrow normal distribution with standard deviation width nm
+# "band" - a LED or infrared emitter, a wider normal distribution with standard deviation width nm
+# "blackbody" - a bulb or lamp, Planck's law at the temperature whose spectrum peaks at peak
+def spectrum(kind, width, wavelengths, peak):
+    if kind == "blackbody":
+        temperature = WIEN / peak
+        metres = wavelengths * math.pow(10, -9)
+        exponent = np.minimum(PLANCK * LIGHT_SPEED / (metres * BOLTZMANN * temperature), 700)
+        radiance = 1 / (metres ** 5 * np.expm1(exponent))
+        # Dividing by the brightest value keeps the numbers in a sensible range
+        return radiance / radiance.max()
+    return np.exp(-0.5 * ((wavelengths - peak) / width) ** 2)
+
+
+# Returns the alias table for a source's spectrum, cut off at the wavelengths low and high it can emit
+# Tables are cached, so moving the slider back to a wavelength doesn't build its table again
+@functools.lru_cache(maxsize=256)
+def spectrum_table(kind, width, low, high, peak):
+    # A line narrower than the step would fall between two steps, so it is drawn as a single wavelength
+    if kind == "line" and width < SPECTRUM_STEP:
+        return AliasTable([peak], [1.0])
+    wavelengths = np.arange(low, high + SPECTRUM_STEP / 2, SPECTRUM_STEP)
+    return AliasTable(wavelengths, spectrum(kind, width, wavelengths, peak))
+
+
+# Class that stores a set of particles as one numpy array per attribute (a structure of arrays)
+# The arrays have spare capacity which doubles whenever it runs out, so adding particles is cheap
+class ParticleArrays:
+
+    # fields - dictionary of attribute names and the numpy dtype of each one
+    # capacity - number of particles there is room for before the arrays have to grow
+    def __init__(self, fields, capacity=64):
+        self.fields = fields
+        self.count = 0
+        self.data = {name: np.zeros(capacity, dtype) for name, dtype in fields.items()}
+
+    # Returns a view of the live particles' values of one attribute
+    def __getitem__(self, name):
+        return self.data[name][:self.count]
+
+    def __len__(self):
+        return self.count
+
+    # Returns how many particles the arrays have room for
+    @property
+    def capacity(self):
+        return len(next(iter(self.data.values())))
+
+    # Adds particles, each keyword argument is an array of values for one attribute
+    # All arrays must be the same length, attributes that are not given are set to 0
+    def append(self, **values):
+        n = len(next(iter(values.values())))
+        if n == 0:
+            return
+        if self.count + n > self.capacity:
+            self.grow(self.count + n)
+        for name in self.fields:
+            if name in values:
+                self.data[name][self.count:self.count + n] = values[name]
+            else:
+                self.data[name][self.count:self.count + n] = 0
+        self.count += n
+
+    # Doubles the capacity until there is room for at least minimum particles
+    def grow(self, minimum):
+        capacity = self.capacity
+        while capacity < minimum:
+            capacity *= 2
+        for name, array in self.data.items():
+            new_array = np.zeros(capacity, array.dtype)
+            new_array[:self.count] = array[:self.count]
+            self.data[name] = new_array
+
+    # Removes every particle where mask is False, keeping the rest in order
+    def keep(self, mask):
+        n = int(np.count_nonzero(mask))
+        if n == self.count:
+            return
+        for array in self.data.values():
+            array[:n] = array[:self.count][mask]
+        self.count = n
+
+
+# Particle arrays stored in a block of shared memory so that other processes can read and update them
+# The block holds the particle count followed by each attribute's array, so its capacity is fixed
+# Particles added when the arrays are full are dropped and counted in dropped
+class SharedParticleArrays(ParticleArrays):
+
+    # fields - dictionary of attribute names and numpy dtypes
+    # capacity - the number of particles the block has room for
+    # name - name of an existing block to attach to, a new block is created if None
+    def __init__(self, fields, capacity, name=None):
+        self.fields = fields
+        self.dropped = 0
+        sizes = [SharedParticleArrays.aligned(np.dtype(dtype).itemsize * capacity) for dtype in fields.values()]
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=8 + sum(sizes))
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        # Only the process that created the block removes it
+        self.owner = name is None
+        self.header = np.ndarray(1, np.int64, buffer=self.memory.buf)
+        self.data = {}
+        offset = 8
+        for (field, dtype), size in zip(fields.items(), sizes):
+            self.data[field] = np.ndarray(capacity, dtype, buffer=self.memory.buf, offset=offset)
+            offset += size
+        if self.owner:
+            self.count = 0
+
+    # Rounds a number of bytes up to a multiple of 8 so every array starts on an 8 byte boundary
+    @staticmethod
+    def aligned(size):
+        return (size + 7) // 8 * 8
+
+    # The particle count is stored in the shared block so every process sees the same one
+    @property
+    def count(self):
+        return int(self.header[0])
+
+    @count.setter
+    def count(self, new_count):
+        self.header[0] = new_count
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def append(self, **values):
+        room = self.capacity - self.count
+        n = len(next(iter(values.values())))
+        if n > room:
+            self.dropped += n - room
+            values = {field: np.asarray(value)[:room] for field, value in values.items()}
+        ParticleArrays.append(self, **values)
+
+    # Detaches from the shared block, removing it if this process created it
+    def close(self):
+        # numpy arrays using the block have to be released before it can be closed
+        self.data = {}
+        self.header = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# Combines the particle arrays of every shard of a ShardedEngine so they can be read as one set
+class ShardedArrays:
+
+    def __init__(self, shards):
+        self.shards = shards
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    # Returns one attribute of every particle in every shard as a single array
+    def __getitem__(self, name):
+        return np.concatenate([shard[name] for shard in self.shards])
+
+
+# Class that runs one simulation of the photoelectric effect
+# Each call to step advances the simulation by one frame, exactly like one run of the loop in game_loop
+class Engine:
+
+    # metal - any object with a work_func attribute in joules, eg. a Metal
+    # source - any object with x, y, mean, std, min and max attributes, eg. a Source
+    # wavelength - the wavelength of the light in nanometres
+    # intensity - the intensity of the light from 0 to 100
+    # stop_voltage - the stopping voltage in volts
+    # seed - seed for the random number generator, a random one is chosen if None
+    # budget - target number of live particles. If None, one photon is emitted at a time with a timer, like the
+    # original GUI. Otherwise every particle is a macro-particle standing for many real ones, and the source needs
+    # a power attribute in watts that sets the real photon flux
+    # monochromatic - if True every photon has the slider's wavelength, like the original GUI. Otherwise
+    # wavelengths are drawn from the source's spectrum, with the slider setting where it peaks
+    # field - if True electrons leave the plate with all their kinetic energy and the stopping voltage is a uniform
+    # electric field between the plates that slows them down, so slow electrons turn round and the current is the
+    # electrons that reach the right plate. Otherwise, like the original GUI, the voltage is taken off the energy of
+    # each electron when it is created, which then moves at a constant speed, and the current is the electrons emitted
+    # cone - if True each photon leaves in a direction drawn from the source's emission cone (its direction and
+    # spread attributes, in degrees) and whether it hits the plate is worked out when it is emitted. Otherwise,
+    # like the original GUI, every photon moves at PHOTON_SPEED and is checked against the plate every frame
+    # qmc - if True photon positions, directions, wavelengths and emission times are drawn from scrambled Halton
+    # sequences (see qmc.py) instead of random numbers, so results converge faster with the number of photons
+    def __init__(self, metal, source, wavelength=475, intensity=0, stop_voltage=0, seed=None, budget=None,
+                 monochromatic=False, field=False, cone=False, qmc=False):
+        self.metal = metal
+        self.source = source
+        self.wavelength = wavelength
+        self.intensity = intensity
+        self.stop_voltage = stop_voltage
+        self.budget = budget
+        self.monochromatic = monochromatic
+        self.field = field
+        self.cone = cone
+        self.qmc = qmc
+        # Whether photons from the cone that miss the plate are kept so they can be drawn. Headless runs drop them
+        # when they are emitted, so they cost nothing afterwards
+        self.keep_missed = False
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        # Two random number streams: timer_rng decides when photons are emitted and rng everything else
+        # Keeping emission times in their own stream lets the shards of a ShardedEngine share them
+        streams = np.random.SeedSequence(seed).spawn(2)
+        self.rng = np.random.default_rng(streams[0])
+        self.timer_rng = np.random.default_rng(streams[1])
+        # Quasi-random sequences for what rng and timer_rng would draw when qmc is True, made when first used
+        self.sampler = None
+        self.timer_sampler = None
+        # When the engine is one shard of a ShardedEngine, it only creates every shard_count-th photon
+        # starting from the shard_index-th
+        self.shard_index = 0
+        self.shard_count = 1
+        # Number of photons the light source has emitted, including those created by other shards
+        self.emission_index = 0
+        self.photons = ParticleArrays(PHOTON_FIELDS)
+        self.electrons = ParticleArrays(ELECTRON_FIELDS)
+        # Frames until the next photon is emitted, the same as Photon.LastEmitted
+        self.last_emitted = 0
+        # Number of frames simulated so far
+        self.frame = 0
+        # Electrons created in the current second and the current of the last full second
+        self.count_collisions = 0
+        self.current = 0.0
+        # Totals over the whole simulation
+        self.photons_emitted = 0
+        self.photons_absorbed = 0
+        self.photons_missed = 0
+        self.electrons_emitted = 0
+        self.electrons_collected = 0
+        self.electrons_returned = 0
+        # Number of real electrons the emitted and collected macro-particles stand for,
+        # and the total kinetic energy of the emitted ones
+        self.real_electrons = 0.0
+        self.real_collected = 0.0
+        self.total_ke = 0.0
+        # Statistics of the electrons' kinetic energies and speeds, see stats.py
+        self.stats = stats.ElectronStats()
+        # Object whose publish method is called with the engine at the end of every frame, eg. a
+        # livestate.StatePublisher, or None
+        self.publisher = None
+
+    # Creates an engine from a config dictionary as made by photoelectric.make_config
+    # options are passed on to the constructor
+    @classmethod
+    def from_config(cls, config, **options):
+        metal = types.SimpleNamespace(name=config["metal"], work_func=config["work_func"])
+        source = types.SimpleNamespace(name=config["source"], **config["source_params"])
+        return cls(metal, source, config["wavelength"], config["intensity"], config["stop_voltage"],
+                   config.get("seed"), config.get("budget"), config.get("monochromatic", False),
+                   config.get("field", False), config.get("cone", False), config.get("qmc", False), **options)
+
+    # Returns the number of seconds simulated so far
+    @property
+    def time(self):
+        return self.frame / FPS
+
+    # Advances the simulation by one frame
+    def step(self):
+        self.emit()
+        self.move_photons()
+        self.move_electrons()
+        self.end_frame()
+
+    # Counts the frame as finished
+    def end_frame(self):
+        self.frame += 1
+        # Once a second the current is worked out from the electrons created in that second
+        if self.frame % FPS == 0:
+            self.current = self.count_collisions * CHARGE
+            self.count_collisions = 0
+        if self.publisher is not None:
+            self.publisher.publish(self)
+
+    # Runs the simulation for a number of seconds
+    def run(self, duration):
+        for _ in range(round(duration * FPS)):
+            self.step()
+
+    # Returns the alias table photon wavelengths are drawn from
+    # Sources without spectrum and width attributes always emit the slider's wavelength
+    def spectrum_table(self):
+        kind = getattr(self.source, "spectrum", None)
+        if self.monochromatic or kind is None:
+            return AliasTable([self.wavelength], [1.0])
+        return spectrum_table(kind, self.source.width, self.source.min, self.source.max, float(self.wavelength))
+
+    # Returns the next n points of the quasi-random sequence photons are emitted from, one row per photon
+    # Columns 0 and 1 are its position, 2 its wavelength and 3 its direction
+    def emission_points(self, n):
+        # Made the first time it is needed, so each shard of a ShardedEngine scrambles it with its own random numbers
+        if self.sampler is None:
+            self.sampler = qmc.ScrambledHalton(4, self.rng)
+        return self.sampler.points(n)
+
+    # Returns the next number of the quasi-random sequence that decides when photons are emitted
+    def timer_point(self):
+        # Scrambled with timer_rng, so every shard of a ShardedEngine has the same emission times
+        if self.timer_sampler is None:
+            self.timer_sampler = qmc.ScrambledHalton(1, self.timer_rng)
+        return float(self.timer_sampler.points(1)[0, 0])
+
+    # Creates n photons of weight weight spread around the bottom of the light source
+    def create_photons(self, n, weight):
+        if self.qmc:
+            points = self.emission_points(n)
+            wavelengths = self.spectrum_table().quantile(points[:, 2])
+            # The Box-Muller transform turns two uniform numbers into two independent normally distributed ones
+            radius = np.sqrt(-2 * np.log(points[:, 0]))
+            angle = 2 * math.pi * points[:, 1]
+            offsets = self.source.mean + self.source.std * np.column_stack((radius * np.cos(angle),
+                                                                             radius * np.sin(angle)))
+        else:
+            wavelengths = self.spectrum_table().sample(self.rng, n)
+            offsets = self.rng.normal(self.source.mean, self.source.std, (n, 2))
+        # Kinetic energy is leftover energy from breaking off of surface of metal
+        ke = photon_energy(wavelengths) - self.metal.work_func
+        x = self.source.x + offsets[:, 0]
+        y = self.source.y + offsets[:, 1]
+        self.photons_emitted += n
+        if not self.cone:
+            self.photons.append(x=x, y=y, ke=ke, wavelength=wavelengths, weight=np.full(n, weight),
+                                vx=np.full(n, PHOTON_SPEED[0], np.float64), vy=np.full(n, PHOTON_SPEED[1], np.float64),
+                                life=np.full(n, np.inf), hits=np.zeros(n, np.bool_))
+            return
+        # Directions are spread evenly across the cone
+        spread = 2 * points[:, 3] - 1 if self.qmc else self.rng.uniform(-1, 1, n)
+        angles = np.radians(self.source.direction + self.source.spread * spread)
+        vx = -PHOTON_STEP * np.cos(angles)
+        vy = PHOTON_STEP * np.sin(angles)
+        hits, life = cast_photons(x, y, vx, vy)
+        self.photons_missed += n - int(np.count_nonzero(hits))
+        keep = slice(None) if self.keep_missed else hits
+        self.photons.append(x=x[keep], y=y[keep], ke=ke[keep], wavelength=wavelengths[keep],
+                            weight=np.full(n, weight)[keep], vx=vx[keep], vy=vy[keep], life=life[keep], hits=hits[keep])
+
+    # Emits photons, either a single one when the emission timer runs out or macro-photons if there is a budget
+    def emit(self):
+        if self.intensity <= 0:
+            return
+        if self.budget is not None:
+            self.emit_weighted()
+            return
+        # Emits a photon if the emission timer has run out, the same as emit_photon in photoelectric.py
+        if self.last_emitted == 0:
+            if self.source.min <= self.wavelength <= self.source.max:
+                if self.emission_index % self.shard_count == self.shard_index:
+                    self.create_photons(1, 1.0)
+                self.emission_index += 1
+                # Higher the intensity, the sooner the next photon will be released
+                if self.qmc:
+                    # The inverse of the exponential distribution's cumulative probability
+                    wait = -math.log(1 - self.timer_point()) / self.intensity
+                else:
+                    wait = self.timer_rng.exponential(1 / self.intensity)
+                self.last_emitted = math.ceil(wait * 250)
+        else:
+            self.last_emitted -= 1
+
+    # Returns the number of macro-photons to emit per frame and the number of real photons each one stands for
+    # The real photon flux is the source's power divided by the mean energy of its photons
+    # The rate is chosen so that about budget particles are alive at once,
+    # using how long a photon and the electron it creates are expected to live
+    def emission_rate(self):
+        table = self.spectrum_table()
+        flux = self.source.power * (self.intensity / 100) / photon_energy(table.mean)
+        lifetime = (self.source.x + self.source.mean - ELECTRON_START_X) / -PHOTON_SPEED[0]
+        # Averages the electron's time between the plates over the spectrum, photons without enough energy add 0
+        ke = photon_energy(table.values) - self.metal.work_func
+        if self.field:
+            transit = field_transit(field_speed(np.maximum(ke, 0)), self.acceleration())
+        else:
+            ke = ke - self.stop_voltage * CHARGE
+            speed = np.maximum(ke, 0) * math.pow(10, 19)
+            transit = (RIGHT_PLATE[0] - ELECTRON_START_X) / np.maximum(speed, 1e-9)
+        transit = np.minimum(transit, MAX_ELECTRON_LIFE)
+        lifetime += float(np.dot(np.where(ke > 0, transit, 0), table.weights))
+        rate = self.budget / lifetime
+        weight = flux / (rate * FPS)
+        # A macro-particle never stands for less than one real particle
+        if weight < 1:
+            weight = 1.0
+            rate = flux / FPS
+        return rate, weight
+
+    # Emits a Poisson distributed number of macro-photons this frame, each carrying the weight from emission_rate
+    def emit_weighted(self):
+        if not self.source.min <= self.wavelength <= self.source.max:
+            return
+        rate, weight = self.emission_rate()
+        n = qmc.poisson_quantile(rate, self.timer_point()) if self.qmc else int(self.timer_rng.poisson(rate))
+        # Photons are numbered across all shards, this shard creates the ones numbered shard_index mod shard_count
+        mine = len(range((self.shard_index - self.emission_index) % self.shard_count, n, self.shard_count))
+        self.emission_index += n
+        if mine > 0:
+            self.create_photons(mine, weight)
+
+    # Moves every photon, turns the ones that hit the left plate into electrons and removes those off screen
+    def move_photons(self):
+        photons = self.photons
+        if len(photons) == 0:
+            return
+        hit, gone = advance_photons(photons)
+        if not gone.any():
+            return
+        # Photons whose energy (minus the stopping voltage without the field) is positive create an electron
+        ke = photons["ke"][hit]
+        if not self.field:
+            ke = ke - self.stop_voltage * CHARGE
+        creates = ke > 0
+        self.photons_absorbed += int(np.count_nonzero(hit))
+        self.create_electrons(photons["y"][hit][creates], ke[creates], photons["weight"][hit][creates])
+        photons.keep(~gone)
+
+    # Creates electrons at the left plate with y co-ords y, kinetic energies ke and weights weight
+    def create_electrons(self, y, ke, weight):
+        n = len(y)
+        if n == 0:
+            return
+        # Without the field the speed in pixels per frame is the kinetic energy multiplied by 10^19
+        speed = field_speed(ke) if self.field else ke * math.pow(10, 19)
+        self.electrons.append(x=np.full(n, ELECTRON_START_X, np.float64), y=y, ke=ke, speed=speed, weight=weight)
+        real = float(weight.sum())
+        if not self.field:
+            self.count_collisions += real
+        self.electrons_emitted += n
+        self.real_electrons += real
+        self.total_ke += float((ke * weight).sum())
+        self.stats.created(ke, electron_speed(ke), weight)
+
+    # Returns the acceleration of the electrons in pixels per frame squared, 0 without the field
+    def acceleration(self):
+        return field_acceleration(self.stop_voltage) if self.field else 0.0
+
+    # Moves every electron and removes the ones that reach the right plate or come back to the left one
+    def move_electrons(self):
+        electrons = self.electrons
+        if len(electrons) == 0:
+            return
+        collected, returned = advance_electrons(electrons, self.acceleration())
+        removed = collected | returned
+        if removed.any():
+            self.remove_electrons(electrons["ke"][removed], electrons["weight"][removed], collected[removed])
+            electrons.keep(~removed)
+
+    # Counts electrons that have been removed, given their kinetic energies, weights and whether each was collected
+    # With the field, the current is the electrons collected each second
+    def remove_electrons(self, ke, weight, collected):
+        n = int(np.count_nonzero(collected))
+        self.electrons_collected += n
+        self.electrons_returned += len(ke) - n
+        real = float(weight[collected].sum())
+        self.real_collected += real
+        if self.field:
+            self.count_collisions += real
+        self.stats.removed(ke, weight)
+
+    # Returns the number of particles dropped because shared particle arrays were full
+    @property
+    def dropped(self):
+        return getattr(self.photons, "dropped", 0) + getattr(self.electrons, "dropped", 0)
+
+    # Returns a Snapshot of the engine, for drawing
+    def snapshot(self):
+        return Snapshot(self)
+
+    # Returns a dictionary of the engine's totals, see COUNTERS
+    def counters(self):
+        return {name: getattr(self, name) for name in COUNTERS}
+
+    # Returns the mean speed in m/s of all electrons emitted so far
+    def mean_speed(self):
+        if self.real_electrons == 0:
+            return 0.0
+        return float(electron_speed(self.total_ke / self.real_electrons))
+
+    # Returns a flat dictionary of the simulation's parameters and results
+    def results(self):
+        duration = self.time
+        if duration > 0:
+            current = (self.real_collected if self.field else self.real_electrons) * CHARGE / duration
+        else:
+            current = 0.0
+        return {
+            "metal": self.metal.name,
+            "source": self.source.name,
+            "wavelength": self.wavelength,
+            "intensity": self.intensity,
+            "stop_voltage": self.stop_voltage,
+            "seed": self.seed,
+            "budget": self.budget,
+            "monochromatic": self.monochromatic,
+            "field": self.field,
+            "cone": self.cone,
+            "qmc": self.qmc,
+            "duration": duration,
+            "frames": self.frame,
+            "photons_emitted": self.photons_emitted,
+            "photons_absorbed": self.photons_absorbed,
+            "photons_missed": self.photons_missed,
+            "electrons_emitted": self.electrons_emitted,
+            "electrons_collected": self.electrons_collected,
+            "electrons_returned": self.electrons_returned,
+            "real_electrons": self.real_electrons,
+            "real_collected": self.real_collected,
+            "photons_in_flight": len(self.photons),
+            "electrons_in_flight": len(self.electrons),
+            "current": current,
+            "mean_speed": self.mean_speed(),
+            **self.stats.summary(),
+            "dropped": self.dropped,
+            "engine_version": ENGINE_VERSION,
+        }
+
+
+# Copies the attributes of an object such as a Metal or Source into a plain object that can be sent to other processes
+def plain(obj):
+    return types.SimpleNamespace(**vars(obj))
+
+
+# Run by each worker process of a ShardedEngine
+# Builds an engine whose particles live in the shard's shared memory blocks, then runs commands sent by the parent:
+# ("run", frames) steps the engine and replies with its counters and statistics, ("set", changes) changes its parameters
+# and ("stop", None) ends the process
+# Every shard has the same seed so they share emission times, shard_seed seeds the rest of the shard's randomness
+def shard_worker(connection, metal, source, params, seed, shard_seed, index, count, photon_block, electron_block,
+                 capacity):
+    shard = Engine(metal, source, seed=seed, **params)
+    shard.rng = np.random.default_rng(shard_seed)
+    shard.shard_index = index
+    shard.shard_count = count
+    shard.photons = SharedParticleArrays(PHOTON_FIELDS, capacity, photon_block)
+    shard.electrons = SharedParticleArrays(ELECTRON_FIELDS, capacity, electron_block)
+    try:
+        while True:
+            command, argument = connection.recv()
+            if command == "run":
+                for _ in range(argument):
+                    shard.step()
+                connection.send((shard.counters(), shard.stats))
+            elif command == "set":
+                for name, value in argument.items():
+                    setattr(shard, name, value)
+            else:
+                break
+    finally:
+        shard.photons.close()
+        shard.electrons.close()
+        connection.close()
+
+
+# Engine that splits the particles of one simulation between several worker processes
+# Each worker (shard) owns part of the particle arrays, kept in shared memory, and emits, moves and collides
+# its own particles with its own random number stream and share of the light
+# After each batch of frames the counters of the shards are added together, which is all the reduction needed
+# The arrays of every shard can be read by the parent between batches through photons and electrons
+class ShardedEngine(Engine):
+
+    # Parameters to keep the same in every shard
+    Params = ("metal", "source", "wavelength", "intensity", "stop_voltage", "budget", "monochromatic", "field",
+              "cone", "qmc")
+
+    # Takes the same parameters as Engine plus:
+    # workers - number of worker processes, one per core if None
+    # capacity - maximum number of photons and of electrons in each shard
+    def __init__(self, metal, source, wavelength=475, intensity=0, stop_voltage=0, seed=None, budget=None,
+                 monochromatic=False, field=False, cone=False, qmc=False, workers=None, capacity=1000000):
+        Engine.__init__(self, metal, source, wavelength, intensity, stop_voltage, seed, budget, monochromatic, field,
+                        cone, qmc)
+        if workers is None:
+            workers = os.cpu_count()
+        self.workers = workers
+        self.sent = self.params()
+        seeds = np.random.SeedSequence(self.seed).spawn(2 + workers)[2:]
+        photon_shards = []
+        electron_shards = []
+        self.connections = []
+        self.processes = []
+        for i in range(workers):
+            photon_shards.append(SharedParticleArrays(PHOTON_FIELDS, capacity))
+            electron_shards.append(SharedParticleArrays(ELECTRON_FIELDS, capacity))
+            parent_end, worker_end = multiprocessing.Pipe()
+            params = {name: self.sent[name] for name in ShardedEngine.Params[2:]}
+            process = multiprocessing.Process(target=shard_worker, daemon=True,
+                                              args=(worker_end, plain(metal), plain(source), params, self.seed,
+                                                    seeds[i], i, workers, photon_shards[i].name,
+                                                    electron_shards[i].name, capacity))
+            process.start()
+            worker_end.close()
+            self.connections.append(parent_end)
+            self.processes.append(process)
+        self.photons = ShardedArrays(photon_shards)
+        self.electrons = ShardedArrays(electron_shards)
+
+    # Returns the current values of the parameters shared by every shard
+    def params(self):
+        return {name: getattr(self, name) for name in ShardedEngine.Params}
+
+    # Runs every shard for a number of frames then adds their counters together
+    def run_frames(self, frames):
+        params = self.params()
+        if params != self.sent:
+            changes = {name: value for name, value in params.items() if value != self.sent[name]}
+            for name in ("metal", "source"):
+                if name in changes:
+                    changes[name] = plain(changes[name])
+            for connection in self.connections:
+                connection.send(("set", changes))
+            self.sent = params
+        for connection in self.connections:
+            connection.send(("run", frames))
+        totals = dict.fromkeys(COUNTERS, 0)
+        self.stats = stats.ElectronStats()
+        for connection in self.connections:
+            counters, shard_stats = connection.recv()
+            for name, value in counters.items():
+                totals[name] += value
+            self.stats.merge(shard_stats)
+        for name, value in totals.items():
+            if name != "dropped":
+                setattr(self, name, value)
+        self.shard_dropped = totals["dropped"]
+        self.frame += frames
+        if self.publisher is not None:
+            self.publisher.publish(self)
+
+    def step(self):
+        self.run_frames(1)
+
+    # Runs the simulation for a number of seconds in one batch per shard
+    def run(self, duration):
+        self.run_frames(round(duration * FPS))
+
+    @property
+    def dropped(self):
+        return getattr(self, "shard_dropped", 0)
+
+    def results(self):
+        results = Engine.results(self)
+        results["workers"] = self.workers
+        return results
+
+    # Stops the worker processes and removes the shared memory blocks
+    def close(self):
+        for connection in self.connections:
+            connection.send(("stop", None))
+        for process in self.processes:
+            process.join()
+        for connection in self.connections:
+            connection.close()
+        for shard in self.photons.shards + self.electrons.shards:
+            shard.close()
+        self.connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Returns a property that reads a parameter from the first scene of a SceneEngine and sets it in every scene
+def scene_parameter(name):
+    def get(self):
+        return getattr(self.scenes[0], name)
+
+    def set(self, value):
+        for scene in self.scenes:
+            setattr(scene, name, value)
+    return property(get, set)
+
+
+# Class that runs several independent scenes, eg. different metals or sources side by side, in one set of particle
+# arrays where every particle has the index of its scene. Moving particles and finding collisions is done for all
+# scenes at once, so the work per frame that doesn't depend on the number of particles is only done once
+# Each scene is an Engine that keeps its own parameters, random numbers, counters and statistics, but its particles
+# only pass through it while they are being created
+class SceneEngine:
+
+    # Setting these sets them in every scene, eg. from the GUI's sliders
+    wavelength = scene_parameter("wavelength")
+    intensity = scene_parameter("intensity")
+    stop_voltage = scene_parameter("stop_voltage")
+
+    # scenes - list of Engine objects, one per scene
+    def __init__(self, scenes):
+        self.scenes = scenes
+        self.photons = ParticleArrays(dict(PHOTON_FIELDS, scene=np.int64))
+        self.electrons = ParticleArrays(dict(ELECTRON_FIELDS, scene=np.int64))
+        for scene in scenes:
+            scene.photons = ParticleArrays(PHOTON_FIELDS, 16)
+            scene.electrons = ParticleArrays(ELECTRON_FIELDS, 16)
+        self.frame = 0
+
+    # Creates a scene engine from a list of config dictionaries, see Engine.from_config
+    @classmethod
+    def from_configs(cls, configs):
+        return cls([Engine.from_config(config) for config in configs])
+
+    # Moves the particles a scene has just created into the shared arrays
+    @staticmethod
+    def take(created, shared, index):
+        n = len(created)
+        if n > 0:
+            shared.append(scene=np.full(n, index), **{name: created[name] for name in created.fields})
+            created.count = 0
+
+    # Advances every scene by one frame
+    def step(self):
+        for index, scene in enumerate(self.scenes):
+            scene.emit()
+            SceneEngine.take(scene.photons, self.photons, index)
+        self.move_photons()
+        self.move_electrons()
+        for scene in self.scenes:
+            scene.end_frame()
+        self.frame += 1
+
+    # Runs every scene for a number of seconds
+    def run(self, duration):
+        for _ in range(round(duration * FPS)):
+            self.step()
+
+    # Moves every photon, then each scene turns its photons that hit the left plate into electrons
+    def move_photons(self):
+        photons = self.photons
+        if len(photons) == 0:
+            return
+        hit, gone = advance_photons(photons)
+        if not gone.any():
+            return
+        scene_of = photons["scene"][hit]
+        # Scenes with the field take the voltage off later, as their electrons cross the plates
+        voltages = np.array([0.0 if scene.field else scene.stop_voltage for scene in self.scenes], np.float64)
+        ke = photons["ke"][hit] - voltages[scene_of] * CHARGE
+        creates = ke > 0
+        absorbed = np.bincount(scene_of, minlength=len(self.scenes))
+        y = photons["y"][hit]
+        weight = photons["weight"][hit]
+        for index, scene in enumerate(self.scenes):
+            if absorbed[index] == 0:
+                continue
+            scene.photons_absorbed += int(absorbed[index])
+            mine = creates & (scene_of == index)
+            scene.create_electrons(y[mine], ke[mine], weight[mine])
+            SceneEngine.take(scene.electrons, self.electrons, index)
+        photons.keep(~gone)
+
+    # Moves every electron in the field of its scene and removes the ones that reach the right plate or come back
+    # to the left one from their scenes
+    def move_electrons(self):
+        electrons = self.electrons
+        if len(electrons) == 0:
+            return
+        accelerations = np.array([scene.acceleration() for scene in self.scenes], np.float64)
+        collected, returned = advance_electrons(electrons, accelerations[electrons["scene"]])
+        removed = collected | returned
+        if not removed.any():
+            return
+        scene_of = electrons["scene"][removed]
+        ke = electrons["ke"][removed]
+        weight = electrons["weight"][removed]
+        collected = collected[removed]
+        counts = np.bincount(scene_of, minlength=len(self.scenes))
+        for index, scene in enumerate(self.scenes):
+            if counts[index] > 0:
+                mine = scene_of == index
+                scene.remove_electrons(ke[mine], weight[mine], collected[mine])
+        electrons.keep(~removed)
+
+    # Returns a list of the particles of each scene, see SceneParticles
+    def scene_particles(self):
+        photon_scenes = self.photons["scene"]
+        electron_scenes = self.electrons["scene"]
+        return [(SceneParticles(self.photons, photon_scenes == index),
+                 SceneParticles(self.electrons, electron_scenes == index)) for index in range(len(self.scenes))]
+
+    # Returns a list of one Snapshot per scene
+    def snapshot(self):
+        snapshots = []
+        for scene, (photons, electrons) in zip(self.scenes, self.scene_particles()):
+            snapshots.append(Snapshot(types.SimpleNamespace(frame=scene.frame, photons=photons, electrons=electrons,
+                                                            current=scene.current, stats=scene.stats,
+                                                            field=scene.field)))
+        return snapshots
+
+    # Returns a list of the results of every scene, see Engine.results
+    def results(self):
+        results = []
+        for scene, (photons, electrons) in zip(self.scenes, self.scene_particles()):
+            result = scene.results()
+            result["photons_in_flight"] = len(photons)
+            result["electrons_in_flight"] = len(electrons)
+            results.append(result)
+        return results
+
+
+# The particles of one scene of a SceneEngine, which can be read like a ParticleArrays
+# particles - the shared ParticleArrays, mask - which of its particles are in the scene
+class SceneParticles:
+
+    def __init__(self, particles, mask):
+        self.particles = particles
+        self.mask = mask
+
+    def __getitem__(self, name):
+        return self.particles[name][self.mask]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.mask))
+
+
+# Runs one headless simulation described by a config dictionary and returns its results
+# If the config has more than 1 shard the particles are split between that many processes
+# Defined at module level so it can be sent to worker processes
+def simulate(config):
+    shards = config.get("shards", 1)
+    if shards > 1:
+        with ShardedEngine.from_config(config, workers=shards) as sharded:
+            sharded.run(config["duration"])
+            return sharded.results()
+    engine = Engine.from_config(config)
+    engine.run(config["duration"])
+    return engine.results()
+
+
+# Immutable copy of the state of an engine at the end of a frame, which is all the GUI needs to draw it
+# The arrays are copies marked read-only, so the engine can carry on while a snapshot is being drawn
+class Snapshot:
+
+    def __init__(self, engine):
+        self.frame = engine.frame
+        self.photon_x = Snapshot.freeze(engine.photons["x"])
+        self.photon_y = Snapshot.freeze(engine.photons["y"])
+        self.photon_wavelength = Snapshot.freeze(engine.photons["wavelength"])
+        self.electron_x = Snapshot.freeze(engine.electrons["x"])
+        self.electron_y = Snapshot.freeze(engine.electrons["y"])
+        self.photons = len(engine.photons)
+        self.electrons = len(engine.electrons)
+        self.current = engine.current
+        # Mean speed in m/s of the real electrons between the plates, as they are now
+        self.mean_speed = live_speed(engine.electrons, engine.field)
+        # Kinetic energy in J that 99% of the electrons emitted so far are below
+        self.ke_p99 = engine.stats.ke_sketch.quantile(0.99)
+        # Weighted counts of the kinetic energies of the electrons emitted so far, see stats.ElectronStats
+        self.ke_histogram = Snapshot.freeze(engine.stats.ke_histogram.counts)
+        self.ke_bin_width = (engine.stats.ke_histogram.high - engine.stats.ke_histogram.low) / len(self.ke_histogram)
+
+    # Returns a read-only copy of an array
+    @staticmethod
+    def freeze(array):
+        array = array.copy()
+        array.flags.writeable = False
+        return array
+
+
+# Thread that runs an engine at a fixed number of frames per second, separately from the drawing loop
+# After every frame the thread builds a new snapshot (the back buffer) then swaps it to the front,
+# so the drawing loop always reads the latest complete frame without waiting for the simulation
+class EngineThread(threading.Thread):
+
+    # engine - the Engine to run
+    # fps - frames simulated per second of real time
+    def __init__(self, engine, fps=FPS):
+        threading.Thread.__init__(self, daemon=True)
+        self.engine = engine
+        self.fps = fps
+        # The snapshot the drawing loop reads, or a list of them for a SceneEngine
+        self.front = engine.snapshot()
+        # Parameter changes waiting to be applied at the start of the next frame, protected by lock
+        self.changes = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    # Changes engine attributes (eg. wavelength=400) at the start of the next frame
+    # Can be called from any thread
+    def set(self, **changes):
+        with self.lock:
+            self.changes.update(changes)
+
+    # Returns the most recent snapshot
+    def latest(self):
+        return self.front
+
+    def run(self):
+        period = 1 / self.fps
+        next_frame = time.perf_counter()
+        while not self.stopped.is_set():
+            with self.lock:
+                changes = self.changes
+                self.changes = {}
+            for name, value in changes.items():
+                setattr(self.engine, name, value)
+            self.engine.step()
+            # Swapping the reference is atomic, readers see either the old or the new snapshot
+            self.front = self.engine.snapshot()
+            next_frame += period
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                self.stopped.wait(delay)
+            else:
+                # If the simulation has fallen behind it carries on from now rather than rushing to catch up
+                next_frame = time.perf_counter()
+
+    # Stops the thread and waits for it to finish its current frame
+    def stop(self):
+        self.stopped.set()
+        self.join()
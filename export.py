@@ -0,0 +1,101 @@
+# export.py writes frames rendered offscreen to numbered PNG files or to one raw video stream
+# Frames are written by a pool of threads while the next ones are rendered. The queue between them has a fixed size,
+# so if the writers fall behind, rendering waits for them instead of filling up memory
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+
+
+# Returns the bytes of a PNG image of width x height pixels, given its pixels as RGB bytes row by row
+# zlib lets other threads run while it compresses, which is why the writers are threads
+def png_bytes(pixels, width, height, level=3):
+    stride = width * 3
+    # Every row starts with the number of the filter used on it, 0 is none
+    rows = b"".join(b"\x00" + pixels[y * stride:(y + 1) * stride] for y in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    # 8 bits per channel, colour type 2 (RGB), deflate compression, no filtering and no interlacing
+    # A low compression level keeps up with rendering, at the cost of slightly bigger files
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows, level))
+            + chunk(b"IEND", b""))
+
+
+# Class that writes frames on background threads
+# output - for "png" a folder the frames are written to as frame_000000.png, frame_000001.png, ...
+# for "raw" a file, or "-" for standard output, that every frame's RGB bytes are written to one after the other,
+# which ffmpeg reads with -f rawvideo -pix_fmt rgb24 -s WIDTHxHEIGHT
+# threads - number of writer threads, a raw stream has to be written in order so it always has 1
+# queue_size - most frames waiting to be written before put waits
+class FrameWriter:
+
+    def __init__(self, output, width, height, fmt="png", threads=4, queue_size=32):
+        self.output = output
+        self.width = width
+        self.height = height
+        self.fmt = fmt
+        if fmt == "png":
+            os.makedirs(output, exist_ok=True)
+            self.stream = None
+        else:
+            threads = 1
+            self.stream = sys.stdout.buffer if output == "-" else open(output, "wb")
+        self.queue = queue.Queue(queue_size)
+        self.error = None
+        # Seconds put spent waiting for the writers
+        self.waited = 0.0
+        # Frames written, protected by lock
+        self.written = 0
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    # Queues frame number index, given as RGB bytes, waiting if the queue is full
+    def put(self, index, pixels):
+        if self.error is not None:
+            raise self.error
+        start = time.perf_counter()
+        self.queue.put((index, pixels))
+        self.waited += time.perf_counter() - start
+
+    # Run by each writer thread until it takes None from the queue
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            # After an error the rest of the frames are taken but not written, so put never waits forever
+            if self.error is not None:
+                continue
+            index, pixels = item
+            try:
+                if self.stream is not None:
+                    self.stream.write(pixels)
+                else:
+                    path = os.path.join(self.output, "frame_{:06d}.png".format(index))
+                    with open(path, "wb") as f:
+                        f.write(png_bytes(pixels, self.width, self.height))
+                with self.lock:
+                    self.written += 1
+            except OSError as error:
+                self.error = error
+
+    # Waits for every queued frame to be written and closes the stream
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.stream is not None:
+            self.stream.flush()
+            if self.stream is not sys.stdout.buffer:
+                self.stream.close()
+        if self.error is not None:
+            raise self.error
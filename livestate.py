@@ -0,0 +1,181 @@
+# livestate.py publishes the particles and totals of a running engine in a named block of shared memory, so another
+# process, eg. a Jupyter notebook, can map the block and analyse the simulation as it runs without slowing it down
+# The block starts with a header (see HEADER) followed by one fixed size array per published attribute (see ARRAYS)
+# The simulation never waits for readers. The header's sequence number works as a seqlock: the publisher makes it
+# odd before changing the block and even again afterwards, so a reader knows what it read is consistent if the
+# sequence was the same even number before and after. Both sides are plain numpy stores and loads, which relies on
+# the processor keeping them in order, as x86 processors do
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import engine
+
+# Changed whenever the layout of the block changes, so readers can refuse blocks they would misread
+LAYOUT_VERSION = 1
+# The header. photons and electrons are how many particles are in the arrays, at most capacity, and photons_alive
+# and electrons_alive how many the engine has, then the engine's totals (see engine.COUNTERS)
+HEADER = np.dtype([("sequence", np.int64), ("version", np.int64), ("capacity", np.int64), ("frame", np.int64),
+                   ("photons", np.int64), ("electrons", np.int64), ("photons_alive", np.int64),
+                   ("electrons_alive", np.int64)] + [(name, np.float64) for name in engine.COUNTERS])
+# Published arrays, by name, as (particles, attribute) of the engine
+ARRAYS = {
+    "photon_x": ("photons", "x"),
+    "photon_y": ("photons", "y"),
+    "photon_wavelength": ("photons", "wavelength"),
+    "electron_x": ("electrons", "x"),
+    "electron_y": ("electrons", "y"),
+    "electron_ke": ("electrons", "ke"),
+    "electron_weight": ("electrons", "weight"),
+}
+# Default number of photons and of electrons published
+CAPACITY = 65536
+# Attempts a reader makes straight away before giving up the processor between attempts, so it doesn't keep a core
+# busy while the publisher is descheduled in the middle of a frame, and attempts before it gives up altogether
+SPINS = 100
+ATTEMPTS = 10000
+
+
+# Names of the blocks this process has published, see StateReader
+published = set()
+
+
+# Returns numpy views of the header, its sequence number alone and the arrays in a block of shared memory
+# Reading and writing the sequence through its own view is much faster than through the header's
+def layout(memory, capacity):
+    header = np.ndarray(1, HEADER, buffer=memory.buf)
+    sequence = np.ndarray(1, np.int64, buffer=memory.buf)
+    arrays = {}
+    offset = HEADER.itemsize
+    for name in ARRAYS:
+        arrays[name] = np.ndarray(capacity, np.float64, buffer=memory.buf, offset=offset)
+        offset += capacity * 8
+    return header, sequence, arrays
+
+
+# Class that publishes the state of an engine in a new block of shared memory
+# name - name of the block for readers to open, a random one is chosen if None
+# capacity - most photons and electrons published, the first capacity of each are published if there are more
+# Set as an engine's publisher attribute, it publishes at the end of every frame
+class StatePublisher:
+
+    def __init__(self, name=None, capacity=CAPACITY):
+        self.memory = shared_memory.SharedMemory(name, create=True, size=HEADER.itemsize + len(ARRAYS) * capacity * 8)
+        self.capacity = capacity
+        self.header, self.sequence, self.arrays = layout(self.memory, capacity)
+        published.add(self.memory.name)
+        self.header[0] = 0
+        self.header["version"] = LAYOUT_VERSION
+        self.header["capacity"] = capacity
+        # View of the fields changed every frame, so they are written in one go
+        self.values = self.header[list(HEADER.names[3:])]
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    # Copies the particles and totals of engine into the block
+    def publish(self, engine):
+        photons = len(engine.photons)
+        electrons = len(engine.electrons)
+        counts = {"photons": min(photons, self.capacity), "electrons": min(electrons, self.capacity)}
+        self.sequence[0] += 1
+        for name, (particles, attribute) in ARRAYS.items():
+            n = counts[particles]
+            self.arrays[name][:n] = getattr(engine, particles)[attribute][:n]
+        self.values[0] = (engine.frame, counts["photons"], counts["electrons"], photons, electrons,
+                          *engine.counters().values())
+        self.sequence[0] += 1
+
+    # Removes the block, readers that still have it open keep their mapping
+    def close(self):
+        # numpy arrays using the block have to be released before it can be closed
+        published.discard(self.memory.name)
+        self.header = None
+        self.sequence = None
+        self.values = None
+        self.arrays = {}
+        self.memory.close()
+        self.memory.unlink()
+
+
+# The state of an engine read from a block, as numbers and arrays named as in HEADER and ARRAYS
+# values - dictionary of the header's fields, arrays - dictionary of arrays, which are cut to the number of particles
+class LiveState:
+
+    def __init__(self, values, arrays):
+        for name, value in values.items():
+            setattr(self, name, value)
+        for name, array in arrays.items():
+            setattr(self, name, array[:getattr(self, ARRAYS[name][0])])
+
+
+# Class that reads the state published by a StatePublisher, from any process on the same computer
+# name - name of the block
+# Raises FileNotFoundError if there is no such block and ValueError if it has another layout
+class StateReader:
+
+    def __init__(self, name):
+        if sys.version_info >= (3, 13):
+            self.memory = shared_memory.SharedMemory(name, track=False)
+        else:
+            self.memory = shared_memory.SharedMemory(name)
+            # Opening a block registers it with this process's resource tracker, which would remove it when this
+            # process exits, while the publisher is still using it. Blocks published by this process are already
+            # registered, by the publisher
+            if self.memory.name not in published:
+                resource_tracker.unregister(self.memory._name, "shared_memory")
+        header = np.ndarray(1, HEADER, buffer=self.memory.buf)
+        if header["version"][0] != LAYOUT_VERSION:
+            raise ValueError("block " + name + " has layout version " + str(header["version"][0]) + ", expected "
+                             + str(LAYOUT_VERSION))
+        # sequence[0] goes up by 2 every time a frame is published, so it can be polled for new frames
+        self.header, self.sequence, self.arrays = layout(self.memory, int(header["capacity"][0]))
+
+    # Calls function with a LiveState whose arrays are views of the block, without copying anything, until the
+    # block didn't change while it ran, and returns what it returned
+    # function must not keep the arrays, which the publisher overwrites, and should be quick next to a frame
+    # Nothing here is a memory barrier, so this relies on the processor keeping the publisher's stores and the
+    # reader's loads in order, as x86 processors do. Other processors may let a read see part of a frame
+    # Raises TimeoutError after attempts tries, eg. if the publisher stopped in the middle of a frame or publishes
+    # frames faster than function runs
+    def read(self, function, attempts=ATTEMPTS):
+        for attempt in range(attempts):
+            if attempt >= SPINS:
+                time.sleep(0)
+            before = int(self.sequence[0])
+            if before % 2 == 1:
+                continue
+            result = function(LiveState({name: self.header[name][0].item() for name in HEADER.names}, self.arrays))
+            if self.sequence[0] == before:
+                return result
+        raise TimeoutError("no consistent frame after " + str(attempts) + " attempts")
+
+    # Returns a LiveState with copies of the arrays, which can be kept
+    def snapshot(self):
+        return self.read(lambda state: LiveState({name: getattr(state, name) for name in HEADER.names},
+                                                 {name: getattr(state, name).copy() for name in ARRAYS}))
+
+    def close(self):
+        self.header = None
+        self.sequence = None
+        self.arrays = {}
+        self.memory.close()
+
+
+# Runs one headless simulation like engine.simulate, publishing its state in a new block called name as it runs
+# Defined at module level so it can be sent to worker processes
+def simulate(config, name, capacity=CAPACITY):
+    publisher = StatePublisher(name, capacity)
+    try:
+        if config.get("shards", 1) > 1:
+            with engine.ShardedEngine.from_config(config, workers=config["shards"]) as sharded:
+                sharded.publisher = publisher
+                sharded.run(config["duration"])
+                return sharded.results()
+        simulation = engine.Engine.from_config(config)
+        simulation.publisher = publisher
+        simulation.run(config["duration"])
+        return simulation.results()
+    finally:
+        publisher.close()
@@ -1,8 +1,30 @@
+import os
+# Stops pygame printing its welcome message, which would end up in the output of the command line runs
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
 import pygame
 import random
 import time
 import math
+import sys
+import argparse
+import csv
+import functools
+import io
+import itertools
+import json
+import multiprocessing
+import queue
+import numpy as np
+import analysis
+import cache
+import checkpoint
 import dan_gui
+import distributed
+import engine
+import export
+import livestate
+import quality
+import service
 
 # Method that creates two random numbers following a normal distribution using Box Muller transform
 # Returns a tuple of the two numbers
@@ -217,7 +239,15 @@ class Source:
 
     # Parameters:
     # name - The Source's name
-    def __init__(self, name, x, y, mean, std, min=100, max=850):
+    # x, y - Where photons start from, mean and std - the normal distribution photons are spread by
+    # min, max - The range of wavelengths in nm the source can emit
+    # power - The light power in watts reaching the metal at 100% intensity, sets the real photon flux
+    # spectrum - The shape of the spectrum of wavelengths emitted around the slider's wavelength,
+    # "line", "band" or "blackbody" (see engine.spectrum), width - The standard deviation in nm of a line or band
+    # direction - The degrees below the horizontal the middle of the beam points at, going left
+    # spread - The degrees either side of direction photons can be emitted at
+    def __init__(self, name, x, y, mean, std, min=100, max=850, power=0.001, spectrum="line", width=1,
+                 direction=engine.PHOTON_DIRECTION, spread=0.5):
         self.name = name
         self.x = x
         self.y = y
@@ -225,14 +255,16 @@ class Source:
         self.std = std
         self.min = min
         self.max = max
+        self.power = power
+        self.spectrum = spectrum
+        self.width = width
+        self.direction = direction
+        self.spread = spread
         # On Initialisation adds the light source's name to a list of light source names
         Source.SourceNames.append(name)
 
 
 # Beginning of actual code
-# Initialise all pygame modules before they can be used
-pygame.init()
-
 # These variables hold the dimensions of the screen, should be kept constant
 display_width = 800
 display_height = 600
@@ -243,13 +275,6 @@ white = (255, 255, 255)
 grey = (100, 100, 100)
 lightGrey = (180, 180, 180)
 
-# Initialise main drawing surface
-screen = pygame.display.set_mode((display_width, display_height))
-# Set title of window
-pygame.display.set_caption("Photoelectric Effect Simulator")
-# Create clock object for timing
-clock = pygame.time.Clock()
-
 # Tuple of min wavelengths for UV, violet, blue, cyan, yellow and red
 wlValues = (850, 750, 620, 570, 495, 450, 380, 0)
 wlValues2 = (0, 380, 450, 495, 570, 620, 750, 850)
@@ -420,14 +445,28 @@ def delete_file(f):
     f.seek(0)
     f.truncate()
 
-# The main game code is run here
-def game_loop(ticks,count_ticks,count_collisions):
-    # Creating the loop boolean, this is false until the game exits
-    game_exit = False
-
-    # Starting value definitions
-    wavelength = 0
-    intensity = 0
+# Returns the corners of the polygon the light of a source is drawn as, which covers the paths photons from its cone
+# can take, from two standard deviations either side of where they start to the left plate
+def light_polygon(source):
+    middle = math.radians(source.direction)
+    start_x = source.x + source.mean
+    start_y = source.y + source.mean
+    edges = []
+    for side in (-1, 1):
+        # Across the beam from its middle, (sin, cos) is at right angles to the direction (-cos, sin)
+        x = start_x + side * 2 * source.std * math.sin(middle)
+        y = start_y + side * 2 * source.std * math.cos(middle)
+        angle = math.radians(source.direction + side * source.spread)
+        distance = (engine.ELECTRON_START_X - x) / -math.cos(angle)
+        edges.append(((x, y), (engine.ELECTRON_START_X, y + distance * math.sin(angle))))
+    return edges[0][0], edges[0][1], edges[1][1], edges[1][0]
+
+
+# Adds the default metals and light sources to the MetalList and SourceList
+# Only adds them the first time it is called, so both the GUI and the command line can call it
+def load_defaults():
+    if Metal.MetalList:
+        return
 
     # Appends default metals to the metal list
     Metal.MetalList.append(Metal("Platino", 1.01738 * math.pow(10, -18), (229, 228, 226))) #
@@ -441,15 +480,187 @@ def game_loop(ticks,count_ticks,count_collisions):
     Metal.MetalList.append(Metal("Berilio", 8.0109 * math.pow(10, -19), (139,129,135)))
     Metal.MetalList.append(Metal("Oro", 8.1711 * math.pow(10, -19), (212,175,55)))
 
+    # Appends default sources to the metal list
+    Source.SourceList.append(Source("Laser",500+16, 150+84, 60, 1, power=0.005))
+    Source.SourceList.append(Source("Lampara", 500+16, 150+54, 60, 30, min=350, power=0.5, spectrum="blackbody",
+                                    spread=12))
+    Source.SourceList.append(Source("Led", 500, 150+5, 60, 5, min=400, max=700, power=0.1, spectrum="band", width=15,
+                                    spread=8))
+    Source.SourceList.append(Source("Bombillo", 480, 150+38, 60, 18, min=450, max=650, power=1, spectrum="blackbody",
+                                    spread=15))
+    Source.SourceList.append(Source("Infrarrojo", 478, 150+40, 60, 20, min=700, power=0.2, spectrum="band", width=25,
+                                    spread=10))
+
+
+# Target number of live macro-particles in the GUI's simulation
+# Each particle stands for many real photons or electrons so the current matches the source's real photon flux
+gui_budget = 1000
+# Most photons and most electrons drawn each frame, the rest of the simulated particles are not drawn
+max_drawn = 300
+
+
+# Photons or electrons in a snapshot above which they are drawn as a density heatmap instead of a circle each
+lod_threshold = 400
+# Once drawn as a heatmap they only go back to circles below this fraction of the threshold,
+# so a count hovering around the threshold doesn't make the drawing flicker between the two
+lod_hysteresis = 0.8
+# Size in pixels of the square cells particles are counted in for a heatmap
+heatmap_cell = 8
+
+
+# Returns a transparent surface showing how many of the points x, y (arrays) are in each part of a width x height
+# area, and the position to draw it at. The points are counted in cells of heatmap_cell pixels with a 2D histogram,
+# then an image with one pixel per cell, coloured colour with an alpha that grows with the cell's count, is scaled up
+# in one go. Only the cells from the first to the last with a point in them are scaled, so a narrow band of particles
+# costs little. Returns None if no points are in the area
+def density_surface(x, y, width, height, colour):
+    columns = math.ceil(width / heatmap_cell)
+    rows = math.ceil(height / heatmap_cell)
+    column = np.floor(x / heatmap_cell).astype(np.int64)
+    row = np.floor(y / heatmap_cell).astype(np.int64)
+    # Points off screen are left out
+    inside = (column >= 0) & (column < columns) & (row >= 0) & (row < rows)
+    if not inside.any():
+        return None
+    counts = np.bincount(column[inside] * rows + row[inside], minlength=columns * rows).reshape(columns, rows)
+    used_columns = np.flatnonzero(counts.any(axis=1))
+    used_rows = np.flatnonzero(counts.any(axis=0))
+    left, right = used_columns[0], used_columns[-1] + 1
+    top, bottom = used_rows[0], used_rows[-1] + 1
+    counts = counts[left:right, top:bottom]
+    cells = pygame.Surface((right - left, bottom - top), pygame.SRCALPHA)
+    cells.fill(colour)
+    alpha = pygame.surfarray.pixels_alpha(cells)
+    # The square root keeps sparse cells visible next to dense ones
+    alpha[:] = np.where(counts > 0, 60 + 195 * np.sqrt(counts / counts.max()), 0).astype(np.uint8)
+    # The surface is locked until its pixel array is deleted
+    del alpha
+    surface = pygame.transform.smoothscale(cells, ((right - left) * heatmap_cell, (bottom - top) * heatmap_cell))
+    return surface, (left * heatmap_cell, top * heatmap_cell)
+
+
+# Class that draws the photons and electrons of engine Snapshots
+# Each particle is drawn as a circle until there are so many that circles would be an unreadable mess and slow to draw,
+# then they are drawn as a density heatmap instead. Photons and electrons switch between the two separately
+# threshold - number of photons or electrons above which they are drawn as a heatmap, lod_threshold if None
+class ParticleRenderer:
+
+    def __init__(self, threshold=None):
+        self.threshold = lod_threshold if threshold is None else threshold
+        # Most photons and most electrons drawn as circles
+        self.max_drawn = max_drawn
+        # Whether photons and electrons were drawn as heatmaps last time
+        self.photon_heatmap = False
+        self.electron_heatmap = False
+        # Colours of photons for each wavelength
+        self.colours = {}
+        # Heatmaps of the snapshot last drawn and where they go, by kind ("photons" or "electrons"),
+        # reused while the same snapshot is drawn again
+        self.frame = None
+        self.heatmaps = {}
+
+    # Returns True if count particles should be drawn as a heatmap, given whether they were last time
+    def use_heatmap(self, count, heatmap):
+        if heatmap:
+            return count >= self.threshold * lod_hysteresis
+        return count > self.threshold
+
+    # Returns the colour of photons with a wavelength in nm
+    def photon_colour(self, wavelength):
+        # Wavelengths are drawn from a spectrum, so colours are cached to the nearest nm
+        wavelength = round(wavelength)
+        if wavelength not in self.colours:
+            self.colours[wavelength] = set_light_colour(wavelength * math.pow(10, -9))
+        return self.colours[wavelength]
+
+    # Draws the heatmap of one kind of particle at co-ords x, y, building it if this snapshot's hasn't been yet
+    def draw_heatmap(self, screen, kind, x, y, colour):
+        if kind not in self.heatmaps:
+            self.heatmaps[kind] = density_surface(x, y, *screen.get_size(), colour)
+        if self.heatmaps[kind] is not None:
+            screen.blit(*self.heatmaps[kind])
+
+    # Draws the photons and electrons in an engine Snapshot, electrons are drawn in electron_colour
+    # If there are more than self.max_drawn of either drawn as circles, only an evenly spread subset of them is drawn
+    def draw(self, screen, snapshot, electron_colour):
+        if snapshot.frame != self.frame:
+            self.frame = snapshot.frame
+            self.heatmaps = {}
+        self.photon_heatmap = self.use_heatmap(snapshot.photons, self.photon_heatmap)
+        self.electron_heatmap = self.use_heatmap(snapshot.electrons, self.electron_heatmap)
+
+        if self.photon_heatmap:
+            # Coloured by the photons' median wavelength
+            self.draw_heatmap(screen, "photons", snapshot.photon_x, snapshot.photon_y,
+                              self.photon_colour(np.median(snapshot.photon_wavelength)))
+        else:
+            for i in range(0, snapshot.photons, math.ceil(snapshot.photons / self.max_drawn) or 1):
+                pygame.draw.circle(screen, self.photon_colour(snapshot.photon_wavelength[i]),
+                                   (snapshot.photon_x[i], snapshot.photon_y[i]), Photon.Radius)
+
+        if self.electron_heatmap:
+            # Black like the electrons' borders, as some metals' colours hardly show on white
+            self.draw_heatmap(screen, "electrons", snapshot.electron_x, snapshot.electron_y, black)
+        else:
+            for i in range(0, snapshot.electrons, math.ceil(snapshot.electrons / self.max_drawn) or 1):
+                draw_x = round(snapshot.electron_x[i])
+                draw_y = round(snapshot.electron_y[i])
+                # Draw inner part
+                pygame.draw.circle(screen, electron_colour, (draw_x, draw_y), Electron.Radius - 1)
+                # Draw border
+                pygame.draw.circle(screen, black, (draw_x, draw_y), Electron.Radius, 2)
+
+
+# Returns the lines of text of the profiler overlay
+# clock - the GUI's pygame Clock, governor - its quality.QualityGovernor, renderer - its ParticleRenderer
+# simulated - frames the simulation ran per second since the overlay was last updated
+def profile_lines(clock, governor, renderer, simulated):
+    lines = ["{:.1f} FPS, simulación {:.1f} fotogramas/s".format(clock.get_fps(), simulated),
+             "Dibujo: {:.1f} ms de {:.1f} ms".format(1000 * (governor.frame_time or 0),
+                                                    1000 * quality.BUDGET * governor.target),
+             "Calidad: {}/{}".format(len(quality.LEVELS) - 1 - governor.level, len(quality.LEVELS) - 1)
+             + ("" if governor.enabled else " (fija)")]
+    # What the governor has lowered to keep up
+    for name, full, value in governor.degraded():
+        if name == "hud_every":
+            lines.append("Texto cada {} fotogramas".format(value))
+        elif name == "drawn":
+            lines.append("Hasta {} partículas dibujadas".format(renderer.max_drawn))
+        elif name == "lod":
+            lines.append("Mapa de calor desde {} partículas".format(renderer.threshold))
+        elif name == "blend":
+            lines.append("Luz sin transparencia")
+    return lines
+
+
+# The main game code is run here
+# serve - None, or a dictionary of the host and port or the Unix socket path to publish live statistics on
+# and take parameter changes from, see service.StatsService
+# lod - number of photons or electrons above which they are drawn as a heatmap, see ParticleRenderer
+# governed - if True, drawing quality is lowered when frames take too long to draw, see quality.QualityGovernor
+# publisher - None, or a livestate.StatePublisher to publish every frame of the simulation in
+def game_loop(ticks, serve=None, lod=None, governed=True, publisher=None):
+    # Initialise all pygame modules before they can be used
+    pygame.init()
+    # Initialise main drawing surface
+    screen = pygame.display.set_mode((display_width, display_height))
+    # Set title of window
+    pygame.display.set_caption("Photoelectric Effect Simulator")
+    # Create clock object for timing
+    clock = pygame.time.Clock()
+
+    # Creating the loop boolean, this is false until the game exits
+    game_exit = False
+
+    # Starting value definitions
+    wavelength = 0
+    intensity = 0
+
+    # Appends default metals and sources to their lists
+    load_defaults()
+
     # Sets starting metal to the first one in the list (sodium)
     current_metal = Metal.MetalList[0]
-
-    # Appends default sources to the metal list
-    Source.SourceList.append(Source("Laser",500+16, 150+84, 60, 1))
-    Source.SourceList.append(Source("Lampara", 500+16, 150+54, 60, 30, min=350))
-    Source.SourceList.append(Source("Led", 500, 150+5, 60, 5, min=400, max=700))
-    Source.SourceList.append(Source("Bombillo", 480, 150+38, 60, 18, min=450, max=650))
-    Source.SourceList.append(Source("Infrarrojo", 478, 150+40, 60, 20, min=700))
     
     # Sets starting source to the first one in the list (lamp)
     current_source = Source.SourceList[0]
@@ -459,12 +670,6 @@ def game_loop(ticks,count_ticks,count_collisions):
     small_font = pygame.font.Font(None, 25)
 
     # Text objects used to describe the different GUI elements
-    wave_txt = my_font.render("Longitud de onda: ", 1, (0, 0, 0))
-    wave_txt2 = my_font.render("[nm]", 1, (0, 0, 0))
-    intensity_txt = my_font.render("Intensidad: ", 1, black)
-    intensity_txt2 = my_font.render("[%]", 1, black)
-    metal_txt = my_font.render("Metal: ", 1, black)
-    source_txt = my_font.render("Fuente: ", 1, black)
     stop_txt = my_font.render("Voltaje de parada: ", 1, black)
     stop_txt2 = my_font.render("[V]", 1, black)
 
@@ -491,23 +696,91 @@ def game_loop(ticks,count_ticks,count_collisions):
     # Dropdown menu creation
     metal_drop = dan_gui.DropDown(75, 78, 105, 25, Metal.MetalNames, my_font)
     source_drop = dan_gui.DropDown(379, 78, 110, 25, Source.SourceNames, my_font)
+
+    # Group for the control panel at the top of the screen
+    # The group composites its elements into one cached surface that is only redrawn when a control changes
+    controls = dan_gui.Group(0, 0, display_width, 110, my_font)
+    controls.visible = True
+    controls.add(wv_slider)
+    controls.add(int_slider)
+    controls.add(metal_drop)
+    controls.add(source_drop)
+    # Text used to describe the different controls
+    controls.add_text("Longitud de onda: ", (3, 5), black)
+    controls.add_text("[nm]", (750, 5), black)
+    controls.add_text("Intensidad: ", (3, 40), black)
+    controls.add_text("[%]", (750, 40), black)
+    controls.add_text("Metal: ", (3, 80), black)
+    controls.add_text("Fuente: ", (292, 80), black)
     
     # Adding electron speed text to screen
     speed_obj = my_font.render("Velocidad media de los fotones: 0 [m/s]", 1, (0, 0, 0))
     fotones_obj = my_font.render("Número de fotones: 0 ", 1, (0, 0, 0))
     electrones_obj = my_font.render("Número de electrones: 0 ", 1, (0, 0, 0))
     corriente_obj = my_font.render("Corriente: 0 [A]", 1, (0, 0, 0))
+    energia_obj = my_font.render("Energía cinética máxima: 0 [eV]", 1, (0, 0, 0))
+
+    # Live plots of the current over the last 20 seconds and of the kinetic energies of the electrons emitted
+    # The G key shows and hides them
+    plot_font = pygame.font.Font(None, 18)
+    current_plot = dan_gui.Plot(3, 268, 220, 46, plot_font, 20 * engine.FPS, "Corriente [A]")
+    ke_chart = dan_gui.BarChart(3, 316, 220, 42, plot_font)
+    show_plots = True
 
     # Creating surface for transparent light texture
+    # The light's alpha is drawn with it, so the surface itself is left opaque
     surf = pygame.Surface((display_width, display_height), pygame.SRCALPHA)
-    surf.set_alpha(set_light_alpha(wavelength, intensity))
 
+    # Loads every image once so that switching light source does not read from disk
+    dan_gui.assets.preload()
     # Image for the light source
-    lamp_img = pygame.image.load("img/"+current_source.name.lower()+".png")
-
+    lamp_img = dan_gui.assets.get(current_source.name.lower())
+
+    # The physics runs on its own thread, this loop only draws the latest snapshot of it
+    # so a slow frame of physics does not slow down drawing or input
+    gui_engine = engine.Engine(current_metal, current_source, wv_slider.get_pos(), int_slider.get_pos(), stop_voltage,
+                               budget=gui_budget, field=True, cone=True)
+    # Photons that miss the plate are still drawn
+    gui_engine.keep_missed = True
+    gui_engine.publisher = publisher
+    simulation = engine.EngineThread(gui_engine, ticks)
+    simulation.start()
+
+    # Parameter changes from clients of the statistics service, which the loop applies to the controls
+    # so the controls always show what is being simulated
+    remote_changes = queue.SimpleQueue()
+    stats_service = None
+    if serve is not None:
+        # Called on the service's thread, unknown names are refused before they reach the loop
+        def apply_remote(changes):
+            # The sliders would move to their nearest end, so the client would be told a value was set that wasn't
+            for name, slider in (("wavelength", wv_slider), ("intensity", int_slider),
+                                 ("stop_voltage", stop_slider)):
+                if name in changes and not slider.limits[0] <= changes[name] <= slider.limits[1]:
+                    raise ValueError(name + " must be between " + str(slider.limits[0]) + " and "
+                                     + str(slider.limits[1]))
+            if "metal" in changes:
+                changes["metal"] = find_by_name(Metal.MetalList, changes["metal"], "metal").name
+            if "source" in changes:
+                changes["source"] = find_by_name(Source.SourceList, changes["source"], "source").name
+            remote_changes.put(changes)
+        stats_service = service.StatsService(simulation.latest, apply_remote, **serve)
+        stats_service.start()
+    # The frame of the snapshot the text was last rendered for
+    last_frame = -1
+    renderer = ParticleRenderer(lod)
+    lod = renderer.threshold
+    # Lowers drawing quality when frames take too long to draw, which never changes the simulation
+    governor = quality.QualityGovernor(1 / ticks, governed)
+    # The profiler overlay is shown and hidden with F3 and its text updated twice a second
+    show_profile = False
+    profile_text = []
+    profile_updated = (time.perf_counter(), 0)
 
     # All code in this loop runs 30 times a second until the program is closed
     while not game_exit:
+        # When the frame started, to measure how long it takes to draw without the wait for the next tick
+        frame_start = time.perf_counter()
         # This gets all events pygame detects in one list
         events = pygame.event.get()
         # Gets the position as a pair of co-ords of the mouse in the current frame
@@ -530,13 +803,20 @@ def game_loop(ticks,count_ticks,count_collisions):
                     current_metal = find_metal(name)
                 if source_drop.on_click(x, y):
                     name = source_drop.data[source_drop.current_opt]
-                    lamp_img = pygame.image.load("img/"+name.lower()+".png")
+                    lamp_img = dan_gui.assets.get(name.lower())
                     current_source = find_source(name)
                 # Passes mouse co-ords onto sliders when click registered
                 wv_slider.on_click(x, y)
                 int_slider.on_click(x, y)
                 stop_slider.on_click(x, y)
 
+            # G shows or hides the plots
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_g:
+                show_plots = not show_plots
+            # F3 shows or hides the profiler overlay
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                show_profile = not show_profile
+
             # Checking for mouse unclicked
             if event.type == pygame.MOUSEBUTTONUP:
                 # Triggers the sliders' methods for when a mouse is unclicked
@@ -547,11 +827,26 @@ def game_loop(ticks,count_ticks,count_collisions):
                 
             # Checking for exit, in event of exit event, the game closes and the loop stops
             if event.type == pygame.QUIT:
+                if stats_service is not None:
+                    stats_service.stop()
+                simulation.stop()
                 pygame.quit()
                 quit()
                 # game_exit = True
 
 
+        # Changes from the statistics service move the controls as if they had been used
+        while not remote_changes.empty():
+            changes = remote_changes.get()
+            if "metal" in changes and metal_drop.select(changes["metal"]):
+                current_metal = find_metal(changes["metal"])
+            if "source" in changes and source_drop.select(changes["source"]):
+                current_source = find_source(changes["source"])
+                lamp_img = dan_gui.assets.get(current_source.name.lower())
+            for name, slider in (("wavelength", wv_slider), ("intensity", int_slider), ("stop_voltage", stop_slider)):
+                if name in changes:
+                    slider.set_pos(changes[name])
+
         # ALL CALCULATIONS BELOW HERE
         # Gets the wavelength from the slider
         wavelength = wv_slider.get_pos()
@@ -566,45 +861,55 @@ def game_loop(ticks,count_ticks,count_collisions):
         # Gets stopping voltage
         stop_voltage = stop_slider.get_pos()
 
-        # Emits a photon if needed
-        emit_photon(current_metal, current_source, intensity, wavelength)
+        # Passes the controls on to the simulation thread, the engine takes the wavelength in nanometres
+        simulation.set(metal=current_metal, source=current_source, wavelength=wv_slider.get_pos(),
+                       intensity=intensity, stop_voltage=stop_voltage)
+        # Gets the most recent state of the simulation
+        snapshot = simulation.latest()
+
+        # The governor's quality level decides how much is drawn
+        settings = governor.settings
+        renderer.max_drawn = max(1, round(max_drawn * settings["drawn"]))
+        renderer.threshold = round(lod * settings["lod"])
+        # Gets alpha (transparency) value for light
+        alpha = set_light_alpha(wavelength, intensity)
 
         # Draws white over previous frame
         screen.fill(white)
         # ALL DRAWING BELOW HERE
-        # For every photon in the PhotonList
-        for photon in Photon.PhotonList:
-            # Moves the photon's x and y co-ords
-            photon.move()
-            # #Draws the photon if the setting for drawing photons is enabled
-            photon.draw(screen)
-            # Checks if photon has hit left metal plate
-            count_collisions = photon.check_collision(left_rect, stop_voltage,count_collisions)
-        # print(count_collisions)
-
-        # Draw Electrons and calculate their average speed using their kinetic energy
-        total_ke = 0
-        for electron in Electron.ElectronList:
-            # Adds each electron's kinetic energy to the total
-            total_ke += electron.kinEnergy
-            electron.move()
-            electron.draw(screen)
-            electron.check_pos(right_rect.rect)
-        
-        fotones_obj = my_font.render(("Número de fotones: " + str(len(Photon.PhotonList))), 1, black)
-        electrones_obj = my_font.render("Número de electrones: "+ str(len(Electron.ElectronList)), 1, black)
-        # If the ElectronList is not empty
-        if len(Electron.ElectronList) == 0:
-            corriente_obj = my_font.render("Corriente: 0.0 [A]", 1, black)
-            speed_obj = my_font.render("Velocidad media de los electrones: 0 [m/s]", 1, black)
-        if len(Electron.ElectronList) > 0:
-            # Calculates average kinetic energy of all electrons
-            average_ke = total_ke / len(Electron.ElectronList)
-            # Converts kinetic energy to speed
-            speed = round(math.sqrt((2*average_ke)/Electron.Mass))
-            # Creates a pygame Text object for rendering the speed
-            speed_obj = my_font.render("Velocidad media de los electrones: " + str(speed) + " [m/s]", 1, black)
-            
+        # Without blending the light is drawn solid, in its colour mixed with the white background,
+        # behind the particles so they can still be seen
+        if not settings["blend"]:
+            mixed = tuple(round(white[i] + (channel - white[i]) * alpha / 255) for i, channel in enumerate((r, g, b)))
+            pygame.draw.polygon(screen, mixed, light_polygon(current_source))
+        # Draws the photons and electrons, electrons are the colour of the left plate
+        renderer.draw(screen, snapshot, left_rect.colour)
+
+        # Text is only rendered again when the simulation has moved on hud_every frames
+        if snapshot.frame - last_frame >= settings["hud_every"]:
+            # One sample of the current per simulated frame, including any the drawing loop skipped over
+            for _ in range(min(snapshot.frame - last_frame, current_plot.capacity)):
+                current_plot.add(snapshot.current)
+            # Only the bins up to the fastest electron are shown, so slow electrons are spread across the chart
+            used = snapshot.ke_histogram.nonzero()[0]
+            bins = max(5, used[-1] + 1 if len(used) else 0)
+            ke_chart.values = snapshot.ke_histogram[:bins]
+            ke_chart.title = "Energía cinética: 0 - {:0.1f} [eV]".format(bins * snapshot.ke_bin_width / engine.CHARGE)
+            last_frame = snapshot.frame
+            fotones_obj = my_font.render(("Número de fotones: " + str(snapshot.photons)), 1, black)
+            electrones_obj = my_font.render("Número de electrones: "+ str(snapshot.electrons), 1, black)
+            # 99% of the electrons emitted so far have less kinetic energy than this, which ignores rare outliers
+            energia_obj = my_font.render("Energía cinética máxima: " + '{:0.2f}'.format(snapshot.ke_p99 / engine.CHARGE)
+                                         + " [eV]", 1, black)
+            # If there are no electrons between the plates
+            if snapshot.electrons == 0:
+                corriente_obj = my_font.render("Corriente: 0.0 [A]", 1, black)
+                speed_obj = my_font.render("Velocidad media de los electrones: 0 [m/s]", 1, black)
+            else:
+                corriente_obj = my_font.render("Corriente: " + str('{:0.3e}'.format(snapshot.current)) + " [A]", 1, black)
+                # Creates a pygame Text object for rendering the speed
+                speed_obj = my_font.render("Velocidad media de los electrones: " + str(round(snapshot.mean_speed)) + " [m/s]", 1, black)
+
 
         # Draws background for wavelength, intensity and current metal selectors
         # pygame.draw.rect(screen, lightGrey, (0, 0, 450, 200))
@@ -621,53 +926,51 @@ def game_loop(ticks,count_ticks,count_collisions):
         left_rect.draw(screen, current_metal.colour)
         # Right rectangle
         right_rect.draw(screen, current_metal.colour)
-        # Wavelength slider prompt
-        screen.blit(wave_txt, (3, 5))
-        # Wavelength slider
-        wv_slider.draw(screen)
-        # Wavelength slider suffix
-        screen.blit(wave_txt2, (750, 5))
-        # Intensity slider prompt
-        screen.blit(intensity_txt, (3, 40))
-        # Intensity slider suffix
-        screen.blit(intensity_txt2, (750, 40))
-        # Draw intensity slider
-        int_slider.draw(screen)
+        # Wavelength and intensity sliders, metal and source drop down boxes and their prompts
+        controls.draw(screen)
         # Stopping voltage slider
         stop_slider.draw(screen)
         # Stopping voltage slider prompt
         screen.blit(stop_txt, (100, 574))
         # Stopping voltage slider suffix
         screen.blit(stop_txt2, (540, 574))
-        # Metal Text
-        screen.blit(metal_txt, (3, 80))
-        # Drop down box
-        metal_drop.draw(screen)
-        screen.blit(source_txt, (292, 80))
-        source_drop.draw(screen)
 
         # Draws light from light source to screen
-        # Gets alpha (transparency) value for light
-        alpha = set_light_alpha(wavelength, intensity)
-        # Combines colour with alpha in 1 tuple
-        light_colour = (r, g, b, alpha)
-        # Draws light to transparency enabled surface
-        pygame.draw.polygon(surf, light_colour, ((60, 400), (60, 550), (700, 380), (512, 202)))
-        # Draws transparent surface to screen
-        screen.blit(surf, (0, 0))
+        if settings["blend"]:
+            # Combines colour with alpha in 1 tuple
+            light_colour = (r, g, b, alpha)
+            # Draws light to transparency enabled surface
+            surf.fill((0, 0, 0, 0))
+            pygame.draw.polygon(surf, light_colour, light_polygon(current_source))
+            # Draws transparent surface to screen
+            screen.blit(surf, (0, 0))
         # Draws light source image
         screen.blit(lamp_img, (500, 150))
-        # Makes the program wait so that the main loop only runs 30 times a second
-        clock.tick(ticks)
-        count_ticks+=1
-        if count_ticks%ticks==0 and len(Electron.ElectronList)!=0:
-            corriente_obj = my_font.render("Corriente: " + str('{:0.3e}'.format(count_collisions* 1.6 * math.pow(10,-19))) + " [A]", 1, black)
-            count_collisions=0
-            count_ticks=0
         screen.blit(corriente_obj, (3, 210))
-
+        screen.blit(energia_obj, (3, 240))
+        if show_plots:
+            current_plot.draw(screen)
+            ke_chart.draw(screen)
+        if show_profile:
+            now = time.perf_counter()
+            if now - profile_updated[0] >= 0.5 or not profile_text:
+                simulated = (snapshot.frame - profile_updated[1]) / (now - profile_updated[0])
+                profile_text = [small_font.render(line, 1, black)
+                                for line in profile_lines(clock, governor, renderer, simulated)]
+                profile_updated = (now, snapshot.frame)
+            width = max(line.get_width() for line in profile_text) + 10
+            height = 22 * len(profile_text) + 6
+            pygame.draw.rect(screen, lightGrey, (display_width - width - 3, 115, width, height))
+            pygame.draw.rect(screen, black, (display_width - width - 3, 115, width, height), 1)
+            for i, line in enumerate(profile_text):
+                screen.blit(line, (display_width - width + 2, 119 + 22 * i))
+
+        # The time this frame took to draw, including the text, plots and overlay
+        governor.update(time.perf_counter() - frame_start)
         # Updates the display
         pygame.display.update()
+        # Makes the program wait so that the main loop only runs 30 times a second
+        clock.tick(ticks)
 
         
         
@@ -675,7 +978,617 @@ def game_loop(ticks,count_ticks,count_collisions):
 
 
 
-# Calls the main loop subroutine to start
+# Size of the window of the split screen comparison and the height of its control panel
+compare_width = 1200
+compare_height = 760
+compare_controls = 80
+
+
+# Draws one scene of the comparison onto scene_surface, which is the size of the normal window
+# config is the scene's config, snapshot its latest Snapshot, text the rendered lines of its counters and renderer
+# the scene's ParticleRenderer
+def draw_scene(scene_surface, light, config, snapshot, text, renderer):
+    scene_surface.fill(white)
+    metal = find_metal(config["metal"])
+    # Light from the source, drawn with its alpha onto a transparent layer
+    light.fill((0, 0, 0, 0))
+    r, g, b = set_light_colour(config["wavelength"] * math.pow(10, -9))
+    alpha = set_light_alpha(config["wavelength"] * math.pow(10, -9), config["intensity"])
+    pygame.draw.polygon(light, (r, g, b, alpha), light_polygon(find_source(config["source"])))
+    scene_surface.blit(light, (0, 0))
+    scene_surface.blit(dan_gui.assets.get(config["source"].lower()), (500, 150))
+    renderer.draw(scene_surface, snapshot, metal.colour)
+    MetalRect(10, 360, 50, 210, metal.colour).draw(scene_surface, metal.colour)
+    MetalRect(740, 360, 50, 210, metal.colour).draw(scene_surface, metal.colour)
+    for i, line in enumerate(text):
+        scene_surface.blit(line, (10, 10 + 45 * i))
+
+
+# Runs several scenes side by side in a split screen, eg. to compare two metals or two sources
+# configs is a list of configs made by make_config, one per scene. They all run in one engine.SceneEngine,
+# and the wavelength, intensity and stopping voltage sliders change every scene at once
+# lod - number of photons or electrons above which they are drawn as a heatmap, see ParticleRenderer
+def compare_loop(configs, ticks, lod=None):
+    pygame.init()
+    screen = pygame.display.set_mode((compare_width, compare_height))
+    pygame.display.set_caption("Photoelectric Effect Simulator")
+    clock = pygame.time.Clock()
+    load_defaults()
+    dan_gui.assets.preload()
+
+    my_font = pygame.font.Font(None, 32)
+    small_font = pygame.font.Font(None, 25)
+    # Scenes are drawn at full size then scaled down, so their text is drawn large
+    big_font = pygame.font.Font(None, 48)
+
+    wv_slider = dan_gui.Slider(235, 5, 470, 25, small_font, (100, 850))
+    int_slider = dan_gui.Slider(235, 40, 470, 25, small_font, (0, 100), starting_pos=0.5)
+    stop_slider = dan_gui.Slider(990, 5, 150, 25, small_font, (-3, 3), 0.5, 1)
+    sliders = (wv_slider, int_slider, stop_slider)
+    controls = dan_gui.Group(0, 0, compare_width, compare_controls, my_font)
+    controls.visible = True
+    for slider in sliders:
+        controls.add(slider)
+    controls.add_text("Longitud de onda: ", (3, 5), black)
+    controls.add_text("[nm]", (715, 5), black)
+    controls.add_text("Intensidad: ", (3, 40), black)
+    controls.add_text("[%]", (715, 40), black)
+    controls.add_text("Voltaje de parada: ", (770, 5), black)
+    controls.add_text("[V]", (1150, 5), black)
+
+    # Grid of panes as close to square as possible, each scene keeps the proportions of the normal window
+    columns = math.ceil(math.sqrt(len(configs)))
+    rows = math.ceil(len(configs) / columns)
+    pane_width = compare_width // columns
+    pane_height = (compare_height - compare_controls) // rows
+    scale = min(pane_width / display_width, pane_height / display_height)
+    scaled_size = (int(display_width * scale), int(display_height * scale))
+    scene_surface = pygame.Surface((display_width, display_height))
+    light = pygame.Surface((display_width, display_height), pygame.SRCALPHA)
+
+    configs = [dict(config, budget=gui_budget, field=True, cone=True) for config in configs]
+    scenes = engine.SceneEngine.from_configs(configs)
+    for scene in scenes.scenes:
+        scene.keep_missed = True
+    simulation = engine.EngineThread(scenes, ticks)
+    simulation.start()
+    # Each scene switches between circles and heatmaps on its own
+    renderers = [ParticleRenderer(lod) for _ in configs]
+    # Rendered counters of each scene and the frame they were rendered for
+    texts = [[] for _ in configs]
+    last_frames = [-1] * len(configs)
+
+    game_exit = False
+    while not game_exit:
+        events = pygame.event.get()
+        x, y = pygame.mouse.get_pos()
+        for slider in sliders:
+            slider.update(x)
+        for event in events:
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                for slider in sliders:
+                    slider.on_click(x, y)
+            if event.type == pygame.MOUSEBUTTONUP:
+                for slider in sliders:
+                    slider.on_unclick()
+            if event.type == pygame.QUIT:
+                game_exit = True
+
+        for config in configs:
+            config.update(wavelength=wv_slider.get_pos(), intensity=int_slider.get_pos(),
+                          stop_voltage=stop_slider.get_pos())
+        simulation.set(wavelength=wv_slider.get_pos(), intensity=int_slider.get_pos(),
+                       stop_voltage=stop_slider.get_pos())
+        snapshots = simulation.latest()
+
+        screen.fill(white)
+        controls.draw(screen)
+        for i, (config, snapshot) in enumerate(zip(configs, snapshots)):
+            if snapshot.frame != last_frames[i]:
+                last_frames[i] = snapshot.frame
+                texts[i] = [big_font.render(config["metal"] + " - " + config["source"], 1, black),
+                            big_font.render("Electrones: " + str(snapshot.electrons), 1, black),
+                            big_font.render("Corriente: " + '{:0.3e}'.format(snapshot.current) + " [A]", 1, black),
+                            big_font.render("Velocidad media: " + str(round(snapshot.mean_speed)) + " [m/s]", 1,
+                                            black)]
+            draw_scene(scene_surface, light, config, snapshot, texts[i], renderers[i])
+            # Each scene is centred in its pane
+            pane_x = (i % columns) * pane_width + (pane_width - scaled_size[0]) // 2
+            pane_y = compare_controls + (i // columns) * pane_height + (pane_height - scaled_size[1]) // 2
+            screen.blit(pygame.transform.smoothscale(scene_surface, scaled_size), (pane_x, pane_y))
+            pygame.draw.rect(screen, grey, (pane_x, pane_y, scaled_size[0], scaled_size[1]), 1)
+
+        clock.tick(ticks)
+        pygame.display.update()
+
+    simulation.stop()
+    pygame.quit()
+
+
+# Renders the simulation in config to frames offscreen, as fast as it can run, instead of showing it in a window
+# The frames are written by export.FrameWriter, to a folder of PNGs or a raw RGB video stream (fmt "png" or "raw")
+# lod - number of photons or electrons above which they are drawn as a heatmap, see ParticleRenderer
+# Returns the number of frames, the seconds it took and the seconds spent waiting for the writers
+def export_loop(config, output, fmt="png", threads=4, queue_size=32, lod=None):
+    # The dummy video driver needs no display, so exports also run on servers
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pygame.init()
+    pygame.display.set_mode((display_width, display_height))
+    load_defaults()
+    dan_gui.assets.preload()
+    my_font = pygame.font.Font(None, 32)
+    frame_surface = pygame.Surface((display_width, display_height))
+    light = pygame.Surface((display_width, display_height), pygame.SRCALPHA)
+    renderer = ParticleRenderer(lod)
+    # Looks like the GUI, with a budget of particles unless the config has its own, the electric field and the
+    # source's cone
+    simulation = engine.Engine.from_config(dict(config, budget=config.get("budget") or gui_budget, field=True,
+                                                cone=True))
+    simulation.keep_missed = True
+    title = my_font.render(config["metal"] + " - " + config["source"] + " - " + str(config["wavelength"]) + " [nm] - "
+                           + str(config["intensity"]) + " [%] - " + str(config["stop_voltage"]) + " [V]", 1, black)
+    frames = round(config["duration"] * engine.FPS)
+    writer = export.FrameWriter(output, display_width, display_height, fmt, threads, queue_size)
+    start = time.perf_counter()
+    try:
+        for frame in range(frames):
+            simulation.step()
+            snapshot = simulation.snapshot()
+            text = [title,
+                    my_font.render("Número de electrones: " + str(snapshot.electrons), 1, black),
+                    my_font.render("Corriente: " + '{:0.3e}'.format(snapshot.current) + " [A]", 1, black),
+                    my_font.render("Velocidad media de los electrones: " + str(round(snapshot.mean_speed))
+                                   + " [m/s]", 1, black)]
+            draw_scene(frame_surface, light, config, snapshot, text, renderer)
+            writer.put(frame, pygame.image.tobytes(frame_surface, "RGB"))
+    finally:
+        writer.close()
+        pygame.quit()
+    return frames, time.perf_counter() - start, writer.waited
+
+
+# Exit codes of the command line interface, so job schedulers can tell what went wrong
+EXIT_OK = 0
+# A simulation raised an error
+EXIT_FAILURE = 1
+# The arguments were invalid (argparse also exits with 2)
+EXIT_USAGE = 2
+# The results could not be written
+EXIT_OUTPUT = 3
+# The run was interrupted with Ctrl+C
+EXIT_INTERRUPTED = 130
+
+
+# Given a list of objects with a name attribute, finds the one called name ignoring case
+# Raises ValueError if there is none
+def find_by_name(items, name, kind):
+    for item in items:
+        if item.name.lower() == name.lower():
+            return item
+    raise ValueError("Unknown " + kind + " '" + name + "', choose from: " + ", ".join(i.name for i in items))
+
+
+# Creates the config dictionary describing one headless simulation, which is run by engine.simulate
+# The config holds everything the engine needs, so it can be sent to other processes
+# wavelength is in nanometres, intensity from 0 to 100, stop_voltage in volts and duration in seconds
+# shards is the number of processes the particles of the simulation are split between
+# budget is the target number of live macro-particles, None for one simulated photon per real photon emitted
+# at the GUI's fixed rate
+# field is True to simulate the electric field between the plates, cone to emit photons in the source's cone
+# and qmc to draw emission from quasi-random sequences, see engine.Engine
+def make_config(metal_name, source_name, wavelength, intensity, stop_voltage, duration, seed=None, shards=1,
+                budget=None, monochromatic=False, field=False, cone=False, qmc=False):
+    load_defaults()
+    metal = find_by_name(Metal.MetalList, metal_name, "metal")
+    source = find_by_name(Source.SourceList, source_name, "source")
+    return {
+        "metal": metal.name,
+        "work_func": metal.work_func,
+        "source": source.name,
+        "source_params": {"x": source.x, "y": source.y, "mean": source.mean, "std": source.std,
+                          "min": source.min, "max": source.max, "power": source.power,
+                          "spectrum": source.spectrum, "width": source.width, "direction": source.direction,
+                          "spread": source.spread},
+        "wavelength": wavelength,
+        "intensity": intensity,
+        "stop_voltage": stop_voltage,
+        "duration": duration,
+        "seed": seed,
+        "shards": shards,
+        "budget": budget,
+        "monochromatic": monochromatic,
+        "field": field,
+        "cone": cone,
+        "qmc": qmc,
+    }
+
+
+# Turns command line values into a list of numbers
+# Each value is either a number or an inclusive range written start:stop:step, eg. 300:600:50
+def parse_values(values):
+    numbers = []
+    for value in values:
+        parts = value.split(":")
+        try:
+            if len(parts) == 1:
+                numbers.append(float(parts[0]))
+            elif len(parts) == 3:
+                start, stop, step = (float(p) for p in parts)
+                if step <= 0:
+                    raise ValueError
+                # The small tolerance stops floating point error dropping the last value
+                for i in range(math.floor((stop - start) / step + 1e-9) + 1):
+                    numbers.append(round(start + i * step, 10))
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError("Invalid value '" + value + "', expected a number or start:stop:step")
+    return numbers
+
+
+# Runs function (a single simulation by default) on each of a list of configs, in parallel if workers is more than 1
+# workers = 0 uses every core
+def run_configs(configs, workers, function=engine.simulate):
+    if workers == 0:
+        workers = os.cpu_count()
+    if workers <= 1 or len(configs) <= 1:
+        return [function(config) for config in configs]
+    with multiprocessing.Pool(min(workers, len(configs))) as pool:
+        return pool.map(function, configs)
+
+
+# Writes a list of result dictionaries to output (a file name, or standard output if None or "-")
+# fmt is either "json" or "csv", single is True to write one JSON object instead of a list
+def write_results(results, fmt, output, single=False):
+    if fmt == "json":
+        text = json.dumps(results[0] if single else results, indent=2) + "\n"
+    else:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(results[0].keys()), lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(results)
+        text = buffer.getvalue()
+    if output is None or output == "-":
+        sys.stdout.write(text)
+    else:
+        with open(output, "w", newline="") as f:
+            f.write(text)
+
+
+# Creates the parser for the command line arguments
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m photoelectric",
+                                     description="Photoelectric effect simulator. Starts the GUI if no command is given.")
+    commands = parser.add_subparsers(dest="command")
+    # Argument shared by the commands that draw the simulation
+    drawing = argparse.ArgumentParser(add_help=False)
+    drawing.add_argument("--lod", type=int, default=lod_threshold, metavar="N",
+                         help="draw photons or electrons as a density heatmap once there are more than N of them "
+                              "(default " + str(lod_threshold) + ")")
+    gui = commands.add_parser("gui", parents=[drawing], help="start the interactive simulator (default)")
+    gui.add_argument("--full-quality", action="store_true",
+                     help="always draw at full quality, instead of drawing less when frames take too long")
+    gui.add_argument("--serve", type=int, default=None, metavar="PORT",
+                     help="publish live statistics and take parameter changes as JSON lines on this localhost port")
+    gui.add_argument("--socket", default=None, metavar="PATH",
+                     help="the same on a Unix socket instead of a port")
+    gui.add_argument("--share", default=None, metavar="NAME",
+                     help="publish the particles and totals of every frame in the shared memory block NAME, "
+                          "see livestate.py")
+
+    # Arguments shared by run and sweep
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--duration", type=float, default=10, help="simulated seconds per run (default 10)")
+    common.add_argument("--seed", type=int, default=None, help="random seed, every run of a sweep uses the same one")
+    common.add_argument("--workers", type=int, default=1, help="worker processes, 0 for one per core (default 1)")
+    common.add_argument("--shards", type=int, default=1,
+                        help="split the particles of each run between this many processes (default 1)")
+    common.add_argument("--budget", type=int, default=None,
+                        help="target number of live particles, each standing for many real ones so the current "
+                             "matches the source's real photon flux (default: one photon at a time, as in the GUI)")
+    common.add_argument("--monochromatic", action="store_true",
+                        help="emit only the given wavelength instead of the source's spectrum")
+    common.add_argument("--field", action="store_true",
+                        help="slow electrons down in the electric field between the plates, so the current is the "
+                             "electrons that reach the other plate (default: take the voltage off each electron's "
+                             "energy when it is emitted, as in the original model)")
+    common.add_argument("--cone", action="store_true",
+                        help="emit photons in directions spread across the source's cone (default: every photon "
+                             "moves the same way, as in the original model)")
+    common.add_argument("--qmc", action="store_true",
+                        help="draw photon positions, directions, wavelengths and emission times from scrambled "
+                             "quasi-random sequences instead of random numbers, so results need fewer photons for "
+                             "the same precision")
+    common.add_argument("--no-cache", action="store_true",
+                        help="always run the simulations instead of reusing results cached in data/cache")
+    common.add_argument("--format", choices=("json", "csv"), default="json", help="output format (default json)")
+    common.add_argument("-o", "--output", default=None, help="output file (default standard output)")
+
+    run = commands.add_parser("run", parents=[common], help="run one headless simulation")
+    run.add_argument("--metal", default="Platino")
+    run.add_argument("--source", default="Laser")
+    run.add_argument("--wavelength", type=float, default=475, help="wavelength in nm (default 475)")
+    run.add_argument("--intensity", type=float, default=50, help="intensity from 0 to 100 (default 50)")
+    run.add_argument("--stop-voltage", type=float, default=0, help="stopping voltage in V (default 0)")
+    run.add_argument("--checkpoint", default=None, help="file to save the state of the simulation to as it runs")
+    run.add_argument("--checkpoint-every", type=float, default=10,
+                     help="simulated seconds between checkpoints (default 10)")
+    run.add_argument("--resume", action="store_true",
+                     help="carry on from the checkpoint file if it exists, which must be of the same run")
+    run.add_argument("--target-error", type=float, default=None,
+                     help="keep simulating until the confidence interval of --quantity is within this fraction of "
+                          "it, eg. 0.01, or until --max-seconds or --duration (then the most simulated seconds) run out")
+    run.add_argument("--absolute-error", type=float, default=None,
+                     help="the same as --target-error, but a half width in the quantity's units (A or m/s)")
+    run.add_argument("--quantity", choices=tuple(analysis.PRECISE_QUANTITIES), default="current",
+                     help="quantity --target-error and --absolute-error apply to: the current, or the mean speed of "
+                          "the electrons emitted (default current)")
+    run.add_argument("--confidence", type=float, default=0.95, help="confidence of the interval (default 0.95)")
+    run.add_argument("--chunk", type=float, default=1,
+                     help="simulated seconds between updates of the interval (default 1)")
+    run.add_argument("--max-seconds", type=float, default=60,
+                     help="most seconds of real time to spend reaching the target error (default 60)")
+    run.add_argument("--share", default=None, metavar="NAME",
+                     help="publish the particles and totals of every frame in the shared memory block NAME as it "
+                          "runs, see livestate.py")
+
+    sweep = commands.add_parser("sweep", parents=[common],
+                                help="run every combination of the given parameters. "
+                                     "Numbers can be given as start:stop:step ranges")
+    sweep.add_argument("--metal", nargs="+", default=["Platino"])
+    sweep.add_argument("--source", nargs="+", default=["Laser"])
+    sweep.add_argument("--wavelength", nargs="+", default=["475"])
+    sweep.add_argument("--intensity", nargs="+", default=["50"])
+    sweep.add_argument("--stop-voltage", nargs="+", default=["0"])
+    sweep.add_argument("--adaptive", choices=("wavelength", "intensity", "stop-voltage"), default=None,
+                       help="sweep this parameter from the lowest to the highest of its values, adding runs only "
+                            "where the current changes sharply or is uncertain, for every combination of the others")
+    sweep.add_argument("--runs", type=int, default=50, help="most runs of each adaptive sweep (default 50)")
+    sweep.add_argument("--initial", type=int, default=5, help="evenly spaced runs an adaptive sweep starts with "
+                                                              "(default 5)")
+    sweep.add_argument("--threshold", type=float, default=0.05,
+                       help="fraction of the current's range a gap must change by to be split (default 0.05)")
+    sweep.add_argument("--min-step", type=float, default=0, help="smallest gap an adaptive sweep splits (default 0)")
+    sweep.add_argument("--coordinate", type=int, default=None, metavar="PORT",
+                       help="hand the runs out to workers started with the worker command, listening on this port, "
+                            "instead of running them here")
+    sweep.add_argument("--bind", default="127.0.0.1",
+                       help="address --coordinate listens on, 0.0.0.0 for workers on other computers "
+                            "(default 127.0.0.1)")
+    sweep.add_argument("--chunk-size", type=int, default=1, help="runs handed to a worker at a time (default 1)")
+    sweep.add_argument("--timeout", type=float, default=distributed.TIMEOUT,
+                       help="seconds a busy worker may go without a message before its runs are handed to another "
+                            "(default " + str(distributed.TIMEOUT) + ")")
+
+    worker = commands.add_parser("worker", help="run the simulations of a sweep --coordinate until it is done")
+    worker.add_argument("--connect", required=True, metavar="HOST:PORT", help="address of the coordinator")
+    worker.add_argument("--workers", type=int, default=1,
+                        help="processes to run the simulations with, 0 for one per core (default 1)")
+
+    stop = commands.add_parser("stop", parents=[common],
+                               help="find the stopping voltage of every combination of the given parameters "
+                                    "by bisection. --duration is the longest probe run (default 30 here)")
+    stop.add_argument("--metal", nargs="+", default=None, help="metals (default all)")
+    stop.add_argument("--source", nargs="+", default=["Laser"])
+    stop.add_argument("--wavelength", nargs="+", default=["200:500:25"])
+    stop.add_argument("--intensity", type=float, default=100, help="intensity from 0 to 100 (default 100)")
+    stop.add_argument("--tolerance", type=float, default=0.01, help="width in V of the final bracket (default 0.01)")
+    stop.add_argument("--max-voltage", type=float, default=3,
+                      help="upper end of the first bracket in V, doubled while there is a current (default 3)")
+    stop.set_defaults(duration=30)
+
+    export_parser = commands.add_parser("export", parents=[drawing], help="render a run offscreen, faster than real time, "
+                                                       "to numbered PNG files or a raw RGB video stream")
+    export_parser.add_argument("--metal", default="Sodio")
+    export_parser.add_argument("--source", default="Laser")
+    export_parser.add_argument("--wavelength", type=float, default=400, help="wavelength in nm (default 400)")
+    export_parser.add_argument("--intensity", type=float, default=80, help="intensity from 0 to 100 (default 80)")
+    export_parser.add_argument("--stop-voltage", type=float, default=0, help="stopping voltage in V (default 0)")
+    export_parser.add_argument("--duration", type=float, default=10, help="seconds of video (default 10)")
+    export_parser.add_argument("--seed", type=int, default=None, help="random seed")
+    export_parser.add_argument("--budget", type=int, default=None,
+                               help="target number of live particles (default " + str(gui_budget) + ", as in the GUI)")
+    export_parser.add_argument("--monochromatic", action="store_true",
+                               help="emit only the given wavelength instead of the source's spectrum")
+    export_parser.add_argument("--format", choices=("png", "raw"), default="png",
+                               help="a folder of PNG files or one raw RGB stream, eg. for ffmpeg -f rawvideo "
+                                    "-pix_fmt rgb24 -s 800x600 -r 30 -i FILE (default png)")
+    export_parser.add_argument("-o", "--output", required=True, help="folder for PNGs, or file (- for standard "
+                                                                     "output) for a raw stream")
+    export_parser.add_argument("--threads", type=int, default=4, help="PNG writer threads (default 4)")
+    export_parser.add_argument("--queue", type=int, default=32,
+                               help="most frames waiting to be written before rendering waits (default 32)")
+
+    compare = commands.add_parser("compare", parents=[drawing], help="show every combination of the given metals and sources "
+                                                  "side by side (at most 8)")
+    compare.add_argument("--metal", nargs="+", default=["Sodio"])
+    compare.add_argument("--source", nargs="+", default=["Laser"])
+    return parser
+
+
+# Entry point of the program, argv is the list of command line arguments
+# Returns the exit code
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if getattr(args, "lod", 0) < 0:
+        print("Error: --lod cannot be negative", file=sys.stderr)
+        return EXIT_USAGE
+    if args.command is None or args.command == "gui":
+        serve = None
+        if getattr(args, "socket", None) is not None:
+            serve = {"path": args.socket}
+        elif getattr(args, "serve", None) is not None:
+            serve = {"port": args.serve}
+        publisher = None
+        try:
+            if getattr(args, "share", None) is not None:
+                publisher = livestate.StatePublisher(args.share)
+        except OSError as error:
+            print("Error: could not create the shared memory block: " + str(error), file=sys.stderr)
+            return EXIT_FAILURE
+        try:
+            game_loop(30, serve, getattr(args, "lod", None), not getattr(args, "full_quality", False), publisher)
+        except OSError as error:
+            print("Error: could not start the statistics service: " + str(error), file=sys.stderr)
+            return EXIT_FAILURE
+        finally:
+            if publisher is not None:
+                publisher.close()
+        return EXIT_OK
+    if args.command == "compare":
+        try:
+            configs = [make_config(m, s, 475, 50, 0, 0) for m, s in itertools.product(args.metal, args.source)]
+            if len(configs) > 8:
+                raise ValueError("at most 8 scenes can be compared")
+        except ValueError as error:
+            print("Error: " + str(error), file=sys.stderr)
+            return EXIT_USAGE
+        compare_loop(configs, 30, args.lod)
+        return EXIT_OK
+    if args.command == "export":
+        try:
+            config = make_config(args.metal, args.source, args.wavelength, args.intensity, args.stop_voltage,
+                                 args.duration, args.seed, 1, args.budget, args.monochromatic)
+            if args.duration <= 0 or args.threads < 1 or args.queue < 1:
+                raise ValueError("--duration, --threads and --queue must be positive")
+        except ValueError as error:
+            print("Error: " + str(error), file=sys.stderr)
+            return EXIT_USAGE
+        try:
+            frames, seconds, waited = export_loop(config, args.output, args.format, args.threads, args.queue,
+                                                    args.lod)
+        except KeyboardInterrupt:
+            return EXIT_INTERRUPTED
+        except OSError as error:
+            print("Error: could not write frames: " + str(error), file=sys.stderr)
+            return EXIT_OUTPUT
+        print("{} frames in {:.1f} s, {:.1f}x real time, {:.1f} s waiting for writers".format(
+            frames, seconds, frames / engine.FPS / seconds, waited), file=sys.stderr)
+        return EXIT_OK
+    if args.command == "worker":
+        host, _, port = args.connect.rpartition(":")
+        if not host or not port.isdigit() or args.workers < 0:
+            print("Error: --connect must be HOST:PORT and --workers cannot be negative", file=sys.stderr)
+            return EXIT_USAGE
+        try:
+            chunks = distributed.work(host, int(port), args.workers)
+        except KeyboardInterrupt:
+            return EXIT_INTERRUPTED
+        except OSError as error:
+            print("Error: lost the coordinator: " + str(error), file=sys.stderr)
+            return EXIT_FAILURE
+        print(str(chunks) + " chunks simulated", file=sys.stderr)
+        return EXIT_OK
+
+    try:
+        # Runs with a seed are reproducible, so their results are cached unless --no-cache is given
+        function = engine.simulate if args.no_cache else cache.simulate
+        if args.command == "run":
+            configs = [make_config(args.metal, args.source, args.wavelength, args.intensity, args.stop_voltage,
+                                   args.duration, args.seed, args.shards, args.budget, args.monochromatic,
+                                   args.field, args.cone, args.qmc)]
+            if args.checkpoint is not None:
+                if args.shards > 1 or args.checkpoint_every <= 0:
+                    raise ValueError("--checkpoint cannot be used with --shards and --checkpoint-every must be positive")
+                function = functools.partial(checkpoint.simulate, path=args.checkpoint,
+                                             interval=args.checkpoint_every, resume=args.resume)
+            elif args.resume:
+                raise ValueError("--resume needs --checkpoint")
+            if args.target_error is not None or args.absolute_error is not None:
+                if args.checkpoint is not None:
+                    raise ValueError("--target-error and --absolute-error cannot be used with --checkpoint")
+                if (args.target_error is not None and args.target_error <= 0
+                        or args.absolute_error is not None and args.absolute_error <= 0
+                        or not 0 < args.confidence < 1 or args.chunk <= 0 or args.max_seconds <= 0):
+                    raise ValueError("--target-error, --absolute-error, --chunk and --max-seconds must be positive "
+                                     "and --confidence between 0 and 1")
+                # How long it takes depends on the computer, so these results are never cached
+                function = functools.partial(analysis.precise, quantity=args.quantity,
+                                             relative_error=args.target_error, absolute_error=args.absolute_error,
+                                             confidence=args.confidence, chunk=args.chunk,
+                                             max_seconds=args.max_seconds, max_duration=args.duration)
+            if args.share is not None:
+                if args.checkpoint is not None or args.target_error is not None or args.absolute_error is not None:
+                    raise ValueError("--share cannot be used with --checkpoint, --target-error or --absolute-error")
+                # What is published depends on the run actually happening, so it is never cached
+                function = functools.partial(livestate.simulate, name=args.share)
+        elif args.command == "stop":
+            load_defaults()
+            metals = args.metal or [metal.name for metal in Metal.MetalList]
+            configs = [make_config(m, s, w, args.intensity, 0, args.duration, args.seed, 1, args.budget,
+                                   args.monochromatic, args.field, args.cone, args.qmc)
+                       for m, s, w in itertools.product(metals, args.source, parse_values(args.wavelength))]
+            if args.tolerance <= 0 or args.max_voltage <= 0:
+                raise ValueError("--tolerance and --max-voltage must be positive")
+            function = functools.partial(analysis.stopping_voltage, tolerance=args.tolerance, high=args.max_voltage,
+                                         max_duration=args.duration)
+        else:
+            values = {"wavelength": parse_values(args.wavelength), "intensity": parse_values(args.intensity),
+                      "stop_voltage": parse_values(args.stop_voltage)}
+            # An adaptive sweep makes one config for each combination of the other parameters,
+            # the swept parameter is filled in by analysis.refine
+            if args.adaptive is not None:
+                adaptive = args.adaptive.replace("-", "_")
+                low, high = min(values[adaptive]), max(values[adaptive])
+                if low == high or args.runs < 2 or args.initial < 2:
+                    raise ValueError("--adaptive needs a range of values, and --runs and --initial must be at least 2")
+                values[adaptive] = [low]
+            configs = [make_config(m, s, w, i, v, args.duration, args.seed, args.shards, args.budget,
+                                   args.monochromatic, args.field, args.cone, args.qmc)
+                       for m, s, w, i, v in itertools.product(args.metal, args.source, values["wavelength"],
+                                                              values["intensity"], values["stop_voltage"])]
+        if args.duration <= 0 or args.workers < 0 or args.shards < 1 or (args.budget is not None and args.budget < 1):
+            raise ValueError("--duration, --shards and --budget must be positive and --workers cannot be negative")
+        # Worker processes cannot start processes of their own
+        if args.shards > 1 and args.workers != 1 and len(configs) > 1:
+            raise ValueError("--shards cannot be combined with more than one worker")
+        coordinator = None
+        if getattr(args, "coordinate", None) is not None:
+            if args.chunk_size < 1 or args.timeout <= distributed.HEARTBEAT:
+                raise ValueError("--chunk-size must be positive and --timeout more than "
+                                 + str(distributed.HEARTBEAT) + " s")
+            coordinator = distributed.Coordinator(args.bind, args.coordinate, args.chunk_size, args.timeout,
+                                                  not args.no_cache, lambda text: print(text, file=sys.stderr))
+    except ValueError as error:
+        print("Error: " + str(error), file=sys.stderr)
+        return EXIT_USAGE
+
+    # Workers choose whether to use their cache themselves, so the coordinator only sends them the configs
+    if coordinator is not None:
+        try:
+            coordinator.start()
+        except OSError as error:
+            print("Error: could not listen for workers: " + str(error), file=sys.stderr)
+            return EXIT_FAILURE
+        runner = lambda f, c: coordinator.map(c)
+    else:
+        runner = lambda f, c: run_configs(c, args.workers, f)
+    try:
+        if args.command == "sweep" and args.adaptive is not None:
+            results = []
+            for config in configs:
+                results += analysis.refine(config, adaptive, low, high, args.runs, args.initial, args.threshold,
+                                           args.min_step, runner, function)
+        else:
+            results = runner(function, configs)
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    except Exception as error:
+        print("Error: simulation failed: " + repr(error), file=sys.stderr)
+        return EXIT_FAILURE
+    finally:
+        if coordinator is not None:
+            coordinator.stop()
+
+    try:
+        write_results(results, args.format, args.output, single=args.command == "run")
+    except OSError as error:
+        print("Error: could not write results: " + str(error), file=sys.stderr)
+        return EXIT_OUTPUT
+    return EXIT_OK
+
+
+# Calls the main subroutine to start
+# With no arguments the GUI starts, see python -m photoelectric --help for headless runs
 if __name__ == "__main__":
-    ticks=30
-    game_loop(ticks,count_ticks=0,count_collisions=0)
+    sys.exit(main())
@@ -0,0 +1,77 @@
+# qmc.py draws quasi-random numbers for the engine's emission. Quasi-random (low discrepancy) points cover the space
+# they are drawn from much more evenly than random ones, so averages over them, such as the fraction of photons that
+# hit the plate or have enough energy to free an electron, converge faster than the 1 / sqrt(N) of random sampling
+# The points are scrambled with random numbers, so different seeds still give independent runs whose spread can be
+# used as the error of a result
+import math
+import numpy as np
+
+# Bases of the dimensions of a Halton sequence, the first prime numbers
+PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29)
+# Digits of a number between 0 and 1 needed for full double precision in base 2, which is enough in every base
+DIGITS = 53
+# Numbers returned are between these, so they can go through logarithms without reaching 0 or 1
+LOWEST = 2.0 ** -53
+HIGHEST = 1 - 2.0 ** -53
+
+
+# Class for a Halton sequence scrambled with random digit permutations
+# The n-th point's number in each dimension is n written in that dimension's base with its digits mirrored after the
+# point (the radical inverse), with each digit put through a random permutation of the digits of the base
+# dimensions - numbers in each point, at most len(PRIMES)
+# rng - numpy Generator the permutations are drawn from
+# permutations and index - the state of a sequence to carry on from instead, see checkpoint.py
+class ScrambledHalton:
+
+    def __init__(self, dimensions=1, rng=None, permutations=None, index=0):
+        if permutations is None:
+            bases = PRIMES[:dimensions]
+            # permutations[d, i] is the permutation of the i-th digit after the point in dimension d
+            permutations = np.zeros((dimensions, DIGITS, max(bases)), np.int64)
+            for d, base in enumerate(bases):
+                for i in range(DIGITS):
+                    permutations[d, i, :base] = rng.permutation(base)
+        self.permutations = permutations
+        self.bases = PRIMES[:len(permutations)]
+        # Number of points drawn so far
+        self.index = index
+        # tails[d, i] is what the digits from the i-th on add when they are all 0, which they are after the last
+        # digit of the index, but which the permutations still turn into other digits
+        self.tails = np.zeros((len(self.bases), DIGITS + 1))
+        for d, base in enumerate(self.bases):
+            for i in range(DIGITS - 1, -1, -1):
+                self.tails[d, i] = self.tails[d, i + 1] + permutations[d, i, 0] * float(base) ** -(i + 1)
+
+    # Returns the next n points as an array of n rows, one column per dimension
+    def points(self, n):
+        indices = np.arange(self.index, self.index + n, dtype=np.int64)
+        self.index += n
+        points = np.empty((n, len(self.bases)))
+        for d, base in enumerate(self.bases):
+            value = np.zeros(n)
+            left = indices.copy()
+            digit = 0
+            while left.any():
+                value += self.permutations[d, digit][left % base] * float(base) ** -(digit + 1)
+                left //= base
+                digit += 1
+            # Every index has run out of digits, the rest are 0 before being permuted
+            points[:, d] = value + self.tails[d, digit]
+        return np.clip(points, LOWEST, HIGHEST)
+
+
+# Returns the smallest whole number k with a probability of at least u that a Poisson distributed number with mean
+# rate is k or less, which turns a uniform number u into a Poisson distributed one
+# Only the probabilities within 12 standard deviations of the mean are added up
+def poisson_quantile(rate, u):
+    if rate <= 0:
+        return 0
+    spread = 12 * math.sqrt(rate) + 10
+    low = max(0, math.floor(rate - spread))
+    high = math.ceil(rate + spread)
+    # Each probability is the one before multiplied by rate / k, added up as logarithms so they never underflow
+    log_first = low * math.log(rate) - rate - math.lgamma(low + 1)
+    ks = np.arange(low + 1, high + 1)
+    log_probabilities = log_first + np.concatenate(([0.0], np.cumsum(np.log(rate / ks))))
+    cumulative = np.cumsum(np.exp(log_probabilities))
+    return low + int(min(np.searchsorted(cumulative, u), len(cumulative) - 1))
@@ -0,0 +1,87 @@
+# quality.py keeps the GUI's frame rate up on slow computers by drawing less, never by simulating differently
+# The governor measures how long each frame takes to draw, not counting the time spent waiting for the next tick,
+# and moves between quality levels to keep that under the frame time. Each level gives up one more thing than the
+# one before, starting with what is hardest to notice
+# Levels only change after the frame time has been over (or well under) the target for a while, and not again
+# straight after a change, so a single slow frame or the cost of the change itself doesn't make it swing back and forth
+
+# Settings of each quality level, from full quality down
+# hud_every - simulation frames between redraws of the text and plots
+# drawn - fraction of the most particles drawn as circles (see photoelectric.max_drawn) that are drawn
+# lod - fraction of the particle count at which particles are drawn as heatmaps instead (see ParticleRenderer)
+# blend - whether the light is blended over the scene, or drawn solid behind the particles
+LEVELS = (
+    {"hud_every": 1, "drawn": 1.0, "lod": 1.0, "blend": True},
+    {"hud_every": 3, "drawn": 1.0, "lod": 1.0, "blend": True},
+    {"hud_every": 3, "drawn": 0.5, "lod": 1.0, "blend": True},
+    {"hud_every": 3, "drawn": 0.5, "lod": 0.5, "blend": True},
+    {"hud_every": 3, "drawn": 0.5, "lod": 0.5, "blend": False},
+    {"hud_every": 6, "drawn": 0.25, "lod": 0.25, "blend": False},
+)
+# Fraction of the frame time the drawing may take before quality is lowered, leaving room for the simulation thread
+# and the operating system
+BUDGET = 0.8
+# Quality is only raised again once frames take less than this fraction of the budget
+RAISE_BELOW = 0.5
+# Frames the average must stay over the budget before quality is lowered, and under it before it is raised
+LOWER_AFTER = 15
+RAISE_AFTER = 90
+# Frames after a change during which the frame time isn't judged
+SETTLE = 30
+# Weight of the newest frame in the moving average of the frame time
+SMOOTHING = 0.1
+
+
+# Class that chooses a quality level from the time frames take to draw
+# target - seconds per frame the GUI aims for, eg. 1 / 30
+# enabled - if False the level always stays at full quality, but frame times are still measured
+class QualityGovernor:
+
+    def __init__(self, target, enabled=True):
+        self.target = target
+        self.enabled = enabled
+        self.level = 0
+        # Moving average of the seconds frames take to draw, None until the first frame
+        self.frame_time = None
+        # Frames in a row over or under the budget, and frames left until the level can change again
+        self.over = 0
+        self.under = 0
+        self.settling = SETTLE
+
+    # The settings of the current level, see LEVELS
+    @property
+    def settings(self):
+        return LEVELS[self.level]
+
+    # Records the seconds the last frame took to draw and changes level if needed
+    # Returns True if the level changed
+    def update(self, busy):
+        if self.frame_time is None:
+            self.frame_time = busy
+        else:
+            self.frame_time += SMOOTHING * (busy - self.frame_time)
+        if not self.enabled:
+            return False
+        if self.settling > 0:
+            self.settling -= 1
+            return False
+        budget = BUDGET * self.target
+        self.over = self.over + 1 if self.frame_time > budget else 0
+        self.under = self.under + 1 if self.frame_time < RAISE_BELOW * budget else 0
+        if self.over >= LOWER_AFTER and self.level < len(LEVELS) - 1:
+            self.change(self.level + 1)
+            return True
+        if self.under >= RAISE_AFTER and self.level > 0:
+            self.change(self.level - 1)
+            return True
+        return False
+
+    def change(self, level):
+        self.level = level
+        self.over = 0
+        self.under = 0
+        self.settling = SETTLE
+
+    # Returns a list of the settings the current level has lowered, as (name, full value, current value)
+    def degraded(self):
+        return [(name, value, self.settings[name]) for name, value in LEVELS[0].items() if self.settings[name] != value]
@@ -0,0 +1,246 @@
+# service.py publishes the live statistics of a running simulation to other programs on the same computer and
+# takes parameter changes from them, so lab dashboards can follow the GUI without reading its window
+# It runs an asyncio server on its own thread, bound to localhost or a Unix socket. Messages are JSON objects,
+# one per line:
+# client to server - {"rate": 5} for at most 5 updates a second,
+# {"set": {"metal": "Cobre", "source": "Laser", "wavelength": 400, "intensity": 80, "stop_voltage": 0.5}}
+# with any of those parameters
+# server to client - {"type": "stats", ...} updates, see statistics, and {"type": "ok"} or
+# {"type": "error", "message": ...} replies to each message
+# Every client only ever has the newest update waiting for it, so a slow client misses updates instead of
+# holding up the simulation or the other clients
+import asyncio
+import collections
+import json
+import math
+import threading
+import time
+
+# Most updates a second sent to a client, and how many it gets a second until it asks for another rate
+MAX_RATE = 30
+DEFAULT_RATE = 5
+# Most messages a client may send a second, over a few seconds, before they are refused
+COMMAND_RATE = 10
+COMMAND_BURST = 20
+# Most replies waiting to be sent to a client, older ones are dropped
+MAX_REPLIES = 16
+# Longest message line in bytes a client may send
+MAX_LINE = 4096
+# Parameters clients can change and their types
+PARAMETERS = {"metal": str, "source": str, "wavelength": float, "intensity": float, "stop_voltage": float}
+
+
+# Returns the dictionary of statistics published for an engine Snapshot
+def statistics(snapshot):
+    return {
+        "type": "stats",
+        "frame": snapshot.frame,
+        "current": snapshot.current,
+        "photons": snapshot.photons,
+        "electrons": snapshot.electrons,
+        "mean_speed": snapshot.mean_speed,
+        "ke_p99": snapshot.ke_p99,
+    }
+
+
+# Returns the changes in a "set" message with their values converted to the right types
+# Raises ValueError if the message has unknown parameters or values of the wrong type
+def parse_changes(changes):
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError("set needs an object of parameters")
+    parsed = {}
+    for name, value in changes.items():
+        if name not in PARAMETERS:
+            raise ValueError("unknown parameter '" + str(name) + "', choose from: " + ", ".join(PARAMETERS))
+        kind = PARAMETERS[name]
+        # bool is a kind of int in Python, but true is not a wavelength
+        if kind is float and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(name + " must be a number")
+        # JSON from Python allows NaN and Infinity, which no control can show
+        if kind is float and not math.isfinite(value):
+            raise ValueError(name + " must be a finite number")
+        if kind is str and not isinstance(value, str):
+            raise ValueError(name + " must be a string")
+        parsed[name] = kind(value)
+    return parsed
+
+
+# One connected client
+class Client:
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.interval = 1 / DEFAULT_RATE
+        # When the last update was offered to it
+        self.last_offered = 0.0
+        # The newest update not yet sent, and the replies not yet sent
+        self.update = None
+        self.replies = collections.deque(maxlen=MAX_REPLIES)
+        # Set when there is something to send
+        self.ready = asyncio.Event()
+        # Updates replaced by a newer one before they were sent
+        self.dropped = 0
+        # Token bucket for the messages the client sends
+        self.tokens = COMMAND_BURST
+        self.last_message = time.monotonic()
+
+    # Makes update the next one sent, replacing one that hasn't been sent yet
+    def offer(self, update):
+        if self.update is not None:
+            self.dropped += 1
+        self.update = update
+        self.ready.set()
+
+    def reply(self, message):
+        self.replies.append(message)
+        self.ready.set()
+
+    # Returns False if the client has sent too many messages recently
+    def allow_message(self):
+        now = time.monotonic()
+        self.tokens = min(COMMAND_BURST, self.tokens + (now - self.last_message) * COMMAND_RATE)
+        self.last_message = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+# Class that serves the statistics of a simulation
+# latest - function returning the newest engine Snapshot, eg. EngineThread.latest
+# apply - function called with a dictionary of parameter changes from a client, see parse_changes. It is called on
+# the service's thread and may raise ValueError to refuse them
+# host and port - where to listen for TCP connections, or path - a Unix socket to listen on instead
+class StatsService:
+
+    def __init__(self, latest, apply, host="127.0.0.1", port=8765, path=None):
+        self.latest = latest
+        self.apply = apply
+        self.host = host
+        self.port = port
+        self.path = path
+        self.clients = set()
+        self.loop = None
+        self.thread = None
+        self.stopping = None
+        self.started = threading.Event()
+        self.error = None
+
+    # Starts the service on a background thread and waits until it is listening
+    # Raises OSError if it can't listen, eg. because the port is already used
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except OSError as error:
+            self.error = error
+            self.started.set()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        if self.path is not None:
+            server = await asyncio.start_unix_server(self.handle, self.path, limit=MAX_LINE)
+        else:
+            server = await asyncio.start_server(self.handle, self.host, self.port, limit=MAX_LINE)
+            # Port 0 picks a free port
+            self.port = server.sockets[0].getsockname()[1]
+        self.started.set()
+        publisher = asyncio.create_task(self.publish())
+        async with server:
+            await self.stopping.wait()
+            publisher.cancel()
+            for client in list(self.clients):
+                client.writer.close()
+
+    # Offers the newest statistics to every client that is due an update, as often as the fastest rate allows
+    async def publish(self):
+        last_frame = None
+        while True:
+            await asyncio.sleep(1 / MAX_RATE)
+            snapshot = self.latest()
+            if snapshot.frame == last_frame or not self.clients:
+                continue
+            last_frame = snapshot.frame
+            update = statistics(snapshot)
+            now = time.monotonic()
+            for client in self.clients:
+                if now - client.last_offered >= client.interval:
+                    client.last_offered = now
+                    client.offer(dict(update, dropped=client.dropped))
+
+    # Sends a client's replies and updates as they come, only this task waits if the client reads slowly
+    @staticmethod
+    async def send(client):
+        while True:
+            await client.ready.wait()
+            client.ready.clear()
+            lines = [json.dumps(reply) + "\n" for reply in client.replies]
+            client.replies.clear()
+            if client.update is not None:
+                lines.append(json.dumps(client.update) + "\n")
+                client.update = None
+            client.writer.write("".join(lines).encode())
+            await client.writer.drain()
+
+    # Runs for as long as a client is connected, reading its messages
+    async def handle(self, reader, writer):
+        client = Client(writer)
+        self.clients.add(client)
+        sender = asyncio.create_task(StatsService.send(client))
+        try:
+            while not sender.done():
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    client.reply({"type": "error", "message": "message longer than " + str(MAX_LINE) + " bytes"})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                if not client.allow_message():
+                    client.reply({"type": "error", "message": "too many messages"})
+                    continue
+                client.reply(self.answer(client, line))
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            sender.cancel()
+            # Replies that haven't been sent yet, such as why the client is being disconnected, are sent before closing
+            try:
+                writer.write("".join(json.dumps(reply) + "\n" for reply in client.replies).encode())
+                await asyncio.wait_for(writer.drain(), 1)
+            except (ConnectionError, asyncio.TimeoutError):
+                pass
+            writer.close()
+
+    # Carries out one message from a client and returns the reply
+    def answer(self, client, line):
+        try:
+            message = json.loads(line)
+            if not isinstance(message, dict):
+                raise ValueError("messages must be JSON objects")
+            if "rate" in message:
+                rate = message["rate"]
+                if isinstance(rate, bool) or not isinstance(rate, (int, float)) or not 0 < rate <= MAX_RATE:
+                    raise ValueError("rate must be a number above 0 and at most " + str(MAX_RATE))
+                client.interval = 1 / rate
+            if "set" in message:
+                self.apply(parse_changes(message["set"]))
+        except ValueError as error:
+            return {"type": "error", "message": str(error)}
+        return {"type": "ok"}
+
+    # Stops the service and disconnects every client, can be called from any thread
+    def stop(self):
+        if self.loop is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+            self.thread.join()
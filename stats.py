@@ -0,0 +1,183 @@
+# stats.py keeps statistics of the electrons in a simulation as they are created and removed
+# Every update costs the same however many electrons there are, so nothing has to loop over all of them each frame
+# Values can be weighted, a weight being the number of real electrons a macro-particle stands for
+import math
+import numpy as np
+
+
+# Class that keeps the weighted count, mean, variance, minimum and maximum of every value added to it
+# Uses Welford's method, with batches combined by Chan's formula so a whole frame's values are added at once
+class RunningStats:
+
+    def __init__(self):
+        self.weight = 0.0
+        self.mean = 0.0
+        # Sum of weighted squared differences from the mean
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    # Adds a batch of values with their weights
+    def add(self, values, weights):
+        batch_weight = float(weights.sum())
+        if batch_weight <= 0:
+            return
+        batch_mean = float(np.dot(values, weights)) / batch_weight
+        batch_m2 = float(np.dot(weights, (values - batch_mean) ** 2))
+        self.combine(batch_weight, batch_mean, batch_m2)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    # Adds the statistics of another set of values, eg. from another shard
+    def merge(self, other):
+        if other.weight > 0:
+            self.combine(other.weight, other.mean, other.m2)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+
+    def combine(self, weight, mean, m2):
+        total = self.weight + weight
+        delta = mean - self.mean
+        self.mean += delta * weight / total
+        self.m2 += m2 + delta * delta * self.weight * weight / total
+        self.weight = total
+
+    @property
+    def variance(self):
+        if self.weight <= 0:
+            return 0.0
+        return self.m2 / self.weight
+
+    @property
+    def std(self):
+        return math.sqrt(max(self.variance, 0.0))
+
+
+# Class that keeps weighted sums of the values currently alive, which values can be added to and removed from
+class LiveSums:
+
+    def __init__(self):
+        self.weight = 0.0
+        self.total = 0.0
+
+    def add(self, values, weights):
+        self.weight += float(weights.sum())
+        self.total += float(np.dot(values, weights))
+
+    def remove(self, values, weights):
+        self.weight -= float(weights.sum())
+        self.total -= float(np.dot(values, weights))
+        # Rounding errors could otherwise leave a tiny negative total once everything is removed
+        if self.weight <= 0:
+            self.weight = 0.0
+            self.total = 0.0
+
+    def merge(self, other):
+        self.weight += other.weight
+        self.total += other.total
+
+    @property
+    def mean(self):
+        if self.weight <= 0:
+            return 0.0
+        return self.total / self.weight
+
+
+# Class that counts weighted values in equal width bins between low and high
+# Values outside the range are counted in the first or last bin
+class Histogram:
+
+    def __init__(self, low, high, bins):
+        self.low = low
+        self.high = high
+        self.counts = np.zeros(bins)
+
+    def add(self, values, weights):
+        bins = len(self.counts)
+        index = ((values - self.low) * (bins / (self.high - self.low))).astype(np.int64)
+        self.counts += np.bincount(np.clip(index, 0, bins - 1), weights, bins)
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    # Returns the edges of the bins, one more than there are bins
+    def edges(self):
+        return np.linspace(self.low, self.high, len(self.counts) + 1)
+
+
+# Class that estimates quantiles of positive values in fixed memory, in the same way as DDSketch
+# Values go into logarithmic buckets, so any quantile is returned within a relative error of accuracy
+# low and high are the smallest and largest values kept apart, values outside them go in the end buckets
+class QuantileSketch:
+
+    def __init__(self, low, high, accuracy=0.01):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.offset = math.floor(math.log(low) / self.log_gamma)
+        self.counts = np.zeros(math.ceil(math.log(high) / self.log_gamma) - self.offset + 1)
+
+    def add(self, values, weights):
+        keep = values > 0
+        index = np.ceil(np.log(values[keep]) / self.log_gamma).astype(np.int64) - self.offset
+        bins = len(self.counts)
+        self.counts += np.bincount(np.clip(index, 0, bins - 1), weights[keep], bins)
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    # Returns the estimated value below which a fraction q of the weight lies, or 0 if nothing has been added
+    def quantile(self, q):
+        total = self.counts.sum()
+        if total <= 0:
+            return 0.0
+        bucket = min(int(np.searchsorted(np.cumsum(self.counts), q * total)), len(self.counts) - 1)
+        # Middle of the bucket, which is at most accuracy away from every value in it
+        return 2 * self.gamma ** (bucket + self.offset) / (self.gamma + 1)
+
+
+# Class that keeps every statistic of a simulation's electrons, updated when electrons are created or removed
+# ke_range and speed_range are the ranges of kinetic energy in J and speed in m/s the histograms cover
+class ElectronStats:
+
+    def __init__(self, ke_range=(0, 8e-19), speed_range=(0, 1.5e6), bins=50):
+        # Every electron ever created
+        self.ke = RunningStats()
+        self.speed = RunningStats()
+        self.ke_histogram = Histogram(*ke_range, bins)
+        self.speed_histogram = Histogram(*speed_range, bins)
+        # Kinetic energies from about 0.0006 eV to 600 eV
+        self.ke_sketch = QuantileSketch(1e-22, 1e-16)
+        # Only the electrons between the plates
+        self.live_ke = LiveSums()
+
+    # Called with the kinetic energies in J, speeds in m/s and weights of newly created electrons
+    def created(self, ke, speed, weights):
+        if len(ke) == 0:
+            return
+        self.ke.add(ke, weights)
+        self.speed.add(speed, weights)
+        self.ke_histogram.add(ke, weights)
+        self.speed_histogram.add(speed, weights)
+        self.ke_sketch.add(ke, weights)
+        self.live_ke.add(ke, weights)
+
+    # Called with the kinetic energies and weights of electrons that have been removed
+    def removed(self, ke, weights):
+        if len(ke) > 0:
+            self.live_ke.remove(ke, weights)
+
+    # Adds another engine's statistics to these ones
+    def merge(self, other):
+        for name in ("ke", "speed", "ke_histogram", "speed_histogram", "ke_sketch", "live_ke"):
+            getattr(self, name).merge(getattr(other, name))
+
+    # Returns a flat dictionary of the statistics, kinetic energies in J and speeds in m/s
+    def summary(self):
+        return {
+            "ke_mean": self.ke.mean,
+            "ke_std": self.ke.std,
+            "ke_median": self.ke_sketch.quantile(0.5),
+            "ke_p99": self.ke_sketch.quantile(0.99),
+            "ke_max": self.ke.max if self.ke.weight > 0 else 0.0,
+            "speed_std": self.speed.std,
+        }